@@ -0,0 +1,813 @@
+#!/usr/bin/env python3
+"""
+Benchmark script for HBIU University Backend
+Measures the hot paths of the API in-process (no HTTP server needed)
+
+Usage:
+    python3 benchmark.py                 # run every benchmark
+    python3 benchmark.py entity-lookup   # run a single benchmark
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from datetime import timedelta
+
+import main
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+
+
+def fill_collection(entity: str, size: int) -> None:
+    """Populate an entity collection through the storage engine, bypassing the routes"""
+    main.storage.clear(entity)
+    for i in range(1, size + 1):
+        main.storage.insert(entity, {
+            "id": i,
+            "userId": i % 5000,
+            "actorId": i % 5000,  # same values as userId, but never indexed
+            "action": "login",
+            "created_at": f"2024-01-01T00:00:{i % 60:02d}+00:00",
+        })
+
+
+def per_op_us(elapsed: float, ops: int) -> float:
+    return elapsed / ops * 1_000_000
+
+
+def local_request(ip: str = "127.0.0.1"):
+    """Minimal request object for calling routes that read the client address"""
+    from starlette.requests import Request
+    return Request({"type": "http", "method": "POST", "path": "/", "headers": [], "client": (ip, 0)})
+
+
+async def bench_entity_lookup(ops: int = 2_000) -> None:
+    """Single-record get/update/delete latency as the collection grows"""
+    print("📊 Single-record entity routes (AuditLog)")
+    print(f"   {'records':>10} {'get µs':>10} {'update µs':>10} {'delete µs':>10}")
+
+    for size in SIZES:
+        fill_collection("AuditLog", size)
+        ids = random.sample(range(1, size + 1), min(ops, size))
+
+        start = time.perf_counter()
+        for entity_id in ids:
+            await main.get_entity("AuditLog", entity_id)
+        get_us = per_op_us(time.perf_counter() - start, len(ids))
+
+        start = time.perf_counter()
+        for entity_id in ids:
+            await main.update_entity("AuditLog", entity_id, {"action": "logout"})
+        update_us = per_op_us(time.perf_counter() - start, len(ids))
+
+        start = time.perf_counter()
+        for entity_id in ids:
+            await main.delete_entity("AuditLog", entity_id)
+        delete_us = per_op_us(time.perf_counter() - start, len(ids))
+
+        print(f"   {size:>10,} {get_us:>10.1f} {update_us:>10.1f} {delete_us:>10.1f}")
+
+    main.storage.clear("AuditLog")
+
+
+async def bench_entity_filter(ops: int = 200) -> None:
+    """Equality filter through the userId index versus a full scan on actorId"""
+    print("📊 Entity filter on AuditLog.userId (5,000 distinct users)")
+    print(f"   {'records':>10} {'indexed µs':>12} {'scan µs':>12}")
+
+    threshold = main.ENTITY_AUTO_INDEX_THRESHOLD
+    for size in SIZES:
+        fill_collection("AuditLog", size)
+        user_ids = [random.randrange(5000) for _ in range(ops)]
+
+        start = time.perf_counter()
+        for user_id in user_ids:
+            await main.filter_entities("AuditLog", {"userId": user_id}, limit=20)
+        indexed_us = per_op_us(time.perf_counter() - start, ops)
+
+        # actorId holds the same values; stop it being indexed to measure the scan path
+        main.ENTITY_AUTO_INDEX_THRESHOLD = 0
+        scan_ops = max(1, ops * 1_000 // size)
+        start = time.perf_counter()
+        for user_id in user_ids[:scan_ops]:
+            await main.filter_entities("AuditLog", {"actorId": user_id}, limit=20)
+        scan_us = per_op_us(time.perf_counter() - start, scan_ops)
+        main.ENTITY_AUTO_INDEX_THRESHOLD = threshold
+
+        print(f"   {size:>10,} {indexed_us:>12.1f} {scan_us:>12.1f}")
+
+    main.storage.clear("AuditLog")
+    print(f"   index stats: {main.storage.index_stats}")
+
+
+async def bench_entity_insert(total: int = 100_000, chunk: int = 10_000) -> None:
+    """Sequential create_entity throughput while the collection grows"""
+    print(f"📊 {total:,} sequential creates (Notification)")
+    print(f"   {'records':>10} {'creates/s':>12} {'µs/create':>10}")
+
+    main.storage.clear("Notification")
+    overall = time.perf_counter()
+    for done in range(0, total, chunk):
+        start = time.perf_counter()
+        for i in range(chunk):
+            await main.create_entity("Notification", {"userId": i % 5000, "message": "Assignment graded"})
+        elapsed = time.perf_counter() - start
+        print(f"   {done + chunk:>10,} {chunk / elapsed:>12,.0f} {per_op_us(elapsed, chunk):>10.1f}")
+
+    elapsed = time.perf_counter() - overall
+    print(f"   total: {elapsed:.2f}s ({total / elapsed:,.0f} creates/s)")
+    main.storage.clear("Notification")
+
+
+async def bench_entity_pagination(ops: int = 200) -> None:
+    """Newest-20 first page and the page after it, as the collection grows"""
+    print("📊 list_entities newest 20 (AuditLog, sort=-created_at)")
+    print(f"   {'records':>10} {'first page µs':>14} {'next page µs':>14}")
+
+    for size in SIZES:
+        fill_collection("AuditLog", size)
+        await main.list_entities("AuditLog", limit=20)  # builds the ordered index once
+
+        start = time.perf_counter()
+        for _ in range(ops):
+            page = await main.list_entities("AuditLog", limit=20)
+        first_us = per_op_us(time.perf_counter() - start, ops)
+
+        cursor = page["next_cursor"]
+        start = time.perf_counter()
+        for _ in range(ops):
+            await main.list_entities("AuditLog", limit=20, after=cursor)
+        next_us = per_op_us(time.perf_counter() - start, ops)
+
+        print(f"   {size:>10,} {first_us:>14.1f} {next_us:>14.1f}")
+
+    main.storage.clear("AuditLog")
+
+
+async def bench_entity_sort(ops: int = 100) -> None:
+    """Top 20 Pages by a declared sort field (order) versus an undeclared one (title)"""
+    print("📊 list_entities sort=order (indexed) vs sort=title (partial sort)")
+    print(f"   {'records':>10} {'order µs':>12} {'title µs':>12}")
+
+    for size in SIZES[:3]:
+        main.storage.clear("Page")
+        for i in range(1, size + 1):
+            main.storage.insert("Page", {"id": i, "order": random.randrange(size), "title": f"Page {i}"})
+
+        timings = []
+        for sort in ("order", "title"):
+            await main.list_entities("Page", sort=sort, limit=20)
+            start = time.perf_counter()
+            for _ in range(ops):
+                await main.list_entities("Page", sort=sort, limit=20)
+            timings.append(per_op_us(time.perf_counter() - start, ops))
+
+        print(f"   {size:>10,} {timings[0]:>12.1f} {timings[1]:>12.1f}")
+
+    main.storage.clear("Page")
+
+
+async def bench_entity_bulk(size: int = 10_000) -> None:
+    """Single-item HTTP requests versus one bulk request per operation"""
+    from fastapi.testclient import TestClient
+
+    print(f"📊 {size:,} Submissions over HTTP: one request per record vs one bulk request (seconds)")
+    client = TestClient(main.app)
+    records = [{"assignmentId": i % 40, "studentId": i % 3000, "status": "submitted"} for i in range(size)]
+
+    main.storage.clear("Submission")
+    start = time.perf_counter()
+    for record in records:
+        client.post("/api/entities/Submission", json=record)
+    single_create = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(1, size + 1):
+        client.put(f"/api/entities/Submission/{i}", json={"status": "graded"})
+    single_update = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(1, size + 1):
+        client.delete(f"/api/entities/Submission/{i}")
+    single_delete = time.perf_counter() - start
+
+    main.storage.clear("Submission")
+    start = time.perf_counter()
+    client.post("/api/entities/Submission/bulk", json={"create": records})
+    bulk_create = time.perf_counter() - start
+    start = time.perf_counter()
+    client.post("/api/entities/Submission/bulk", json={"update": [{"id": i, "status": "graded"} for i in range(1, size + 1)]})
+    bulk_update = time.perf_counter() - start
+    start = time.perf_counter()
+    client.post("/api/entities/Submission/bulk", json={"delete": list(range(1, size + 1))})
+    bulk_delete = time.perf_counter() - start
+
+    timings = {
+        "create": (single_create, bulk_create),
+        "update": (single_update, bulk_update),
+        "delete": (single_delete, bulk_delete),
+    }
+    print(f"   {'operation':<10} {'single':>10} {'bulk':>10} {'speedup':>8}")
+    for operation, (single, bulk) in timings.items():
+        print(f"   {operation:<10} {single:>10.3f} {bulk:>10.3f} {single / bulk:>7.1f}x")
+
+    main.storage.clear("Submission")
+
+
+async def bench_entity_export(size: int = 100_000) -> None:
+    """Peak memory of the streaming export versus list_entities with a huge limit"""
+    import json
+
+    print(f"📊 Exporting {size:,} AuditLog records (peak Python memory)")
+    fill_collection("AuditLog", size)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    exported = sum(len(chunk) for chunk in main.export_ndjson(main.storage.scan("AuditLog")))
+    stream_time = time.perf_counter() - start
+    stream_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    response = json.dumps(await main.list_entities("AuditLog", limit=size))
+    list_time = time.perf_counter() - start
+    list_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    print(f"   {'method':<22} {'seconds':>8} {'peak MB':>9} {'output MB':>10}")
+    print(f"   {'export (ndjson)':<22} {stream_time:>8.2f} {stream_peak / 1e6:>9.1f} {exported / 1e6:>10.1f}")
+    print(f"   {'list_entities':<22} {list_time:>8.2f} {list_peak / 1e6:>9.1f} {len(response) / 1e6:>10.1f}")
+
+    main.storage.clear("AuditLog")
+
+
+def audit_record(i: int) -> dict:
+    return {
+        "userId": i % 5000,
+        "action": "login",
+        "created_at": f"2024-01-01T00:00:{i % 60:02d}+00:00",
+    }
+
+
+def directory_mb(path: str) -> float:
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)) / 1e6
+
+
+async def bench_write_log(size: int = 1_000_000, fsync_each: int = 2_000) -> None:
+    """Insert overhead of the memory engine's write log, and cold start from log or snapshot"""
+    print(f"📊 Memory engine write log, {size:,} AuditLog records")
+
+    def timed_inserts(engine, count: int) -> float:
+        start = time.perf_counter()
+        for i in range(count):
+            engine.insert("AuditLog", audit_record(i))
+        return time.perf_counter() - start
+
+    print(f"   {'writes':<32} {'records':>9} {'µs/insert':>10}")
+    elapsed = timed_inserts(main.MemoryStorageEngine(), size)
+    print(f"   {'no log':<32} {size:>9,} {per_op_us(elapsed, size):>10.2f}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = main.LoggedMemoryStorageEngine(os.path.join(tmp, "each"), fsync_ms=0, snapshot_every=0)
+        elapsed = timed_inserts(engine, fsync_each)
+        engine.close()
+        print(f"   {'log, fsync every write':<32} {fsync_each:>9,} {per_op_us(elapsed, fsync_each):>10.2f}")
+
+        directory = os.path.join(tmp, "batched")
+        engine = main.LoggedMemoryStorageEngine(directory, fsync_ms=100, snapshot_every=0)
+        elapsed = timed_inserts(engine, size)
+        engine.close()
+        print(f"   {'log, fsync every 100 ms':<32} {size:>9,} {per_op_us(elapsed, size):>10.2f}")
+
+        print(f"\n   {'cold start':<32} {'disk MB':>9} {'seconds':>10}")
+        start = time.perf_counter()
+        engine = main.LoggedMemoryStorageEngine(directory, fsync_ms=100, snapshot_every=0)
+        elapsed = time.perf_counter() - start
+        assert engine.count("AuditLog") == size
+        print(f"   {'replay log':<32} {directory_mb(directory):>9.1f} {elapsed:>10.2f}")
+
+        start = time.perf_counter()
+        engine.compact()
+        compact_time = time.perf_counter() - start
+        engine.close()
+
+        start = time.perf_counter()
+        engine = main.LoggedMemoryStorageEngine(directory, fsync_ms=100, snapshot_every=0)
+        elapsed = time.perf_counter() - start
+        assert engine.count("AuditLog") == size
+        engine.close()
+        print(f"   {'load snapshot':<32} {directory_mb(directory):>9.1f} {elapsed:>10.2f}")
+        print(f"   (snapshot written in {compact_time:.2f}s)")
+
+
+async def bench_user_directory(size: int = 500_000, ops: int = 2_000) -> None:
+    """Username/email lookups and token resolution against a large user directory"""
+    from fastapi.security import HTTPAuthorizationCredentials
+
+    print(f"📊 User directory, {size:,} users")
+    main.storage.clear(main.USERS_COLLECTION)
+    for i in range(1, size + 1):
+        main.storage.insert(main.USERS_COLLECTION, main.with_directory_keys({
+            "id": i,
+            "username": f"User{i}",
+            "email": f"User{i}@hbiu.edu",
+            "password": "x",
+            "role": "student",
+            "created_at": "2024-01-01T00:00:00+00:00",
+        }))
+    picks = random.sample(range(1, size + 1), ops)
+
+    def linear_lookup(username: str):
+        # What every lookup cost before the directory indexes
+        wanted = username.casefold()
+        return next((u for u in main.storage.scan(main.USERS_COLLECTION) if u["username"].casefold() == wanted), None)
+
+    print(f"   {'lookup':<28} {'µs/op':>10}")
+    start = time.perf_counter()
+    for i in picks:
+        assert main.get_user_by_username(f"user{i}")["id"] == i
+    print(f"   {'username (indexed)':<28} {per_op_us(time.perf_counter() - start, ops):>10.1f}")
+
+    start = time.perf_counter()
+    for i in picks:
+        assert main.get_user_by_email(f"USER{i}@HBIU.EDU")["id"] == i
+    print(f"   {'email (indexed)':<28} {per_op_us(time.perf_counter() - start, ops):>10.1f}")
+
+    tokens = [main.create_access_token({"sub": f"User{i}"}, timedelta(minutes=5)) for i in picks]
+    start = time.perf_counter()
+    for token in tokens:
+        main.get_current_user(HTTPAuthorizationCredentials(scheme="Bearer", credentials=token))
+    print(f"   {'token resolution':<28} {per_op_us(time.perf_counter() - start, ops):>10.1f}")
+
+    scans = picks[:20]
+    start = time.perf_counter()
+    for i in scans:
+        assert linear_lookup(f"user{i}")["id"] == i
+    print(f"   {'username (linear scan)':<28} {per_op_us(time.perf_counter() - start, len(scans)):>10.1f}")
+
+    main.storage.clear(main.USERS_COLLECTION)
+    main.seed_storage(main.storage)
+
+
+async def bench_token_cache(tokens: int = 500, rounds: int = 20) -> None:
+    """get_current_user with and without the verified-token cache"""
+    from fastapi.security import HTTPAuthorizationCredentials
+
+    print(f"📊 Token resolution, {tokens} tokens x {rounds} requests each")
+    credentials = [
+        HTTPAuthorizationCredentials(
+            scheme="Bearer",
+            credentials=main.create_access_token({"sub": "student1", "n": i}, timedelta(minutes=5)),
+        )
+        for i in range(tokens)
+    ]
+
+    original = main.token_cache
+    print(f"   {'cache':<12} {'µs/request':>11} {'hit rate':>9}")
+    try:
+        for label, size in (("disabled", 0), ("enabled", main.TOKEN_CACHE_SIZE)):
+            main.token_cache = main.TokenCache(size)
+            start = time.perf_counter()
+            for _ in range(rounds):
+                for credential in credentials:
+                    main.get_current_user(credential)
+            elapsed = time.perf_counter() - start
+            hit_rate = main.token_cache.metrics()["hit_rate"] or 0.0
+            print(f"   {label:<12} {per_op_us(elapsed, tokens * rounds):>11.2f} {hit_rate:>9.1%}")
+    finally:
+        main.token_cache = original
+
+
+async def bench_token_refresh(ops: int = 20) -> None:
+    """Renewing a session by password login versus the refresh-token grant"""
+    print(f"📊 Session renewal, {ops} renewals each")
+
+    # Measure the grants themselves, not the login rate limits
+    original = main.auth_rate_limiter
+    main.auth_rate_limiter = main.RateLimiter(main.MemoryRateLimitBackend(), {})
+    try:
+        start = time.perf_counter()
+        for _ in range(ops):
+            tokens = await main.login(main.UserLogin(username="student1", password="student123"), local_request())
+        login_ms = (time.perf_counter() - start) / ops * 1000
+    finally:
+        main.auth_rate_limiter = original
+
+    refresh_token = tokens["refresh_token"]
+    start = time.perf_counter()
+    for _ in range(ops):
+        tokens = await main.refresh_access_token(main.RefreshRequest(refresh_token=refresh_token))
+        refresh_token = tokens["refresh_token"]
+    refresh_ms = (time.perf_counter() - start) / ops * 1000
+
+    print(f"   {'grant':<12} {'ms/renewal':>11}")
+    print(f"   {'password':<12} {login_ms:>11.2f}")
+    print(f"   {'refresh':<12} {refresh_ms:>11.2f}")
+
+
+async def bench_auth_rate_limit(attempts: int = 40, ops: int = 20_000) -> None:
+    """CPU spent on a password-guessing burst with and without the login limits"""
+    from fastapi import HTTPException
+
+    print(f"📊 {attempts} wrong-password logins for one account from one IP")
+    original = main.auth_rate_limiter
+    print(f"   {'limits':<10} {'seconds':>8} {'bcrypt runs':>12} {'429s':>6}")
+    try:
+        for label, budgets in (("off", {}), ("default", original.budgets)):
+            main.auth_rate_limiter = main.RateLimiter(main.MemoryRateLimitBackend(), budgets)
+            verified = main.password_pool.stats["completed"]
+            rejected = 0
+            start = time.perf_counter()
+            for _ in range(attempts):
+                try:
+                    await main.login(main.UserLogin(username="student1", password="guess"), local_request("10.0.0.1"))
+                except HTTPException as e:
+                    rejected += e.status_code == 429
+            elapsed = time.perf_counter() - start
+            verified = main.password_pool.stats["completed"] - verified
+            print(f"   {label:<10} {elapsed:>8.2f} {verified:>12} {rejected:>6}")
+    finally:
+        main.auth_rate_limiter = original
+
+    print(f"\n   {'backend':<10} {'µs/check':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in (main.MemoryRateLimitBackend(), main.SQLiteRateLimitBackend(os.path.join(tmp, "limits.db"))):
+            start = time.perf_counter()
+            for i in range(ops):
+                backend.take(f"ip:10.0.{i % 256}.{i % 200}", 100, 1.0, time.time())
+            print(f"   {backend.name:<10} {per_op_us(time.perf_counter() - start, ops):>9.2f}")
+
+
+async def bench_bcrypt_calibration(targets=(100, 250, 500), samples: int = 3) -> None:
+    """Cost chosen for each latency target, and how long hashing at that cost really takes"""
+    import bcrypt
+
+    print("📊 bcrypt cost calibration on this machine")
+    print(f"   {'target ms':>10} {'rounds':>7} {'hash ms':>8}")
+    for target in targets:
+        rounds, _ = main.calibrate_bcrypt_rounds(target)
+        salt = bcrypt.gensalt(rounds=rounds)
+        start = time.perf_counter()
+        for _ in range(samples):
+            bcrypt.hashpw(b"benchmark", salt)
+        hash_ms = (time.perf_counter() - start) / samples * 1000
+        print(f"   {target:>10} {rounds:>7} {hash_ms:>8.1f}")
+
+
+async def bench_ai_cache(prompts: int = 5, repeats: int = 4, latency: float = 0.5) -> None:
+    """Repeated content generations against fake_llm_server.py, per cache backend"""
+    from fake_llm_server import start_server
+    from openai import AsyncOpenAI
+
+    print(f"📊 AI response cache, {prompts} prompts x {repeats} requests ({latency}s fake completions)")
+    server = start_server(8103, latency)
+    original_client, original_cache = main.openai_client, main.ai_cache
+    main.openai_client = AsyncOpenAI(api_key="fake", base_url="http://127.0.0.1:8103/v1")
+    print(f"   {'backend':<8} {'miss ms':>8} {'hit ms':>8} {'hit rate':>9} {'tokens saved':>13}")
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            backends = [
+                main.MemoryAICacheBackend(1000),
+                main.SQLiteAICacheBackend(os.path.join(tmp, "ai_cache.db"), 1000),
+            ]
+            for backend in backends:
+                main.ai_cache = main.AIResponseCache(backend, 3600)
+                timings = {True: [], False: []}
+                for _ in range(repeats):
+                    for i in range(prompts):
+                        start = time.perf_counter()
+                        result = await main.generate_educational_content(
+                            prompt=f"Explain topic {i}", content_type="lesson", subject="CS"
+                        )
+                        timings[result["metadata"].get("cached", False)].append(time.perf_counter() - start)
+                metrics = main.ai_cache.metrics()
+                miss_ms = sum(timings[False]) / len(timings[False]) * 1000
+                hit_ms = sum(timings[True]) / len(timings[True]) * 1000
+                print(f"   {backend.name:<8} {miss_ms:>8.1f} {hit_ms:>8.3f} {metrics['hit_rate']:>9.0%} "
+                      f"{metrics['tokens_saved']:>13}")
+    finally:
+        main.openai_client, main.ai_cache = original_client, original_cache
+        server.shutdown()
+
+
+async def bench_ai_streaming(latency: float = 3.0) -> None:
+    """Time to first byte of generate-content, whole response versus SSE stream"""
+    from fake_llm_server import start_server
+    from openai import AsyncOpenAI
+
+    print(f"📊 generate-content time to first byte ({latency}s fake completions, cache bypassed)")
+    server = start_server(8106, latency)
+    original_client = main.openai_client
+    main.openai_client = AsyncOpenAI(api_key="fake", base_url="http://127.0.0.1:8106/v1")
+    user = main.storage.get(main.USERS_COLLECTION, 1)
+    request = main.AIContentRequest(prompt="Explain recursion", content_type="lesson", no_cache=True)
+    try:
+        start = time.perf_counter()
+        await main.generate_content(request, user)
+        whole = time.perf_counter() - start
+
+        start = time.perf_counter()
+        first = None
+        response = await main.generate_content_stream(request, user)
+        async for _ in response.body_iterator:
+            if first is None:
+                first = time.perf_counter() - start
+        streamed = time.perf_counter() - start
+    finally:
+        main.openai_client = original_client
+        server.shutdown()
+
+    print(f"   {'route':<24} {'first byte s':>13} {'complete s':>11}")
+    print(f"   {'generate-content':<24} {whole:>13.3f} {whole:>11.3f}")
+    print(f"   {'generate-content/stream':<24} {first:>13.3f} {streamed:>11.3f}")
+
+
+async def bench_ai_single_flight(students: int = 50, latency: float = 1.0) -> None:
+    """A class asking explain-concept for the same concept at once, versus distinct concepts"""
+    from fake_llm_server import start_server
+    from openai import AsyncOpenAI
+
+    print(f"📊 explain-concept, {students} concurrent students ({latency}s fake completions, cache bypassed)")
+    server = start_server(8107, latency)
+    original_client = main.openai_client
+    main.openai_client = AsyncOpenAI(api_key="fake", base_url="http://127.0.0.1:8107/v1")
+    user = main.storage.get(main.USERS_COLLECTION, 1)
+    print(f"   {'concepts':<10} {'upstream calls':>15} {'coalesced':>10} {'wall s':>8}")
+    try:
+        for label, concept in (("same", lambda i: "recursion"), ("distinct", lambda i: f"recursion {i}")):
+            completed = main.ai_stats["completed"]
+            coalesced = main.ai_single_flight["coalesced"]
+            start = time.perf_counter()
+            await asyncio.gather(*(
+                main.explain_concept({"concept": concept(i), "subject": "CS", "no_cache": True}, user)
+                for i in range(students)
+            ))
+            wall = time.perf_counter() - start
+            print(f"   {label:<10} {main.ai_stats['completed'] - completed:>15} "
+                  f"{main.ai_single_flight['coalesced'] - coalesced:>10} {wall:>8.2f}")
+    finally:
+        main.openai_client = original_client
+        server.shutdown()
+
+
+async def bench_ai_quiz_batch(modules: int = 15, latency: float = 1.0) -> None:
+    """Quizzes for every module of a course: one generate-quiz request each versus a batch"""
+    from fake_llm_server import start_server
+    from openai import AsyncOpenAI
+
+    print(f"📊 {modules}-module course quizzes ({latency}s fake completions, cache bypassed)")
+    server = start_server(8108, latency)
+    original_client = main.openai_client
+    main.openai_client = AsyncOpenAI(api_key="fake", base_url="http://127.0.0.1:8108/v1")
+    user = main.storage.get(main.USERS_COLLECTION, 1)
+    items = [main.QuizBatchItem(topic=f"Module {i}", module_id=i, no_cache=True) for i in range(modules)]
+    print(f"   {'requests':<32} {'wall s':>8} {'valid':>6}")
+    try:
+        start = time.perf_counter()
+        for item in items:
+            await main.generate_quiz_endpoint(item, user)
+        print(f"   {f'generate-quiz x {modules}':<32} {time.perf_counter() - start:>8.2f} {modules:>6}")
+
+        for concurrency in (main.AI_BATCH_CONCURRENCY, modules):
+            start = time.perf_counter()
+            results = await main.generate_quiz_batch(items, concurrency)
+            elapsed = time.perf_counter() - start
+            valid = sum(1 for result in results if result["success"])
+            print(f"   {f'batch, concurrency {concurrency}':<32} {elapsed:>8.2f} {valid:>6}")
+    finally:
+        main.openai_client = original_client
+        server.shutdown()
+
+
+async def bench_ai_jobs(bulk: int = 20, interactive: int = 5, latency: float = 0.5) -> None:
+    """Study-assistant jobs submitted behind a backlog of quiz jobs, with and without priorities"""
+    from fake_llm_server import start_server
+    from openai import AsyncOpenAI
+
+    print(f"📊 AI job queue, {interactive} study-assistant jobs behind {bulk} quiz jobs "
+          f"({main.AI_JOB_WORKERS} workers, {latency}s fake completions)")
+    server = start_server(8112, latency)
+    original_client, original_kinds = main.openai_client, main.AI_JOB_KINDS
+    main.openai_client = AsyncOpenAI(api_key="fake", base_url="http://127.0.0.1:8112/v1")
+    user = main.storage.get(main.USERS_COLLECTION, 1)
+    print(f"   {'scheduling':<12} {'submit ms':>10} {'interactive done s':>19} {'all done s':>11}")
+    try:
+        for label in ("fifo", "priority"):
+            if label == "fifo":
+                main.AI_JOB_KINDS = {kind: (model, route, 0) for kind, (model, route, _) in original_kinds.items()}
+            else:
+                main.AI_JOB_KINDS = original_kinds
+            queue = main.AIJobQueue(main.MemoryAIJobBackend())
+            start = time.perf_counter()
+            for i in range(bulk):
+                queue.submit("generate-quiz", {"topic": f"Module {i}", "no_cache": True}, user)
+            asks = [queue.submit("study-assistant", {"question": f"Question {i}"}, user) for i in range(interactive)]
+            submit_ms = (time.perf_counter() - start) / (bulk + interactive) * 1000
+            while queue.stats["succeeded"] + queue.stats["failed"] < bulk + interactive:
+                await asyncio.sleep(0.05)
+            done = time.perf_counter() - start
+            waits = [queue.backend.get(job["id"])["finished_at"] - job["submitted_at"] for job in asks]
+            await queue.stop()
+            print(f"   {label:<12} {submit_ms:>10.3f} {sum(waits) / len(waits):>19.2f} {done:>11.2f}")
+    finally:
+        main.openai_client, main.AI_JOB_KINDS = original_client, original_kinds
+        server.shutdown()
+
+
+async def bench_ai_usage(calls: int = 200_000, users: int = 10_000, courses: int = 500) -> None:
+    """Cost of token accounting on the AI hot path: record, budget check and the admin report"""
+    print(f"📊 AI token accounting, {calls:,} calls from {users:,} users in {courses} courses")
+    ledger = main.AIUsageLedger(user_budget=10**9, course_budget=10**9)
+    callers = [(i % users, i % courses, "study-assistant") for i in range(calls)]
+    now = time.time()
+
+    start = time.perf_counter()
+    for i, caller in enumerate(callers):
+        # spread over the whole window so every ring is fully populated
+        ledger.record(caller, 250, now - (i % ledger.buckets) * ledger.bucket_seconds)
+    record_us = per_op_us(time.perf_counter() - start, calls)
+
+    start = time.perf_counter()
+    for i in range(calls):
+        ledger.check({"id": i % users, "role": "student"}, i % courses)
+    check_us = per_op_us(time.perf_counter() - start, calls)
+
+    start = time.perf_counter()
+    ledger.report("user", 20)
+    report_ms = (time.perf_counter() - start) * 1000
+
+    print(f"   {'record':<24} {record_us:>9.2f} µs/call")
+    print(f"   {'budget check':<24} {check_us:>9.2f} µs/call")
+    print(f"   {'report, top 20 users':<24} {report_ms:>9.1f} ms")
+
+
+async def bench_ai_outage(waves: int = 3, calls: int = 10, deadline: float = 1.0) -> None:
+    """Study-assistant calls while OpenAI hangs: each waits out its deadline, or the breaker fails them fast"""
+    from fake_llm_server import start_server
+    from openai import AsyncOpenAI
+
+    print(f"📊 OpenAI outage, {waves} waves of {calls} study-assistant calls ({deadline}s deadline)")
+    server = start_server(8115, 30.0)  # answers far too late: a hung upstream
+    original = main.openai_client, main.ai_breaker, main.AI_TIMEOUT_SECONDS
+    main.openai_client = AsyncOpenAI(api_key="fake", base_url="http://127.0.0.1:8115/v1", max_retries=0)
+    main.AI_TIMEOUT_SECONDS = deadline
+    print(f"   {'breaker':<10} " + " ".join(f"{f'wave {i + 1} ms':>11}" for i in range(waves)) + f" {'timed out':>10}")
+    try:
+        for label, failure_rate in (("off", 2.0), ("on", main.AI_BREAKER_FAILURE_RATE)):
+            main.ai_breaker = main.CircuitBreaker(failure_rate=failure_rate)
+            timeouts = main.ai_stats["timeouts"]
+            timings = []
+            for wave in range(waves):
+                start = time.perf_counter()
+                await asyncio.gather(*(
+                    main.study_assistant(f"Question {wave}-{i}") for i in range(calls)
+                ), return_exceptions=True)
+                timings.append((time.perf_counter() - start) * 1000)
+            print(f"   {label:<10} " + " ".join(f"{ms:>11.1f}" for ms in timings)
+                  + f" {main.ai_stats['timeouts'] - timeouts:>10}")
+    finally:
+        main.openai_client, main.ai_breaker, main.AI_TIMEOUT_SECONDS = original
+        server.shutdown()
+
+
+async def run_crud_workload(size: int) -> dict:
+    """The same create/get/filter/list/update/delete mix through the entity routes"""
+    timings = {}
+    ids = list(range(1, size + 1))
+    lookups = random.sample(ids, len(ids))
+
+    start = time.perf_counter()
+    for i in ids:
+        await main.create_entity("Enrollment", {"courseId": i % 50, "studentId": i % 2000, "status": "active"})
+    timings["create"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in lookups:
+        await main.get_entity("Enrollment", i)
+    timings["get"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in lookups:
+        await main.filter_entities("Enrollment", {"studentId": i % 2000}, limit=20)
+    timings["filter"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(100):
+        await main.list_entities("Enrollment", limit=20)
+    timings["list (x100)"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in lookups:
+        await main.update_entity("Enrollment", i, {"status": "completed"})
+    timings["update"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in lookups:
+        await main.delete_entity("Enrollment", i)
+    timings["delete"] = time.perf_counter() - start
+
+    return timings
+
+
+async def bench_storage_engines(size: int = 10_000) -> None:
+    """Run the CRUD workload against every storage backend"""
+    print(f"📊 Storage engines, {size:,} Enrollment records (seconds per phase)")
+
+    original = main.storage
+    with tempfile.TemporaryDirectory() as tmp:
+        engines = {
+            "memory": main.MemoryStorageEngine(),
+            "sqlite": main.SQLiteStorageEngine(os.path.join(tmp, "bench.db")),
+        }
+        results = {}
+        try:
+            for name, engine in engines.items():
+                main.storage = engine
+                results[name] = await run_crud_workload(size)
+        finally:
+            main.storage = original
+
+    print(f"   {'phase':<12}" + "".join(f"{name:>10}" for name in results))
+    for phase in next(iter(results.values())):
+        print(f"   {phase:<12}" + "".join(f"{timings[phase]:>10.3f}" for timings in results.values()))
+
+
+STARTUP_SCRIPT = """
+import time
+start = time.perf_counter()
+import main
+from fastapi.testclient import TestClient
+imported = time.perf_counter()
+TestClient(main.app).get("/").raise_for_status()
+print(imported - start, time.perf_counter() - start)
+"""
+
+
+async def bench_startup(runs: int = 5) -> None:
+    """Import-to-first-request time of a fresh interpreter (what every worker spawn pays)"""
+    import statistics
+    import subprocess
+    import sys
+
+    print(f"📊 Startup, median of {runs} fresh processes")
+    imports, firsts = [], []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-c", STARTUP_SCRIPT],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True,
+        )
+        imported, first = map(float, result.stdout.split()[-2:])
+        imports.append(imported)
+        firsts.append(first)
+
+    print(f"   {'import main':<26} {statistics.median(imports) * 1000:>8.1f} ms")
+    print(f"   {'import to first request':<26} {statistics.median(firsts) * 1000:>8.1f} ms")
+
+
+BENCHMARKS = {
+    "entity-lookup": bench_entity_lookup,
+    "entity-filter": bench_entity_filter,
+    "entity-insert": bench_entity_insert,
+    "entity-pagination": bench_entity_pagination,
+    "entity-sort": bench_entity_sort,
+    "entity-bulk": bench_entity_bulk,
+    "entity-export": bench_entity_export,
+    "storage-engines": bench_storage_engines,
+    "write-log": bench_write_log,
+    "user-directory": bench_user_directory,
+    "token-cache": bench_token_cache,
+    "token-refresh": bench_token_refresh,
+    "auth-rate-limit": bench_auth_rate_limit,
+    "bcrypt-calibration": bench_bcrypt_calibration,
+    "ai-cache": bench_ai_cache,
+    "ai-streaming": bench_ai_streaming,
+    "ai-single-flight": bench_ai_single_flight,
+    "ai-quiz-batch": bench_ai_quiz_batch,
+    "ai-jobs": bench_ai_jobs,
+    "ai-usage": bench_ai_usage,
+    "ai-outage": bench_ai_outage,
+    "startup": bench_startup,
+}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="HBIU backend benchmarks")
+    parser.add_argument("names", nargs="*", help=f"benchmarks to run (default: all): {', '.join(BENCHMARKS)}")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+
+    print("🚀 HBIU Backend Benchmarks\n")
+    for name in args.names or BENCHMARKS:
+        asyncio.run(BENCHMARKS[name]())
+        print()
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Fake OpenAI-compatible server for HBIU University Backend tests
+Answers POST /v1/chat/completions after a (configurable) delay, without calling OpenAI
+("stream": true requests get the answer word by word, spread over the delay;
+requests whose system prompt asks for JSON get a quiz in the backend's format).
+Errors can be injected at a given rate: HTTP error statuses, hung requests,
+streams that break midway, and quizzes that are not valid JSON.
+GET /v1/stats returns what the server has answered so far.
+
+Usage:
+    python3 fake_llm_server.py [port] [latency_seconds] [--distribution lognormal --spread 0.5]
+                               [--error-rate 0.1 --errors 500,429,hang] [--bad-json-rate 0.1]
+
+Point the backend at it with:
+    OPENAI_API_KEY=fake OPENAI_BASE_URL=http://localhost:8100/v1 python3 main.py
+"""
+
+import argparse
+import io
+import json
+import math
+import random
+import re
+import socket
+import struct
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Configuration
+DEFAULT_PORT = 8100
+DEFAULT_LATENCY = 2.0  # seconds per completion
+ANSWER_WORDS = 200
+DISTRIBUTIONS = ("fixed", "uniform", "exponential", "lognormal")
+HANG_SECONDS = 600  # an injected "hang" error: long past any client timeout
+
+def fake_answer(prompt: str) -> str:
+    words = f"This is a fake answer to: {prompt[:200]}".split()
+    filler = "lorem ipsum dolor sit amet consectetur adipiscing elit".split()
+    while len(words) < ANSWER_WORDS:
+        words.append(filler[len(words) % len(filler)])
+    return " ".join(words)
+
+def fake_quiz(prompt: str) -> str:
+    match = re.search(r"quiz about (.+?) with (\d+) questions", prompt)
+    topic, count = (match.group(1), int(match.group(2))) if match else ("the topic", 5)
+    return json.dumps({
+        "quiz_title": f"{topic} Quiz",
+        "questions": [{
+            "id": i,
+            "type": "multiple_choice",
+            "question": f"Fake question {i} about {topic}?",
+            "options": ["A) One", "B) Two", "C) Three", "D) Four"],
+            "correct_answer": "A",
+            "explanation": "Fake explanation",
+        } for i in range(1, count + 1)],
+    })
+
+def wants_json(messages: list) -> bool:
+    return any(m.get("role") == "system" and "JSON" in str(m.get("content", "")) for m in messages)
+
+def sample_latency(latency: float, distribution: str = "fixed", spread: float = 0.0) -> float:
+    """One completion delay: latency is the mean (median for lognormal)
+
+    uniform: latency +/- spread seconds; exponential: mean latency;
+    lognormal: median latency with sigma spread (a long right tail).
+    """
+    if distribution == "uniform":
+        return max(random.uniform(latency - spread, latency + spread), 0.0)
+    if distribution == "exponential":
+        return random.expovariate(1 / latency) if latency > 0 else 0.0
+    if distribution == "lognormal":
+        return random.lognormvariate(math.log(latency), spread) if latency > 0 else 0.0
+    return latency
+
+def completion_response(model: str, content: str, prompt_tokens: int) -> dict:
+    completion_tokens = len(content.split())
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": usage(prompt_tokens, completion_tokens),
+    }
+
+def usage(prompt_tokens: int, completion_tokens: int) -> dict:
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+def chunk_response(completion_id: str, model: str, delta: dict, finish_reason=None, chunk_usage=None) -> dict:
+    return {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if chunk_usage is None else [],
+        "usage": chunk_usage,
+    }
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    latency = DEFAULT_LATENCY
+    distribution = "fixed"
+    spread = 0.0
+    error_rate = 0.0
+    errors = ("500",)  # HTTP statuses, "hang" or "break" (stream cut midway), picked at random
+    bad_json_rate = 0.0
+    stats = Counter()  # shared by the server's handlers; configure() gives each server its own
+    stats_lock = threading.Lock()
+
+    def count(self, key: str):
+        with self.stats_lock:
+            self.stats[key] += 1
+
+    def do_GET(self):
+        if not self.path.endswith("/stats"):
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+        with self.stats_lock:
+            self.send_json(200, dict(self.stats))
+
+    def do_POST(self):
+        if not self.path.endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        messages = body.get("messages", [])
+        prompt = messages[-1].get("content", "") if messages else ""
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in messages)
+        delay = sample_latency(self.latency, self.distribution, self.spread)
+        self.count("requests")
+
+        error = random.choice(self.errors) if random.random() < self.error_rate else None
+        if error == "hang":
+            self.count("hung")
+            time.sleep(HANG_SECONDS)
+            return
+        if error and error != "break":
+            self.count(f"error_{error}")
+            time.sleep(delay / 10)  # errors come back faster than answers
+            headers = {"Retry-After": "1"} if error == "429" else {}
+            self.send_json(int(error), {"error": {"message": f"Injected {error} error", "type": "server_error"}}, headers)
+            return
+
+        if wants_json(messages):
+            content = fake_quiz(prompt)
+            if random.random() < self.bad_json_rate:
+                self.count("bad_json")
+                content = content[: len(content) // 2]  # cut off mid-object
+        else:
+            content = fake_answer(prompt)
+        if body.get("stream"):
+            self.count("streams")
+            self.stream_answer(body, content, prompt_tokens, delay, broken=error == "break")
+            return
+        time.sleep(delay)
+        self.count("completions")
+        self.send_json(200, completion_response(body.get("model", "fake"), content, prompt_tokens))
+
+    def stream_answer(self, body: dict, content: str, prompt_tokens: int, delay: float, broken: bool = False):
+        """Send the answer as chat.completion.chunk events, one word per event"""
+        model = body.get("model", "fake")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        words = content.split(" ")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+
+        def send(payload: dict):
+            self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        send(chunk_response(completion_id, model, {"role": "assistant", "content": ""}))
+        for i, word in enumerate(words):
+            if broken and i == len(words) // 2:
+                self.count("error_break")
+                self.reset_connection()
+                return
+            time.sleep(delay / len(words))
+            send(chunk_response(completion_id, model, {"content": word if i == 0 else " " + word}))
+        send(chunk_response(completion_id, model, {}, finish_reason="stop"))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            send(chunk_response(completion_id, model, {}, chunk_usage=usage(prompt_tokens, len(words))))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def reset_connection(self):
+        """Drop the connection with a TCP reset, as a failing upstream would"""
+        self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+        self.connection.close()
+        self.wfile = io.BytesIO()  # finish() flushes it
+        self.close_connection = True
+
+    def send_json(self, status_code: int, payload: dict, headers: dict = None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # keep test output readable
+
+def configure(latency: float = DEFAULT_LATENCY, distribution: str = "fixed", spread: float = 0.0,
+              error_rate: float = 0.0, errors=("500",), bad_json_rate: float = 0.0) -> type:
+    """A FakeLLMHandler subclass with these settings and its own stats"""
+    if distribution not in DISTRIBUTIONS:
+        raise ValueError(f"Unknown distribution '{distribution}' (expected one of: {', '.join(DISTRIBUTIONS)})")
+    return type("ConfiguredFakeLLMHandler", (FakeLLMHandler,), {
+        "latency": latency,
+        "distribution": distribution,
+        "spread": spread,
+        "error_rate": error_rate,
+        "errors": tuple(str(error) for error in errors),
+        "bad_json_rate": bad_json_rate,
+        "stats": Counter(),
+    })
+
+def start_server(port: int = DEFAULT_PORT, latency: float = DEFAULT_LATENCY, **settings) -> ThreadingHTTPServer:
+    """Run the fake server on a background thread; call .shutdown() to stop it.
+
+    settings are those of configure(); the handler's stats are on server.stats.
+    """
+    handler = configure(latency, **settings)
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    server.stats = handler.stats
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible chat completions server")
+    parser.add_argument("port", nargs="?", type=int, default=DEFAULT_PORT)
+    parser.add_argument("latency", nargs="?", type=float, default=DEFAULT_LATENCY,
+                        help="seconds per completion (mean; median for lognormal)")
+    parser.add_argument("--distribution", choices=DISTRIBUTIONS, default="fixed")
+    parser.add_argument("--spread", type=float, default=0.0,
+                        help="uniform: +/- seconds; lognormal: sigma (0.5 gives a long tail)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests that fail")
+    parser.add_argument("--errors", default="500",
+                        help="comma-separated failures to pick from: HTTP statuses, hang, break")
+    parser.add_argument("--bad-json-rate", type=float, default=0.0, help="share of quizzes cut off mid-JSON")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    handler = configure(args.latency, args.distribution, args.spread, args.error_rate,
+                        args.errors.split(","), args.bad_json_rate)
+    print(f"🤖 Fake LLM server on http://localhost:{args.port}/v1 "
+          f"({args.latency}s per completion, {args.distribution}, {args.error_rate:.0%} errors)")
+    server = ThreadingHTTPServer(("0.0.0.0", args.port), handler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+AI load test for HBIU University Backend
+Drives /api/ai/* at a given concurrency and reports throughput, status codes
+and latency percentiles per endpoint (time to first token too, for streams).
+By default it starts fake_llm_server.py and a backend pointed at it, so no
+OpenAI key is spent; --base-url targets a backend that is already running.
+
+Usage:
+    python3 load_test_ai.py [--endpoints study-assistant,generate-quiz] [--requests 200] [--concurrency 20]
+                            [--latency 1.0 --distribution lognormal --spread 0.5]
+                            [--error-rate 0.05 --errors 500,429] [--unique 200]
+    python3 load_test_ai.py --base-url http://localhost:8000
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import requests
+
+from fake_llm_server import DISTRIBUTIONS, start_server
+
+# Configuration
+FAKE_LLM_PORT = 8131
+BACKEND_PORT = 8132
+REQUEST_TIMEOUT = 300  # seconds; the backend's own deadlines should answer well before
+
+# endpoint -> body of request i (unique per i, so the AI cache does not answer)
+ENDPOINTS = {
+    "study-assistant": lambda i: {"question": f"Question {i}: what is recursion?"},
+    "explain-concept": lambda i: {"concept": f"Concept {i}", "subject": "Computer Science"},
+    "generate-content": lambda i: {"prompt": f"Lesson {i} on sorting", "content_type": "lesson"},
+    "generate-quiz": lambda i: {"topic": f"Topic {i}", "num_questions": 5},
+    "study-assistant/stream": lambda i: {"question": f"Question {i}: what is recursion?"},
+    "explain-concept/stream": lambda i: {"concept": f"Concept {i}", "subject": "Computer Science"},
+    "generate-content/stream": lambda i: {"prompt": f"Lesson {i} on sorting", "content_type": "lesson"},
+}
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def start_backend(base_url: str) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY="fake",
+        OPENAI_BASE_URL=f"http://127.0.0.1:{FAKE_LLM_PORT}/v1",
+    )
+    backend = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(BACKEND_PORT), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+    )
+    for _ in range(100):
+        try:
+            requests.get(f"{base_url}/", timeout=1)
+            return backend
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    backend.kill()
+    raise RuntimeError("Backend did not start")
+
+def login(base_url: str, username: str, password: str) -> str:
+    response = requests.post(f"{base_url}/api/auth/login", json={"username": username, "password": password})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+class LoadTest:
+    def __init__(self, base_url: str, token: str):
+        self.base_url = base_url
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = defaultdict(list)  # ms, successful requests
+        self.first_tokens: Dict[str, List[float]] = defaultdict(list)  # ms, streams
+        self.statuses: Dict[str, Counter] = defaultdict(Counter)
+        self.tokens = 0
+
+    def session(self) -> requests.Session:
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def call(self, endpoint: str, body: dict):
+        url = f"{self.base_url}/api/ai/{endpoint}"
+        first_token = None
+        tokens = 0
+        start = time.perf_counter()
+        try:
+            with self.session().post(url, json=body, headers=self.headers, timeout=REQUEST_TIMEOUT,
+                                     stream=endpoint.endswith("/stream")) as response:
+                outcome = str(response.status_code)
+                if response.status_code == 200 and endpoint.endswith("/stream"):
+                    event = None
+                    for line in response.iter_lines(decode_unicode=True):
+                        if line.startswith("event: "):
+                            event = line[len("event: "):]
+                            if event == "token" and first_token is None:
+                                first_token = time.perf_counter() - start
+                        elif line.startswith("data: ") and event in ("done", "error"):
+                            data = json.loads(line[len("data: "):])
+                            if event == "error":
+                                outcome = "stream error"
+                            tokens = (data.get("metadata") or {}).get("tokens_used") or 0
+                elif response.status_code == 200:
+                    tokens = response.json().get("metadata", {}).get("tokens_used") or 0
+        except requests.RequestException as e:
+            outcome = type(e).__name__
+        elapsed = time.perf_counter() - start
+
+        with self.lock:
+            self.statuses[endpoint][outcome] += 1
+            if outcome == "200":
+                self.latencies[endpoint].append(elapsed * 1000)
+                self.tokens += tokens
+                if first_token is not None:
+                    self.first_tokens[endpoint].append(first_token * 1000)
+
+    def run(self, endpoints: List[str], total: int, concurrency: int, unique: int) -> float:
+        jobs = [(endpoints[i % len(endpoints)], ENDPOINTS[endpoints[i % len(endpoints)]](i % unique))
+                for i in range(total)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(lambda job: self.call(*job), jobs))
+        return time.perf_counter() - start
+
+    def report(self, elapsed: float, total: int):
+        succeeded = sum(len(samples) for samples in self.latencies.values())
+        print(f"   {total} requests in {elapsed:.1f}s: {total / elapsed:.1f} req/s, "
+              f"{succeeded / elapsed:.1f} successful req/s, {self.tokens / elapsed:.0f} tokens/s")
+        print(f"   {'endpoint':<26} {'ok':>5} {'p50 ms':>8} {'p90 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+              f"{'max ms':>8} {'ttft p50':>9}  other outcomes")
+        for endpoint, statuses in self.statuses.items():
+            samples = self.latencies[endpoint]
+            stats = [percentile(samples, pct) for pct in (50, 90, 95, 99)] + [max(samples)] if samples else []
+            cells = " ".join(f"{value:>8.0f}" for value in stats) if stats else " ".join(f"{'-':>8}" for _ in range(5))
+            first = self.first_tokens[endpoint]
+            ttft = f"{percentile(first, 50):>9.0f}" if first else f"{'-':>9}"
+            others = ", ".join(f"{outcome} x{count}" for outcome, count in statuses.items() if outcome != "200")
+            print(f"   {endpoint:<26} {statuses['200']:>5} {cells} {ttft}  {others}")
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="HBIU AI endpoints load test")
+    parser.add_argument("--base-url", help="running backend to test (default: start a fake LLM server and a backend)")
+    parser.add_argument("--endpoints", default="study-assistant",
+                        help=f"comma-separated, sent in rotation: {', '.join(ENDPOINTS)}")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--unique", type=int, default=0,
+                        help="distinct request bodies (default: all distinct; fewer lets cache and coalescing work)")
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="admin123")
+    fake = parser.add_argument_group("fake LLM server (ignored with --base-url)")
+    fake.add_argument("--latency", type=float, default=1.0)
+    fake.add_argument("--distribution", choices=DISTRIBUTIONS, default="fixed")
+    fake.add_argument("--spread", type=float, default=0.0)
+    fake.add_argument("--error-rate", type=float, default=0.0)
+    fake.add_argument("--errors", default="500")
+    fake.add_argument("--bad-json-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    args.endpoints = args.endpoints.split(",")
+    unknown = [endpoint for endpoint in args.endpoints if endpoint not in ENDPOINTS]
+    if unknown:
+        parser.error(f"unknown endpoint(s): {', '.join(unknown)}")
+    args.unique = args.unique or args.requests
+    return args
+
+def main():
+    args = parse_args()
+    base_url = args.base_url or f"http://127.0.0.1:{BACKEND_PORT}"
+    fake_llm = backend = None
+    if not args.base_url:
+        fake_llm = start_server(FAKE_LLM_PORT, args.latency, distribution=args.distribution, spread=args.spread,
+                                error_rate=args.error_rate, errors=args.errors.split(","),
+                                bad_json_rate=args.bad_json_rate)
+        backend = start_backend(base_url)
+
+    print(f"🧪 AI load test: {args.requests} requests to {', '.join(args.endpoints)} "
+          f"at concurrency {args.concurrency} ({base_url})")
+    if fake_llm:
+        print(f"   fake LLM: {args.latency}s {args.distribution} latency, {args.error_rate:.0%} errors ({args.errors})")
+    try:
+        load_test = LoadTest(base_url, login(base_url, args.username, args.password))
+        elapsed = load_test.run(args.endpoints, args.requests, args.concurrency, args.unique)
+        load_test.report(elapsed, args.requests)
+
+        metrics = requests.get(f"{base_url}/api/metrics", headers=load_test.headers, timeout=10)
+        if metrics.status_code == 200:
+            data = metrics.json()
+            calls = data["ai_calls"]
+            print(f"   backend: {calls['completed']} completions, {calls['retries']} retries, "
+                  f"{calls['timeouts']} timeouts, breaker {data['ai_breaker']['state']} "
+                  f"(opened {data['ai_breaker']['opened']}x), {data['ai_single_flight']['coalesced']} coalesced, "
+                  f"{data['ai_cache']['hits']} cache hits")
+        if fake_llm:
+            print(f"   fake LLM: {dict(fake_llm.stats)}")
+    finally:
+        if backend:
+            backend.terminate()
+            backend.wait()
+        if fake_llm:
+            fake_llm.shutdown()
+
+if __name__ == "__main__":
+    main()
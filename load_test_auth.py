@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Auth load test for HBIU University Backend
+Fires a burst of concurrent logins and measures /api/courses latency
+before and during the burst (it should stay flat: bcrypt runs off the event loop)
+
+Usage:
+    python3 load_test_auth.py [base_url] [concurrent_logins]
+"""
+
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import requests
+
+# Configuration
+BASE_URL = sys.argv[1] if len(sys.argv) > 1 else "http://localhost:8000"
+CONCURRENT_LOGINS = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+PROBE_INTERVAL = 0.02  # seconds between /api/courses probes
+
+def login_user(username: str, password: str) -> requests.Response:
+    return requests.post(f"{BASE_URL}/api/auth/login", json={"username": username, "password": password})
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def probe_courses(token: str, stop: threading.Event, samples: List[float]) -> None:
+    """Time /api/courses repeatedly until stop is set"""
+    headers = {"Authorization": f"Bearer {token}"}
+    with requests.Session() as session:
+        while not stop.is_set():
+            start = time.perf_counter()
+            session.get(f"{BASE_URL}/api/courses", headers=headers).raise_for_status()
+            samples.append((time.perf_counter() - start) * 1000)
+            time.sleep(PROBE_INTERVAL)
+
+def measure(token: str, seconds: float) -> List[float]:
+    samples: List[float] = []
+    stop = threading.Event()
+    prober = threading.Thread(target=probe_courses, args=(token, stop, samples))
+    prober.start()
+    time.sleep(seconds)
+    stop.set()
+    prober.join()
+    return samples
+
+def login_burst(count: int) -> Dict[int, int]:
+    """Send count logins at once; returns status code -> number of responses"""
+    barrier = threading.Barrier(count)
+
+    def one_login(i: int) -> int:
+        barrier.wait()
+        return login_user("student1", "student123").status_code
+
+    with ThreadPoolExecutor(max_workers=count) as executor:
+        codes = list(executor.map(one_login, range(count)))
+    return {code: codes.count(code) for code in sorted(set(codes))}
+
+def report(label: str, samples: List[float]) -> None:
+    print(f"   {label:<14} {len(samples):>6} {percentile(samples, 50):>9.1f} "
+          f"{percentile(samples, 95):>9.1f} {percentile(samples, 99):>9.1f} {max(samples):>9.1f}")
+
+def main():
+    print(f"🧪 Auth load test against {BASE_URL}")
+    response = login_user("admin", "admin123")
+    if response.status_code != 200:
+        print(f"❌ Admin login failed: {response.status_code} - {response.text}")
+        sys.exit(1)
+    token = response.json()["access_token"]
+
+    print("1. Baseline /api/courses latency (3s)...")
+    baseline = measure(token, 3)
+
+    print(f"2. /api/courses latency during {CONCURRENT_LOGINS} concurrent logins...")
+    samples: List[float] = []
+    stop = threading.Event()
+    prober = threading.Thread(target=probe_courses, args=(token, stop, samples))
+    prober.start()
+    start = time.perf_counter()
+    codes = login_burst(CONCURRENT_LOGINS)
+    burst_seconds = time.perf_counter() - start
+    stop.set()
+    prober.join()
+
+    print(f"\n   {'phase':<14} {'probes':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    report("baseline", baseline)
+    report("login burst", samples)
+    print(f"\n   Burst took {burst_seconds:.2f}s; login responses: "
+          + ", ".join(f"{code} x{count}" for code, count in codes.items()))
+
+    if 503 in codes:
+        print("   ℹ️  503s are logins shed by the password pool (raise AUTH_QUEUE_LIMIT to queue more)")
+    if 429 in codes:
+        print("   ℹ️  429s are logins stopped by the rate limits before bcrypt "
+              "(start the server with AUTH_USERNAME_BURST=0 AUTH_IP_BURST=0 to load the password pool)")
+    if percentile(samples, 95) > max(50.0, 5 * percentile(baseline, 95)):
+        print("❌ Non-auth latency degraded during the login burst")
+        sys.exit(1)
+    print("✅ Non-auth latency stayed flat during the login burst")
+
+if __name__ == "__main__":
+    main()
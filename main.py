@@ -1,31 +1,81 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 from typing import Optional, List
 import uvicorn
 import os
+import re
+import sqlite3
+import threading
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import time
+import atexit
+import pickle
+import struct
+import zlib
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from contextvars import ContextVar
 from datetime import datetime, timedelta, timezone
 import jwt
 import bcrypt
 import hashlib
+import functools
+import inspect
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import (
+    AsyncOpenAI, APIConnectionError, APIStatusError, APITimeoutError, InternalServerError, RateLimitError
+)
 import json
-from typing import Dict, Any
+import base64
+import urllib.parse
+import urllib.request
+import ipaddress
+import socket
+import math
+import secrets
+import random
+import csv
+import io
+import bisect
+import heapq
+from itertools import islice
+from collections import OrderedDict, deque
+from typing import Dict, Any, Iterator, Union
 
 # Load environment variables
 load_dotenv()
 
-# Initialize OpenAI client
+# AI call limits: each completion times out after AI_TIMEOUT_SECONDS, and at
+# most AI_MAX_CONCURRENCY run at once per worker (the rest wait their turn)
+AI_TIMEOUT_SECONDS = float(os.getenv("AI_TIMEOUT_SECONDS", 60))
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", 20))
+# Batch quiz generation: quizzes generated at once per batch request, and batch size
+AI_BATCH_CONCURRENCY = int(os.getenv("AI_BATCH_CONCURRENCY", 5))
+AI_BATCH_MAX_ITEMS = int(os.getenv("AI_BATCH_MAX_ITEMS", 50))
+
+# Initialize OpenAI client (async, one connection pool shared by every request;
+# OPENAI_BASE_URL points it at another OpenAI-compatible server)
 try:
-    openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY")) if os.getenv("OPENAI_API_KEY") else None
+    openai_client = AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        timeout=AI_TIMEOUT_SECONDS,
+        max_retries=0,  # call_upstream retries, within the endpoint's deadline
+    ) if os.getenv("OPENAI_API_KEY") else None
 except Exception as e:
     print(f"Warning: OpenAI client initialization failed: {e}")
     openai_client = None
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    ai_jobs.start()  # workers, and the jobs a durable backend kept from the last run
+    yield
+    await ai_jobs.stop()
+
 # FastAPI app instance
-app = FastAPI(title="HBIU University Backend", version="1.0.0")
+app = FastAPI(title="HBIU University Backend", version="1.0.0", lifespan=lifespan)
 
 # Security
 security = HTTPBearer()
@@ -34,6 +84,7 @@ security = HTTPBearer()
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", 14))
 
 # CORS Configuration
 origins = [
@@ -62,6 +113,9 @@ class UserCreate(BaseModel):
     password: str
     role: str = "student"
 
+class UserRoleUpdate(BaseModel):
+    role: str
+
 class UserLogin(BaseModel):
     username: str
     password: str
@@ -77,6 +131,10 @@ class Token(BaseModel):
     access_token: str
     token_type: str
     user: User
+    refresh_token: Optional[str] = None
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
 
 class Course(BaseModel):
     id: int
@@ -213,24 +271,82 @@ class AIContentRequest(BaseModel):
     subject: Optional[str] = None
     difficulty: Optional[str] = "intermediate"  # "beginner", "intermediate", "advanced"
     length: Optional[str] = "medium"  # "short", "medium", "long"
+    no_cache: bool = False  # force a fresh generation
 
 class QuizGenerationRequest(BaseModel):
     topic: str
     num_questions: int = 5
     difficulty: str = "intermediate"
     question_types: List[str] = ["multiple_choice", "true_false"]
+    no_cache: bool = False  # force a fresh generation
+
+class QuizBatchItem(QuizGenerationRequest):
+    module_id: Optional[int] = None  # stored on the Quiz entity
+
+class QuizBatchRequest(BaseModel):
+    quizzes: List[QuizBatchItem] = []  # empty with a course_id: one quiz per Module of the course
+    course_id: Optional[int] = None
+    store: bool = True  # save valid quizzes as Quiz entities
 
 class StudyAssistantRequest(BaseModel):
     question: str
     context: Optional[str] = None
     course_id: Optional[int] = None
 
+class BulkEntityRequest(BaseModel):
+    create: List[Dict[str, Any]] = []
+    update: List[Dict[str, Any]] = []  # each item carries the "id" to update
+    delete: List[Any] = []  # ids
+
 class AIResponse(BaseModel):
-    content: str
+    content: Union[str, Dict[str, Any]]  # quizzes are structured
     metadata: Dict[str, Any] = {}
     success: bool = True
     error_message: Optional[str] = None
 
+# Password hashing cost. Each extra round doubles the work; the cost used is
+# stored in every hash, so changing it only affects new hashes (and logins,
+# which rehash to the current cost).
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 0))  # fixed cost; 0 calibrates to BCRYPT_TARGET_MS
+BCRYPT_TARGET_MS = float(os.getenv("BCRYPT_TARGET_MS", 250))
+BCRYPT_MIN_ROUNDS = 10  # never weaker than this, however slow the machine
+BCRYPT_MAX_ROUNDS = 16
+bcrypt_settings = {"rounds": None, "probe_ms": None, "rehashed": 0}
+bcrypt_settings_lock = threading.Lock()
+
+def calibrate_bcrypt_rounds(target_ms: float) -> tuple:
+    """Highest cost whose hash takes at most target_ms on this machine.
+
+    Times a cheap cost and extrapolates; returns (rounds, probe milliseconds).
+    """
+    probe_rounds = 8
+    salt = bcrypt.gensalt(rounds=probe_rounds)
+    probe = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        bcrypt.hashpw(b"calibration", salt)
+        probe = min(probe, time.perf_counter() - start)
+    rounds = probe_rounds + math.floor(math.log2(target_ms / 1000 / probe))
+    return max(BCRYPT_MIN_ROUNDS, min(BCRYPT_MAX_ROUNDS, rounds)), probe * 1000
+
+def bcrypt_rounds() -> int:
+    """Cost for new hashes, calibrated on first use (i.e. on the password pool, not at import)"""
+    if bcrypt_settings["rounds"] is None:
+        with bcrypt_settings_lock:
+            if bcrypt_settings["rounds"] is None:
+                if BCRYPT_ROUNDS:
+                    bcrypt_settings["rounds"] = BCRYPT_ROUNDS
+                else:
+                    bcrypt_settings["rounds"], bcrypt_settings["probe_ms"] = calibrate_bcrypt_rounds(BCRYPT_TARGET_MS)
+    return bcrypt_settings["rounds"]
+
+def hash_rounds(hashed_password: str) -> Optional[int]:
+    """Cost stored in a bcrypt hash ("$2b$12$...")"""
+    try:
+        return int(hashed_password.split("$")[2])
+    except (IndexError, ValueError):
+        return None
+
 # Utility Functions
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     # Ensure password is not too long for bcrypt
@@ -242,10 +358,907 @@ def get_password_hash(password: str) -> str:
     # Ensure password is not too long for bcrypt
     if len(password) > 72:
         password = password[:72]
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=bcrypt_rounds())).decode('utf-8')
+
+def check_password(plain_password: str, hashed_password: str) -> tuple:
+    """verify_password, plus a new hash when the stored one uses another cost.
+
+    Returns (verified, new hash or None); one pool task covers both.
+    """
+    if not verify_password(plain_password, hashed_password):
+        return False, None
+    if hash_rounds(hashed_password) == bcrypt_rounds():
+        return True, None
+    return True, get_password_hash(plain_password)
+
+# ===== Password Hashing Pool =====
+
+# bcrypt takes ~100-300 ms of CPU per call, so it runs on a dedicated pool
+# instead of the event loop, and login bursts are shed with 503 once it is full
+AUTH_WORKERS = int(os.getenv("AUTH_WORKERS", os.cpu_count() or 2))
+AUTH_QUEUE_LIMIT = int(os.getenv("AUTH_QUEUE_LIMIT", 64))  # hashes running or queued before rejecting
+AUTH_RETRY_AFTER = int(os.getenv("AUTH_RETRY_AFTER", 2))  # seconds, sent with 503
+
+class PasswordHashPool:
+    """Bounded thread pool for bcrypt (which releases the GIL while hashing)"""
+
+    def __init__(self, workers: int, queue_limit: int):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="auth")
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.in_flight = 0
+        self.stats = {"completed": 0, "rejected": 0, "peak_in_flight": 0}
+
+    async def run(self, func, *args):
+        """Run func on the pool; 503 with Retry-After when the queue is full"""
+        # Only touched from the event loop thread, so no lock is needed
+        if self.in_flight >= self.queue_limit:
+            self.stats["rejected"] += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Authentication is busy, please retry shortly",
+                headers={"Retry-After": str(AUTH_RETRY_AFTER)},
+            )
+        self.in_flight += 1
+        self.stats["peak_in_flight"] = max(self.stats["peak_in_flight"], self.in_flight)
+        loop = asyncio.get_running_loop()
+        future = self.executor.submit(func, *args)
+        # Counted down when the hash is done, not when the caller is: a login
+        # cancelled by a client disconnect leaves bcrypt running on the pool
+        future.add_done_callback(lambda done: loop.call_soon_threadsafe(self.finished, done))
+        return await asyncio.wrap_future(future)
+
+    def finished(self, future):
+        self.in_flight -= 1
+        if not future.cancelled():  # cancelled before a worker picked it up
+            self.stats["completed"] += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        return {"workers": self.workers, "queue_limit": self.queue_limit, "in_flight": self.in_flight,
+                **self.stats, "bcrypt": bcrypt_settings}
+
+password_pool = PasswordHashPool(AUTH_WORKERS, AUTH_QUEUE_LIMIT)
+
+# ===== Rate Limiting =====
+
+# Token buckets checked before any bcrypt work: per client IP on login and
+# register, and per (normalized) username on login. 0 disables a budget.
+AUTH_IP_BURST = int(os.getenv("AUTH_IP_BURST", 100))
+AUTH_IP_PER_MINUTE = float(os.getenv("AUTH_IP_PER_MINUTE", 60))
+AUTH_USERNAME_BURST = int(os.getenv("AUTH_USERNAME_BURST", 5))
+AUTH_USERNAME_PER_MINUTE = float(os.getenv("AUTH_USERNAME_PER_MINUTE", 5))
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()  # "memory" or "sqlite" (shared by workers)
+RATE_LIMIT_SQLITE_PATH = os.getenv("RATE_LIMIT_SQLITE_PATH", "ratelimit.db")
+RATE_LIMIT_MAX_BUCKETS = 100000  # pruned of full buckets beyond this
+# Behind a proxy (e.g. Railway) every client shares the proxy's address, so
+# the client IP has to come from the X-Forwarded-For entry the proxy appends
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "false").lower() == "true"
+
+def take_token(bucket: Optional[tuple], capacity: int, rate: float, now: float):
+    """Refill a (tokens, updated_at) bucket and take one token from it.
+
+    Returns (new bucket, seconds to wait); the wait is 0 when a token was taken.
+    """
+    tokens, updated = bucket if bucket is not None else (capacity, now)
+    tokens = min(capacity, tokens + (now - updated) * rate)
+    if tokens >= 1:
+        return (tokens - 1, now), 0.0
+    return (tokens, now), (1 - tokens) / rate
+
+class MemoryRateLimitBackend:
+    """Buckets for this process only"""
+    name = "memory"
+
+    def __init__(self):
+        self.buckets: Dict[str, tuple] = {}  # key -> (tokens, updated_at, full_at)
+        self.prune_at = RATE_LIMIT_MAX_BUCKETS
+        self.lock = threading.Lock()
+
+    def take(self, key: str, capacity: int, rate: float, now: float) -> float:
+        with self.lock:
+            bucket = self.buckets.get(key)
+            (tokens, updated), wait = take_token(bucket[:2] if bucket else None, capacity, rate, now)
+            self.buckets[key] = (tokens, updated, now + (capacity - tokens) / rate)
+            if len(self.buckets) > self.prune_at:
+                # A bucket that has refilled completely is the same as no bucket
+                self.buckets = {k: b for k, b in self.buckets.items() if b[2] > now}
+                self.prune_at = max(RATE_LIMIT_MAX_BUCKETS, 2 * len(self.buckets))
+            return wait
+
+class SQLiteRateLimitBackend:
+    """Buckets in a SQLite file, shared by every worker process on the host"""
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_limit_buckets "
+            "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, full_at REAL NOT NULL)"
+        )
+        self.lock = threading.Lock()
+        self.takes = 0
+
+    def take(self, key: str, capacity: int, rate: float, now: float) -> float:
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(
+                    "SELECT tokens, updated FROM rate_limit_buckets WHERE key = ?", (key,)
+                ).fetchone()
+                (tokens, updated), wait = take_token(row, capacity, rate, now)
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO rate_limit_buckets (key, tokens, updated, full_at) VALUES (?, ?, ?, ?)",
+                    (key, tokens, updated, now + (capacity - tokens) / rate),
+                )
+                self.takes += 1
+                if self.takes % 1000 == 0:
+                    self.conn.execute("DELETE FROM rate_limit_buckets WHERE full_at <= ?", (now,))
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            return wait
+
+class RateLimiter:
+    """Named token-bucket budgets: scope -> (burst, refills per minute)"""
+
+    def __init__(self, backend, budgets: Dict[str, tuple]):
+        self.backend = backend
+        self.budgets = budgets
+        self.stats = {"allowed": 0, "rejected": {scope: 0 for scope in budgets}}
+
+    def check(self, scope: str, key: str):
+        """Spend one request of key's budget in scope; 429 with Retry-After when it is used up"""
+        burst, per_minute = self.budgets.get(scope, (0, 0))
+        if burst <= 0 or per_minute <= 0:
+            return
+        wait = self.backend.take(f"{scope}:{key}", burst, per_minute / 60, time.time())
+        if wait:
+            self.stats["rejected"][scope] += 1
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many attempts, please retry later",
+                headers={"Retry-After": str(math.ceil(wait))},
+            )
+        self.stats["allowed"] += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        return {"backend": self.backend.name, "budgets": self.budgets, **self.stats}
+
+def create_rate_limit_backend(kind: str = RATE_LIMIT_BACKEND):
+    if kind == "memory":
+        return MemoryRateLimitBackend()
+    if kind == "sqlite":
+        return SQLiteRateLimitBackend(RATE_LIMIT_SQLITE_PATH)
+    raise ValueError(f"Unknown RATE_LIMIT_BACKEND '{kind}' (expected 'memory' or 'sqlite')")
+
+auth_rate_limiter = RateLimiter(create_rate_limit_backend(), {
+    "ip": (AUTH_IP_BURST, AUTH_IP_PER_MINUTE),
+    "username": (AUTH_USERNAME_BURST, AUTH_USERNAME_PER_MINUTE),
+})
+
+def client_ip(request: Request) -> str:
+    if TRUST_FORWARDED_FOR:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            # The right-most entry is the one our proxy added
+            return forwarded.split(",")[-1].strip()
+    return request.client.host if request.client else "unknown"
+
+# ===== AI Response Cache =====
+
+# Successful content/quiz generations are cached on the normalized request
+# (whitespace and case of text fields ignored), so repeats skip the API call.
+AI_CACHE_SIZE = int(os.getenv("AI_CACHE_SIZE", 1000))  # entries, 0 disables
+AI_CACHE_TTL_SECONDS = int(os.getenv("AI_CACHE_TTL_SECONDS", 86400))
+AI_CACHE_BACKEND = os.getenv("AI_CACHE_BACKEND", "memory").lower()  # "memory" or "sqlite" (survives restarts)
+AI_CACHE_SQLITE_PATH = os.getenv("AI_CACHE_SQLITE_PATH", "ai_cache.db")
+
+class MemoryAICacheBackend:
+    """LRU of key -> (expires_at, result) for this process"""
+    name = "memory"
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: str, now: float, stale_ok: bool = False) -> tuple:
+        """Returns (result or None, whether the entry found had expired).
+
+        Expired entries stay until evicted: stale_ok returns them anyway.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None, False
+            if entry[0] <= now and not stale_ok:
+                return None, True
+            self.entries.move_to_end(key)
+            return entry[1], False
+
+    def put(self, key: str, result: dict, expires_at: float) -> int:
+        """Store a result; returns how many entries were evicted to make room"""
+        with self.lock:
+            self.entries[key] = (expires_at, result)
+            self.entries.move_to_end(key)
+            evicted = 0
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                evicted += 1
+            return evicted
+
+    def __len__(self):
+        return len(self.entries)
+
+class SQLiteAICacheBackend:
+    """Same LRU in a SQLite file, shared by the workers and kept across restarts"""
+    name = "sqlite"
+
+    def __init__(self, path: str, max_size: int):
+        self.max_size = max_size
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS ai_cache "
+            "(key TEXT PRIMARY KEY, result TEXT NOT NULL, expires_at REAL NOT NULL, used_at REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_ai_cache_used_at ON ai_cache (used_at)")
+        self.lock = threading.Lock()
+
+    def get(self, key: str, now: float, stale_ok: bool = False) -> tuple:
+        with self.lock:
+            row = self.conn.execute("SELECT result, expires_at FROM ai_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None, False
+            if row[1] <= now and not stale_ok:
+                return None, True
+            self.conn.execute("UPDATE ai_cache SET used_at = ? WHERE key = ?", (now, key))
+            return json.loads(row[0]), False
+
+    def put(self, key: str, result: dict, expires_at: float) -> int:
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO ai_cache (key, result, expires_at, used_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(result), expires_at, time.time()),
+            )
+            excess = len(self) - self.max_size
+            if excess > 0:
+                self.conn.execute(
+                    "DELETE FROM ai_cache WHERE key IN (SELECT key FROM ai_cache ORDER BY used_at LIMIT ?)", (excess,)
+                )
+            return max(excess, 0)
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM ai_cache").fetchone()[0]
+
+class AIResponseCache:
+    def __init__(self, backend, ttl_seconds: int):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.stats = {"hits": 0, "misses": 0, "bypassed": 0, "stored": 0, "expired": 0, "evicted": 0,
+                      "stale_served": 0, "tokens_saved": 0}
+
+    @staticmethod
+    def key(kind: str, arguments: dict) -> str:
+        def normalize(value):
+            if isinstance(value, str):
+                return " ".join(value.split()).casefold()
+            if isinstance(value, (list, tuple)):
+                return sorted(normalize(item) for item in value)
+            return value
+        payload = json.dumps([kind, {name: normalize(value) for name, value in arguments.items()}], sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        if self.backend is None:
+            return None
+        result, expired = self.backend.get(key, time.time())
+        self.stats["expired"] += expired
+        if result is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        self.stats["tokens_saved"] += result["metadata"].get("tokens_used") or 0  # None when a stream sent no usage
+        return {**result, "metadata": {**result["metadata"], "cached": True}}
+
+    def get_stale(self, key: str) -> Optional[dict]:
+        """The entry even past its TTL; for when a fresh answer cannot be generated"""
+        if self.backend is None:
+            return None
+        result, _ = self.backend.get(key, time.time(), stale_ok=True)
+        if result is None:
+            return None
+        self.stats["stale_served"] += 1
+        return {**result, "metadata": {**result["metadata"], "cached": True, "stale": True}}
+
+    def put(self, key: str, result: dict):
+        if self.backend is None:
+            return
+        self.stats["evicted"] += self.backend.put(key, result, time.time() + self.ttl_seconds)
+        self.stats["stored"] += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            "backend": self.backend.name if self.backend else None,
+            "size": len(self.backend) if self.backend else 0,
+            "max_size": AI_CACHE_SIZE,
+            "ttl_seconds": self.ttl_seconds,
+            **self.stats,
+            "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else None,
+        }
+
+def create_ai_cache_backend(kind: str = AI_CACHE_BACKEND, max_size: int = AI_CACHE_SIZE):
+    if max_size <= 0:
+        return None
+    if kind == "memory":
+        return MemoryAICacheBackend(max_size)
+    if kind == "sqlite":
+        return SQLiteAICacheBackend(AI_CACHE_SQLITE_PATH, max_size)
+    raise ValueError(f"Unknown AI_CACHE_BACKEND '{kind}' (expected 'memory' or 'sqlite')")
+
+ai_cache = AIResponseCache(create_ai_cache_backend(), AI_CACHE_TTL_SECONDS)
+
+# Single flight: cache key -> the task generating it, shared by identical concurrent calls
+ai_in_flight: Dict[str, asyncio.Future] = {}
+ai_single_flight = {"upstream": 0, "coalesced": 0}
+
+def single_flight_metrics() -> Dict[str, Any]:
+    total = ai_single_flight["upstream"] + ai_single_flight["coalesced"]
+    return {
+        **ai_single_flight,
+        "in_flight": len(ai_in_flight),
+        "coalesced_rate": round(ai_single_flight["coalesced"] / total, 4) if total else None
+    }
+
+def cache_ai_response(kind: str):
+    """Serve an AI generation function from ai_cache.
+
+    The wrapped function gains a no_cache keyword that skips the lookup
+    (the fresh result still replaces the cached one). Only successful
+    results are stored; expired ones still stand in while OpenAI is
+    unavailable. Calls whose key is already being generated wait for that
+    upstream completion instead of starting another one; this applies to
+    no_cache calls too, since the shared result is just as fresh.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        def cache_key(*args, **kwargs) -> str:
+            arguments = signature.bind(*args, **kwargs)
+            arguments.apply_defaults()
+            return AIResponseCache.key(kind, arguments.arguments)
+
+        @functools.wraps(func)
+        async def wrapper(*args, no_cache: bool = False, **kwargs):
+            key = cache_key(*args, **kwargs)
+            if no_cache:
+                ai_cache.stats["bypassed"] += 1
+            else:
+                cached = ai_cache.get(key)
+                if cached is not None:
+                    return cached
+            flight = ai_in_flight.get(key)
+            if flight is not None:
+                ai_single_flight["coalesced"] += 1
+                # shield: a disconnecting waiter must not cancel the shared call
+                result = await asyncio.shield(flight)
+                return {**result, "metadata": {**result.get("metadata", {}), "coalesced": True}}
+
+            async def generate():
+                try:
+                    result = await func(*args, **kwargs)
+                except AIUnavailableError:
+                    stale = ai_cache.get_stale(key)
+                    if stale is None:
+                        raise
+                    return stale
+                if result["success"]:
+                    ai_cache.put(key, result)
+                return result
+
+            flight = asyncio.ensure_future(generate())
+            ai_in_flight[key] = flight
+            flight.add_done_callback(lambda _: ai_in_flight.pop(key, None))
+            ai_single_flight["upstream"] += 1
+            return await asyncio.shield(flight)
+
+        # Lets the streaming routes share entries with the wrapped function
+        wrapper.cache_key = cache_key
+        return wrapper
+    return decorator
+
+# ===== AI Token Accounting =====
+
+# Upstream tokens are counted per user, course and endpoint in a ring of
+# fixed-width time buckets per key, so recording is O(1) and the usage of the
+# last AI_USAGE_BUCKETS buckets (a rolling window) is a short sum. Budgets
+# are per window and per worker process; 0 means unlimited.
+AI_USAGE_BUCKET_SECONDS = int(os.getenv("AI_USAGE_BUCKET_SECONDS", 3600))
+AI_USAGE_BUCKETS = int(os.getenv("AI_USAGE_BUCKETS", 24))  # window = buckets x bucket seconds
+AI_USER_TOKEN_BUDGET = int(os.getenv("AI_USER_TOKEN_BUDGET", 0))  # per user (admins exempt)
+AI_COURSE_TOKEN_BUDGET = int(os.getenv("AI_COURSE_TOKEN_BUDGET", 0))  # per course, all users together
+
+# (user id, course id, endpoint) of the request being served, read where the
+# upstream call returns its usage; set by start_ai_call in each AI route
+ai_caller: ContextVar[Optional[tuple]] = ContextVar("ai_caller", default=None)
+
+class UsageRing:
+    """Token and call counts of one key in the last len(starts) buckets"""
+    __slots__ = ("starts", "tokens", "calls")
+
+    def __init__(self, size: int):
+        self.starts = [-1] * size  # bucket number each slot currently holds
+        self.tokens = [0] * size
+        self.calls = [0] * size
+
+    def add(self, bucket: int, tokens: int):
+        slot = bucket % len(self.starts)
+        if self.starts[slot] != bucket:
+            self.starts[slot], self.tokens[slot], self.calls[slot] = bucket, 0, 0
+        self.tokens[slot] += tokens
+        self.calls[slot] += 1
+
+    def live_slots(self, bucket: int) -> List[int]:
+        """Slots inside the window ending at bucket, oldest first"""
+        oldest = bucket - len(self.starts) + 1
+        return sorted((slot for slot, start in enumerate(self.starts) if start >= oldest),
+                      key=lambda slot: self.starts[slot])
+
+    def totals(self, bucket: int) -> tuple:
+        oldest = bucket - len(self.starts) + 1
+        tokens = calls = 0
+        for start, slot_tokens, slot_calls in zip(self.starts, self.tokens, self.calls):
+            if start >= oldest:
+                tokens += slot_tokens
+                calls += slot_calls
+        return tokens, calls
+
+class AIUsageLedger:
+    def __init__(self, bucket_seconds: int = AI_USAGE_BUCKET_SECONDS, buckets: int = AI_USAGE_BUCKETS,
+                 user_budget: int = AI_USER_TOKEN_BUDGET, course_budget: int = AI_COURSE_TOKEN_BUDGET):
+        self.bucket_seconds = bucket_seconds
+        self.buckets = buckets
+        self.budgets = {"user": user_budget, "course": course_budget}
+        self.rings: Dict[tuple, UsageRing] = {}  # (scope, id) -> ring
+        self.lock = threading.Lock()
+        self.stats = {"recorded_calls": 0, "recorded_tokens": 0, "unattributed_calls": 0, "rejected": 0}
+
+    def bucket(self, now: float) -> int:
+        return int(now // self.bucket_seconds)
+
+    def record(self, caller: Optional[tuple], tokens: int, now: Optional[float] = None):
+        """Add one upstream call's tokens to the caller's user, course and endpoint"""
+        bucket = self.bucket(time.time() if now is None else now)
+        if caller is None:
+            self.stats["unattributed_calls"] += 1
+            caller = (None, None, "unattributed")
+        user_id, course_id, endpoint = caller
+        keys = [("endpoint", endpoint)]
+        if user_id is not None:
+            keys.append(("user", user_id))
+        if course_id is not None:
+            keys.append(("course", course_id))
+        with self.lock:
+            for key in keys:
+                ring = self.rings.get(key)
+                if ring is None:
+                    ring = self.rings[key] = UsageRing(self.buckets)
+                ring.add(bucket, tokens)
+            self.stats["recorded_calls"] += 1
+            self.stats["recorded_tokens"] += tokens
+
+    def usage(self, scope: str, key, now: Optional[float] = None) -> tuple:
+        """(tokens, calls) of one key over the window"""
+        ring = self.rings.get((scope, key))
+        return ring.totals(self.bucket(time.time() if now is None else now)) if ring else (0, 0)
+
+    def retry_after(self, scope: str, key, budget: int, now: float) -> int:
+        """Seconds until enough old buckets leave the window to bring usage under budget"""
+        ring = self.rings[(scope, key)]
+        bucket = self.bucket(now)
+        excess = ring.totals(bucket)[0] - budget + 1
+        for slot in ring.live_slots(bucket):
+            excess -= ring.tokens[slot]
+            if excess <= 0:
+                return max(int((ring.starts[slot] + self.buckets) * self.bucket_seconds - now) + 1, 1)
+        return self.buckets * self.bucket_seconds
+
+    def check(self, user: dict, course_id: Optional[int] = None):
+        """429 when the user (admins exempt) or the course has spent its budget"""
+        now = time.time()
+        scopes = []
+        if user["role"] != "admin":
+            scopes.append(("user", user["id"]))
+        if course_id is not None:
+            scopes.append(("course", course_id))
+        for scope, key in scopes:
+            budget = self.budgets[scope]
+            if budget and self.usage(scope, key, now)[0] >= budget:
+                self.stats["rejected"] += 1
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail=f"AI token budget of this {scope} is used up",
+                    headers={"Retry-After": str(self.retry_after(scope, key, budget, now))}
+                )
+
+    def report(self, scope: str, top: int) -> List[dict]:
+        """The heaviest keys of a scope over the window, with their hourly buckets"""
+        bucket = self.bucket(time.time())
+        rows = []
+        with self.lock:
+            for (ring_scope, key), ring in list(self.rings.items()):
+                if ring_scope != scope:
+                    continue
+                tokens, calls = ring.totals(bucket)
+                if not calls:
+                    del self.rings[(ring_scope, key)]  # idle for a whole window
+                    continue
+                budget = self.budgets.get(scope, 0)
+                rows.append({
+                    "id": key,
+                    "tokens": tokens,
+                    "calls": calls,
+                    "budget": budget or None,
+                    "remaining": max(budget - tokens, 0) if budget else None,
+                    "buckets": [
+                        {"start": datetime.fromtimestamp(ring.starts[slot] * self.bucket_seconds, timezone.utc).isoformat(),
+                         "tokens": ring.tokens[slot], "calls": ring.calls[slot]}
+                        for slot in ring.live_slots(bucket)
+                    ],
+                })
+        return heapq.nlargest(top, rows, key=lambda row: row["tokens"])
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "bucket_seconds": self.bucket_seconds,
+            "buckets": self.buckets,
+            "user_budget": self.budgets["user"] or None,
+            "course_budget": self.budgets["course"] or None,
+            "tracked_keys": len(self.rings),
+            **self.stats,
+        }
+
+ai_usage = AIUsageLedger()
+
+def start_ai_call(current_user: dict, endpoint: str, course_id: Optional[int] = None):
+    """Enforce the caller's token budgets and bill the upstream calls that follow to them"""
+    ai_usage.check(current_user, course_id)
+    ai_caller.set((current_user["id"], course_id, endpoint))
+
+# ===== AI Resilience =====
+
+# Every upstream call has a deadline (per endpoint, covering retries and the
+# wait for an ai_semaphore slot). Timeouts, connection errors, 429s and 5xx
+# are retried with jittered exponential backoff while the deadline allows;
+# running out of time queued behind our own calls is answered "busy" and
+# neither retried nor held against OpenAI.
+# A circuit breaker watches the outcome of recent attempts and, once too many
+# fail, fails calls fast for a cooldown instead of letting each one time out;
+# cached answers (even expired ones) are still served meanwhile.
+AI_MAX_RETRIES = int(os.getenv("AI_MAX_RETRIES", 2))
+AI_RETRY_BASE_SECONDS = float(os.getenv("AI_RETRY_BASE_SECONDS", 0.5))  # backoff before jitter: base x 2^attempt
+# "endpoint=seconds" pairs; other endpoints get AI_TIMEOUT_SECONDS
+AI_ENDPOINT_DEADLINES = {
+    name.strip(): float(seconds)
+    for name, seconds in (
+        pair.split("=") for pair in os.getenv(
+            "AI_ENDPOINT_DEADLINES",
+            "study-assistant=20,study-assistant/stream=20,explain-concept=30,explain-concept/stream=30"
+        ).split(",") if pair.strip()
+    )
+}
+AI_BREAKER_WINDOW = int(os.getenv("AI_BREAKER_WINDOW", 20))  # recent attempts considered
+AI_BREAKER_MIN_CALLS = int(os.getenv("AI_BREAKER_MIN_CALLS", 10))  # attempts needed before it can open
+AI_BREAKER_FAILURE_RATE = float(os.getenv("AI_BREAKER_FAILURE_RATE", 0.5))
+AI_BREAKER_COOLDOWN_SECONDS = float(os.getenv("AI_BREAKER_COOLDOWN_SECONDS", 30))
+
+RETRYABLE_AI_ERRORS = (APIConnectionError, RateLimitError, InternalServerError, asyncio.TimeoutError)  # APITimeoutError is an APIConnectionError
+
+class AIUnavailableError(HTTPException):
+    """OpenAI is failing or the circuit is open; a 503 with Retry-After"""
+
+    def __init__(self, detail: str, retry_after: float):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=detail,
+            headers={"Retry-After": str(max(math.ceil(retry_after), 1))}
+        )
+
+class CircuitBreaker:
+    """closed -> open when failure_rate of the last window attempts failed.
+
+    Open rejects calls for cooldown seconds, then half-open lets a single
+    probe through: its success closes the circuit, its failure reopens it.
+    """
+
+    def __init__(self, window: int = AI_BREAKER_WINDOW, min_calls: int = AI_BREAKER_MIN_CALLS,
+                 failure_rate: float = AI_BREAKER_FAILURE_RATE, cooldown: float = AI_BREAKER_COOLDOWN_SECONDS):
+        self.outcomes = deque(maxlen=window)  # True for a failed attempt
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.probing = False
+        self.stats = {"opened": 0, "rejected": 0}
+
+    def retry_after(self) -> float:
+        if self.state == "open":
+            return self.opened_at + self.cooldown - time.monotonic()
+        return AI_RETRY_BASE_SECONDS * 2 ** AI_MAX_RETRIES
+
+    def before_call(self):
+        """Raise AIUnavailableError unless an attempt may go upstream now"""
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = "half_open"
+        if self.state == "open" or (self.state == "half_open" and self.probing):
+            self.stats["rejected"] += 1
+            raise AIUnavailableError("AI service is temporarily unavailable, please try again shortly", self.retry_after())
+        if self.state == "half_open":
+            self.probing = True
+
+    def record(self, failed: Optional[bool]):
+        """Outcome of an attempt let through by before_call (None: cancelled, no verdict)"""
+        if self.state == "half_open" and self.probing:
+            self.probing = False
+            if failed:
+                self.open()
+            elif failed is not None:
+                self.state = "closed"
+                self.outcomes.clear()
+            return
+        if failed is None:
+            return
+        self.outcomes.append(failed)
+        if (failed and self.state == "closed" and len(self.outcomes) >= self.min_calls
+                and sum(self.outcomes) / len(self.outcomes) >= self.failure_rate):
+            self.open()
+
+    def open(self):
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self.stats["opened"] += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "recent_attempts": len(self.outcomes),
+            "recent_failure_rate": round(sum(self.outcomes) / len(self.outcomes), 4) if self.outcomes else None,
+            "retry_after_seconds": round(self.retry_after(), 1) if self.state == "open" else None,
+            "failure_rate_threshold": self.failure_rate,
+            "cooldown_seconds": self.cooldown,
+            **self.stats,
+        }
+
+ai_breaker = CircuitBreaker()
+
+def ai_deadline() -> float:
+    """Deadline of the endpoint being served (see start_ai_call)"""
+    caller = ai_caller.get()
+    return AI_ENDPOINT_DEADLINES.get(caller[2], AI_TIMEOUT_SECONDS) if caller else AI_TIMEOUT_SECONDS
+
+def retry_delay(attempt: int) -> float:
+    """Full jitter: uniform in [0, base x 2^attempt], so retrying clients spread out"""
+    return random.uniform(0, AI_RETRY_BASE_SECONDS * 2 ** attempt)
+
+def ai_busy_error() -> AIUnavailableError:
+    ai_stats["local_timeouts"] += 1
+    return AIUnavailableError("AI service is busy, please try again shortly", ai_breaker.retry_after())
+
+def describe_ai_failure(error: Optional[Exception]) -> str:
+    if error is None or isinstance(error, (APITimeoutError, asyncio.TimeoutError)):
+        return "AI service did not answer in time"
+    if isinstance(error, APIStatusError):
+        return f"AI service failed (HTTP {error.status_code})"
+    return f"AI service could not be reached ({error})"
+
+async def call_upstream(make_call, timeout: Optional[float] = None, keep_slot: bool = False):
+    """await make_call(seconds_left) under the deadline, retries and circuit breaker.
+
+    Each attempt takes an ai_semaphore slot (see acquire_ai_slot) before
+    the breaker judges it: running out of time in that queue, or timing out
+    upstream after waiting there for more than half the time the attempt
+    had, says nothing about OpenAI, so it is neither retried nor recorded
+    (nor counted as failed). The slot is released
+    between attempts; with keep_slot the successful attempt's slot is still
+    held on return, for the caller to release_ai_slot.
+
+    Raises AIUnavailableError when the circuit is open, we are too busy or
+    no attempt succeeded in time; errors that retrying cannot fix are
+    raised as is.
+    """
+    budget = timeout or ai_deadline()
+    deadline = time.monotonic() + budget
+    last_error = None
+    for attempt in range(AI_MAX_RETRIES + 1):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        ai_breaker.before_call()
+        failed = None  # no verdict unless the request was sent
+        holding = sent = False
+        queued_at = time.monotonic()
+        try:
+            try:
+                await acquire_ai_slot(remaining)
+            except asyncio.TimeoutError:
+                raise ai_busy_error() from None
+            holding = True
+            waited = time.monotonic() - queued_at
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise ai_busy_error()
+            sent = True
+            result = await asyncio.wait_for(make_call(remaining), remaining)
+            failed = False
+            holding = not keep_slot
+            return result
+        except RETRYABLE_AI_ERRORS as e:
+            if not sent:
+                raise
+            if isinstance(e, (APITimeoutError, asyncio.TimeoutError)):
+                if waited > remaining:  # the queue took over half of this attempt's time
+                    raise ai_busy_error() from e
+                ai_stats["timeouts"] += 1
+            ai_stats["failed"] += 1
+            failed = True
+            last_error = e
+        except Exception:
+            if sent:
+                ai_stats["failed"] += 1
+                failed = False  # OpenAI answered; the request itself was refused
+            raise
+        finally:
+            ai_breaker.record(failed)
+            if holding:
+                release_ai_slot()
+        delay = retry_delay(attempt)
+        if attempt == AI_MAX_RETRIES or time.monotonic() + delay >= deadline:
+            break
+        ai_stats["retries"] += 1
+        await asyncio.sleep(delay)
+    ai_stats["gave_up"] += 1
+    raise AIUnavailableError(describe_ai_failure(last_error), ai_breaker.retry_after())
 
 # AI Utility Functions
-def generate_educational_content(prompt: str, content_type: str, subject: str = None, difficulty: str = "intermediate", length: str = "medium") -> Dict[str, Any]:
+ai_semaphore = asyncio.Semaphore(AI_MAX_CONCURRENCY)
+ai_stats = {
+    "in_flight": 0, "waiting": 0, "completed": 0, "failed": 0, "timeouts": 0, "retries": 0, "gave_up": 0,
+    "local_timeouts": 0,
+}
+
+async def acquire_ai_slot(timeout: Optional[float] = None):
+    """Take an ai_semaphore slot (asyncio.TimeoutError after timeout seconds); pair with release_ai_slot"""
+    ai_stats["waiting"] += 1
+    try:
+        await asyncio.wait_for(ai_semaphore.acquire(), timeout)
+    finally:
+        # Also when cancelled or timed out while queued
+        ai_stats["waiting"] -= 1
+    ai_stats["in_flight"] += 1
+
+def release_ai_slot():
+    ai_stats["in_flight"] -= 1
+    ai_semaphore.release()
+
+async def create_chat_completion(timeout: Optional[float] = None, **kwargs):
+    """chat.completions.create on the shared client, bounded by ai_semaphore, through call_upstream"""
+    response = await call_upstream(
+        lambda remaining: openai_client.chat.completions.create(timeout=remaining, **kwargs), timeout
+    )
+    ai_stats["completed"] += 1
+    if response.usage:
+        ai_usage.record(ai_caller.get(), response.usage.total_tokens)
+    return response
+
+async def stream_chat_completion(timeout: Optional[float] = None, **kwargs):
+    """Streaming create_chat_completion: yields chunks, holding a slot until the stream ends.
+
+    Opening the stream goes through call_upstream; a stream that breaks
+    after it started is not retried, as its tokens were already sent.
+    """
+    stream = await call_upstream(lambda remaining: openai_client.chat.completions.create(
+        timeout=remaining, stream=True, stream_options={"include_usage": True}, **kwargs
+    ), timeout, keep_slot=True)
+    try:
+        async for chunk in stream:
+            if chunk.usage:
+                ai_usage.record(ai_caller.get(), chunk.usage.total_tokens)
+            yield chunk
+    except APITimeoutError:
+        ai_stats["timeouts"] += 1
+        raise
+    except Exception:
+        ai_stats["failed"] += 1
+        raise
+    finally:
+        release_ai_slot()
+        # Also reached when the client disconnects mid-stream
+        await stream.close()
+    ai_stats["completed"] += 1
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_ai_events(messages: List[dict], metadata: dict, max_tokens: int, temperature: float,
+                           cache_key: Optional[str] = None, no_cache: bool = False):
+    """Relay a completion as server-sent events.
+
+    Emits a "token" event per text delta, then "done" with the metadata
+    (including tokens_used), or "error". With a cache_key the answer is
+    served from / stored in ai_cache like the non-streaming call.
+    """
+    if cache_key and not no_cache:
+        cached = ai_cache.get(cache_key)
+        if cached is not None:
+            yield sse_event("token", {"content": cached["content"]})
+            yield sse_event("done", {"metadata": cached["metadata"], "success": True})
+            return
+    elif cache_key:
+        ai_cache.stats["bypassed"] += 1
+
+    parts = []
+    tokens_used = None
+    try:
+        async for chunk in stream_chat_completion(
+            model="gpt-3.5-turbo", messages=messages, max_tokens=max_tokens, temperature=temperature
+        ):
+            if chunk.usage:
+                tokens_used = chunk.usage.total_tokens
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+                yield sse_event("token", {"content": chunk.choices[0].delta.content})
+    except AIUnavailableError as e:
+        stale = ai_cache.get_stale(cache_key) if cache_key and not parts else None
+        if stale is None:
+            yield sse_event("error", {"success": False, "error_message": e.detail})
+        else:
+            yield sse_event("token", {"content": stale["content"]})
+            yield sse_event("done", {"metadata": stale["metadata"], "success": True})
+        return
+    except Exception as e:
+        yield sse_event("error", {"success": False, "error_message": str(e)})
+        return
+
+    result = {"content": "".join(parts), "metadata": {**metadata, "tokens_used": tokens_used}, "success": True}
+    if cache_key:
+        ai_cache.put(cache_key, result)
+    yield sse_event("done", {"metadata": result["metadata"], "success": True})
+
+def sse_response(events) -> StreamingResponse:
+    # X-Accel-Buffering stops nginx-style proxies from holding the events back
+    return StreamingResponse(events, media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def content_messages(prompt: str, content_type: str, subject: str = None, difficulty: str = "intermediate", length: str = "medium") -> List[dict]:
+    """Chat messages for a content generation request"""
+    # Customize system prompt based on content type
+    system_prompts = {
+        "lesson": f"You are an expert educator creating {difficulty} level lesson content for {subject or 'general studies'}. Create engaging, well-structured educational material.",
+        "quiz": f"You are an expert educator creating {difficulty} level quiz questions for {subject or 'general studies'}. Create clear, fair, and educational quiz content.",
+        "assignment": f"You are an expert educator creating {difficulty} level assignments for {subject or 'general studies'}. Create meaningful, practical assignments that reinforce learning.",
+        "explanation": f"You are an expert tutor providing {difficulty} level explanations for {subject or 'general studies'}. Provide clear, comprehensive explanations."
+    }
+    
+    length_instructions = {
+        "short": "Keep the response concise and focused (200-400 words).",
+        "medium": "Provide a moderate length response (400-800 words).",
+        "long": "Create a comprehensive, detailed response (800-1200 words)."
+    }
+    
+    system_prompt = system_prompts.get(content_type, system_prompts["explanation"])
+    system_prompt += f" {length_instructions.get(length, length_instructions['medium'])}"
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": prompt}
+    ]
+
+@cache_ai_response("content")
+async def generate_educational_content(prompt: str, content_type: str, subject: str = None, difficulty: str = "intermediate", length: str = "medium") -> Dict[str, Any]:
     """Generate educational content using OpenAI GPT"""
     if not openai_client:
         return {
@@ -256,29 +1269,9 @@ def generate_educational_content(prompt: str, content_type: str, subject: str =
         }
     
     try:
-        # Customize system prompt based on content type
-        system_prompts = {
-            "lesson": f"You are an expert educator creating {difficulty} level lesson content for {subject or 'general studies'}. Create engaging, well-structured educational material.",
-            "quiz": f"You are an expert educator creating {difficulty} level quiz questions for {subject or 'general studies'}. Create clear, fair, and educational quiz content.",
-            "assignment": f"You are an expert educator creating {difficulty} level assignments for {subject or 'general studies'}. Create meaningful, practical assignments that reinforce learning.",
-            "explanation": f"You are an expert tutor providing {difficulty} level explanations for {subject or 'general studies'}. Provide clear, comprehensive explanations."
-        }
-        
-        length_instructions = {
-            "short": "Keep the response concise and focused (200-400 words).",
-            "medium": "Provide a moderate length response (400-800 words).",
-            "long": "Create a comprehensive, detailed response (800-1200 words)."
-        }
-        
-        system_prompt = system_prompts.get(content_type, system_prompts["explanation"])
-        system_prompt += f" {length_instructions.get(length, length_instructions['medium'])}"
-        
-        response = openai_client.chat.completions.create(
+        response = await create_chat_completion(
             model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
-            ],
+            messages=content_messages(prompt, content_type, subject, difficulty, length),
             max_tokens=1500,
             temperature=0.7
         )
@@ -294,6 +1287,8 @@ def generate_educational_content(prompt: str, content_type: str, subject: str =
             },
             "success": True
         }
+    except AIUnavailableError:
+        raise
     except Exception as e:
         return {
             "content": "",
@@ -302,7 +1297,8 @@ def generate_educational_content(prompt: str, content_type: str, subject: str =
             "error_message": str(e)
         }
 
-def generate_quiz(topic: str, num_questions: int = 5, difficulty: str = "intermediate", question_types: List[str] = None) -> Dict[str, Any]:
+@cache_ai_response("quiz")
+async def generate_quiz(topic: str, num_questions: int = 5, difficulty: str = "intermediate", question_types: List[str] = None) -> Dict[str, Any]:
     """Generate quiz questions using OpenAI GPT"""
     if question_types is None:
         question_types = ["multiple_choice", "true_false"]
@@ -338,7 +1334,7 @@ Format as JSON with this structure:
 Ensure all questions are educational, clear, and appropriate for {difficulty} level.
 """
         
-        response = openai_client.chat.completions.create(
+        response = await create_chat_completion(
             model="gpt-3.5-turbo",
             messages=[
                 {"role": "system", "content": "You are an expert educator creating educational quizzes. Always respond with valid JSON format."},
@@ -366,6 +1362,8 @@ Ensure all questions are educational, clear, and appropriate for {difficulty} le
             },
             "success": True
         }
+    except AIUnavailableError:
+        raise
     except Exception as e:
         return {
             "content": {},
@@ -374,7 +1372,62 @@ Ensure all questions are educational, clear, and appropriate for {difficulty} le
             "error_message": str(e)
         }
 
-def study_assistant(question: str, context: str = None, course_info: str = None) -> Dict[str, Any]:
+def validate_quiz(quiz: Any) -> Optional[str]:
+    """Why a generated quiz is unusable, or None when it has well-formed questions"""
+    if not isinstance(quiz, dict) or "raw_content" in quiz:
+        return "Quiz was not valid JSON"
+    questions = quiz.get("questions")
+    if not isinstance(questions, list) or not questions:
+        return "Quiz has no questions"
+    for number, question in enumerate(questions, 1):
+        if not isinstance(question, dict) or not question.get("question") or "correct_answer" not in question:
+            return f"Question {number} is missing its text or correct answer"
+    return None
+
+async def generate_quiz_batch(items: List[QuizBatchItem], concurrency: int = AI_BATCH_CONCURRENCY) -> List[Dict[str, Any]]:
+    """generate_quiz for every item, at most concurrency at a time, results in item order.
+
+    Each result is the generate_quiz result, with success False (and an
+    error_message) when the quiz did not validate or could not be generated
+    (e.g. OpenAI unavailable), so one item never fails the others.
+    """
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+    async def generate(item: QuizBatchItem) -> Dict[str, Any]:
+        async with semaphore:
+            try:
+                result = await generate_quiz(
+                    topic=item.topic,
+                    num_questions=item.num_questions,
+                    difficulty=item.difficulty,
+                    question_types=item.question_types,
+                    no_cache=item.no_cache
+                )
+            except HTTPException as e:
+                return {"content": {}, "metadata": {}, "success": False, "error_message": e.detail}
+        if result["success"]:
+            error = validate_quiz(result["content"])
+            if error:
+                return {**result, "success": False, "error_message": error}
+        return result
+
+    return await asyncio.gather(*(generate(item) for item in items))
+
+def study_assistant_messages(question: str, context: str = None, course_info: str = None) -> List[dict]:
+    """Chat messages for a study assistant question"""
+    system_prompt = "You are a helpful AI tutor assistant. Provide clear, educational answers to student questions. Be encouraging and supportive while maintaining academic accuracy."
+    
+    user_prompt = f"Student Question: {question}"
+    if context:
+        user_prompt += f"\n\nContext: {context}"
+    if course_info:
+        user_prompt += f"\n\nCourse Information: {course_info}"
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+async def study_assistant(question: str, context: str = None, course_info: str = None) -> Dict[str, Any]:
     """AI study assistant to help students with questions"""
     if not openai_client:
         return {
@@ -385,20 +1438,9 @@ def study_assistant(question: str, context: str = None, course_info: str = None)
         }
     
     try:
-        system_prompt = "You are a helpful AI tutor assistant. Provide clear, educational answers to student questions. Be encouraging and supportive while maintaining academic accuracy."
-        
-        user_prompt = f"Student Question: {question}"
-        if context:
-            user_prompt += f"\n\nContext: {context}"
-        if course_info:
-            user_prompt += f"\n\nCourse Information: {course_info}"
-            
-        response = openai_client.chat.completions.create(
+        response = await create_chat_completion(
             model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
+            messages=study_assistant_messages(question, context, course_info),
             max_tokens=1000,
             temperature=0.7
         )
@@ -413,6 +1455,8 @@ def study_assistant(question: str, context: str = None, course_info: str = None)
             },
             "success": True
         }
+    except AIUnavailableError:
+        raise
     except Exception as e:
         return {
             "content": "I apologize, but I'm unable to process your question at the moment. Please try again later or contact your instructor for assistance.",
@@ -421,115 +1465,1356 @@ def study_assistant(question: str, context: str = None, course_info: str = None)
             "error_message": str(e)
         }
 
-# In-memory storage (replace with actual database in production)
-users_db = [
-    {
-        "id": 1,
-        "username": "admin",
-        "email": "admin@hbiu.edu",
-        "password": get_password_hash("admin123"),
-        "role": "admin",
-        "created_at": datetime.now(timezone.utc)
-    },
-    {
-        "id": 2,
-        "username": "lecturer1",
-        "email": "lecturer1@hbiu.edu",
-        "password": get_password_hash("lecturer123"),
-        "role": "lecturer",
-        "created_at": datetime.now(timezone.utc)
-    },
-    {
-        "id": 3,
-        "username": "student1",
-        "email": "student1@hbiu.edu",
-        "password": get_password_hash("student123"),
-        "role": "student",
-        "created_at": datetime.now(timezone.utc)
-    }
-]
+# ===== Storage Engines =====
 
-courses_db = [
-    {
-        "id": 1,
-        "title": "Introduction to Computer Science",
-        "description": "Basic programming concepts and algorithms",
-        "instructor": "Dr. Smith",
-        "created_at": datetime.now(timezone.utc)
-    },
-    {
-        "id": 2,
-        "title": "Web Development",
-        "description": "Full-stack web development with modern frameworks",
-        "instructor": "Prof. Johnson",
-        "created_at": datetime.now(timezone.utc)
-    },
-    {
-        "id": 3,
-        "title": "Database Systems",
-        "description": "Database design and SQL fundamentals",
-        "instructor": "Dr. Williams",
-        "created_at": datetime.now(timezone.utc)
-    }
+# Collections backing the auth helpers and /api/courses. Names starting with
+# "_" are internal and never reachable through the /api/entities routes.
+USERS_COLLECTION = "_users"
+COURSES_COLLECTION = "_courses"
+# Used refresh token ids and revoked token families, kept until they expire
+REVOKED_TOKENS_COLLECTION = "_revoked_tokens"
+
+# Entity collections known up front (others are created on first use)
+ENTITY_NAMES = [
+    "User",
+    "Course",
+    "Enrollment",
+    "Assignment",
+    "College",
+    "Module",
+    "Announcement",
+    "Quiz",
+    "Submission",
+    "SystemSetting",
+    "StaffApplication",
+    "UniversityAnnouncement",
+    "Notification",
+    "InternalMessage",
+    "Document",
+    "DocumentVersion",
+    "CollegeTransferHistory",
+    "AuditLog",
+    "EmployeeRecord",
+    "LeaveRequest",
+    "PerformanceReview",
+    "PayrollRecord",
+    "CommunityGroup",
+    "CommunityMember",
+    "CommunityPost",
+    "SystemAccess",
 ]
 
-def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
-    to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.now(timezone.utc) + expires_delta
-    else:
-        expire = datetime.now(timezone.utc) + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+# Secondary equality indexes used by the filter route.
+# Declared here per entity, extended with ENTITY_INDEXES="Entity.field,..."
+# and learned automatically once a field is filtered on often enough.
+ENTITY_INDEXES = {
+    USERS_COLLECTION: ["username_key", "email_key", "role"],
+    "Enrollment": ["courseId", "studentId"],
+    "Assignment": ["courseId"],
+    "Module": ["courseId"],
+    "Announcement": ["courseId"],
+    "Quiz": ["courseId"],
+    "Submission": ["assignmentId", "studentId"],
+    "Notification": ["userId"],
+    "AuditLog": ["userId"],
+}
+for declared in filter(None, os.getenv("ENTITY_INDEXES", "").split(",")):
+    declared_entity, _, declared_field = declared.strip().partition(".")
+    ENTITY_INDEXES.setdefault(declared_entity, []).append(declared_field)
 
-def get_user_by_username(username: str):
-    for user in users_db:
-        if user["username"] == username:
-            return user
-    return None
+ENTITY_AUTO_INDEX_THRESHOLD = int(os.getenv("ENTITY_AUTO_INDEX_THRESHOLD", 50))  # 0 disables
+ENTITY_AUTO_INDEX_MAX = int(os.getenv("ENTITY_AUTO_INDEX_MAX", 8))  # learned indexes per entity
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+# Sort fields served from maintained ordered indexes. SORTABLE_FIELDS apply
+# to every entity; more are declared per entity here or extended with
+# ENTITY_SORT_FIELDS="Entity.field,...". Any other field can still be sorted
+# on, at the cost of a partial sort per request.
+SORTABLE_FIELDS = ['created_at', 'createdAt', 'id']
+ENTITY_SORT_FIELDS = {
+    "Page": ["order", "updated_at"],
+    "Module": ["order"],
+    "Assignment": ["dueDate", "updated_at"],
+    "Quiz": ["dueDate"],
+    "Announcement": ["updated_at"],
+    "UniversityAnnouncement": ["updated_at"],
+    "Notification": ["updated_at"],
+}
+for declared in filter(None, os.getenv("ENTITY_SORT_FIELDS", "").split(",")):
+    declared_entity, _, declared_field = declared.strip().partition(".")
+    ENTITY_SORT_FIELDS.setdefault(declared_entity, []).append(declared_field)
+
+def has_sort_index(entity_name: str, sort_field: Optional[str]) -> bool:
+    return sort_field in SORTABLE_FIELDS or sort_field in ENTITY_SORT_FIELDS.get(entity_name, ())
+
+ENTITY_BULK_MAX_ITEMS = int(os.getenv("ENTITY_BULK_MAX_ITEMS", 10000))
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", 1000))  # records per streamed chunk
+
+STORAGE_ENGINE = os.getenv("STORAGE_ENGINE", "memory").lower()  # "memory" or "sqlite"
+SQLITE_PATH = os.getenv("SQLITE_PATH", "hbiu.db")
+# Write log for the memory engine; empty keeps it volatile
+MEMORY_LOG_DIR = os.getenv("MEMORY_LOG_DIR", "")
+MEMORY_LOG_FSYNC_MS = int(os.getenv("MEMORY_LOG_FSYNC_MS", 100))  # 0 fsyncs every write
+MEMORY_SNAPSHOT_EVERY = int(os.getenv("MEMORY_SNAPSHOT_EVERY", 100000))  # logged writes per snapshot, 0 disables
+
+class DuplicateEntityError(Exception):
+    """Raised when a record is inserted with an id that is already taken"""
+
+def _is_hashable(value) -> bool:
     try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-    except jwt.ExpiredSignatureError:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Token expired",
+        hash(value)
+        return True
+    except TypeError:
+        return False
+
+def _compact_json(value) -> str:
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False, default=str)
+
+def _order_key(value):
+    """Total order over JSON values, shared by every storage engine.
+
+    Missing and null values come first, then numbers (booleans count as 0/1),
+    then strings. Objects and arrays are ordered by their compact JSON text
+    alongside the strings, which is how SQLite compares json_extract results.
+    """
+    if value is None:
+        return (0, 0)
+    if isinstance(value, (bool, int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    return (2, _compact_json(value))
+
+def _record_sort_key(record: dict, sort_field: str):
+    """Sort position of a record; the id breaks ties so every position is unique"""
+    return (_order_key(record.get(sort_field)), _order_key(record.get('id')))
+
+def _cursor_sort_key(after):
+    """Sort position of an (value, id) cursor"""
+    return None if after is None else (_order_key(after[0]), _order_key(after[1]))
+
+def _select_sorted(records, sort_field: str, reverse: bool, limit: Optional[int], after=None) -> List[dict]:
+    """First `limit` records after the cursor, without sorting everything.
+
+    Partial selection with a heap costs O(m log k) for k of m records.
+    """
+    after_key = _cursor_sort_key(after)
+    if after_key is not None:
+        if reverse:
+            records = [item for item in records if _record_sort_key(item, sort_field) < after_key]
+        else:
+            records = [item for item in records if _record_sort_key(item, sort_field) > after_key]
+
+    sort_key = lambda item: _record_sort_key(item, sort_field)
+    if limit is None:
+        return sorted(records, key=sort_key, reverse=reverse)
+    select = heapq.nlargest if reverse else heapq.nsmallest
+    return select(limit, records, key=sort_key)
+
+def _key_id(key):
+    """Record id stored in a sort key"""
+    return key[1][1]
+
+class SortedIndex:
+    """Ordered set of sort keys kept in bounded chunks.
+
+    Inserting or removing a key only shifts elements within one chunk, and
+    walking from any position costs O(log n) to find the start.
+    """
+    CHUNK = 512
+
+    def __init__(self, keys=()):
+        keys = sorted(keys)
+        self.chunks = [keys[i:i + self.CHUNK] for i in range(0, len(keys), self.CHUNK)]
+        self.maxes = [chunk[-1] for chunk in self.chunks]
+
+    def __len__(self):
+        return sum(len(chunk) for chunk in self.chunks)
+
+    def add(self, key):
+        if not self.chunks:
+            self.chunks.append([key])
+            self.maxes.append(key)
+            return
+        i = min(bisect.bisect_left(self.maxes, key), len(self.chunks) - 1)
+        chunk = self.chunks[i]
+        bisect.insort(chunk, key)
+        self.maxes[i] = chunk[-1]
+        if len(chunk) > 2 * self.CHUNK:
+            self.chunks[i:i + 1] = [chunk[:self.CHUNK], chunk[self.CHUNK:]]
+            self.maxes[i:i + 1] = [chunk[self.CHUNK - 1], chunk[-1]]
+
+    def remove(self, key):
+        i = bisect.bisect_left(self.maxes, key)
+        if i == len(self.chunks):
+            return
+        chunk = self.chunks[i]
+        j = bisect.bisect_left(chunk, key)
+        if j < len(chunk) and chunk[j] == key:
+            del chunk[j]
+            if chunk:
+                self.maxes[i] = chunk[-1]
+            else:
+                del self.chunks[i]
+                del self.maxes[i]
+
+    def iter_from(self, after=None, reverse: bool = False):
+        """Yield keys in order (or reverse order), starting strictly after `after`"""
+        if not reverse:
+            if after is None:
+                i, j = 0, 0
+            else:
+                i = bisect.bisect_right(self.maxes, after)
+                j = bisect.bisect_right(self.chunks[i], after) if i < len(self.chunks) else 0
+            while i < len(self.chunks):
+                chunk = self.chunks[i]
+                yield from chunk[j:]
+                i, j = i + 1, 0
+        else:
+            if not self.chunks:
+                return
+            if after is None:
+                i = len(self.chunks) - 1
+                j = len(self.chunks[i])
+            else:
+                i = bisect.bisect_left(self.maxes, after)
+                if i == len(self.chunks):
+                    i -= 1
+                    j = len(self.chunks[i])
+                else:
+                    j = bisect.bisect_left(self.chunks[i], after)
+            while i >= 0:
+                chunk = self.chunks[i]
+                yield from reversed(chunk[:j])
+                i -= 1
+                j = len(self.chunks[i]) if i >= 0 else 0
+
+class StorageEngine:
+    """Interface shared by the storage backends.
+
+    Records are plain dicts whose "id" is the primary key within their
+    collection (entity). Collections are created on first use.
+    """
+    name = "base"
+
+    def __init__(self):
+        self.auto_indexes: Dict[str, set] = {}
+        self.filter_counts: Dict[tuple, int] = {}
+        self.index_stats = {"hits": 0, "misses": 0, "auto_created": 0}
+
+    def get(self, entity_name: str, entity_id) -> Optional[dict]:
+        raise NotImplementedError
+
+    def insert(self, entity_name: str, record: dict) -> dict:
+        """Store a new record, allocating its id when missing"""
+        raise NotImplementedError
+
+    def replace(self, entity_name: str, entity_id, record: dict) -> Optional[dict]:
+        """Overwrite an existing record; returns None when it does not exist"""
+        raise NotImplementedError
+
+    def delete(self, entity_name: str, entity_id) -> Optional[dict]:
+        """Remove a record and return it (None when it does not exist)"""
+        raise NotImplementedError
+
+    def scan(self, entity_name: str, filters: Optional[dict] = None) -> Iterator[dict]:
+        """Iterate lazily over every (matching) record in insertion order.
+
+        Safe to interleave with writes, and never materializes the collection.
+        """
+        raise NotImplementedError
+
+    def list(self, entity_name: str, sort_field: Optional[str] = None, reverse: bool = False,
+             limit: Optional[int] = None, after: Optional[tuple] = None) -> List[dict]:
+        """Up to limit records ordered on sort_field (insertion order when it is None).
+
+        Records are ordered by _order_key of the field, then by id.
+
+        after is a (sort value, id) cursor; only records positioned strictly
+        after it in the requested direction are returned.
+        """
+        raise NotImplementedError
+
+    def filter(self, entity_name: str, filters: dict, sort_field: Optional[str] = None, reverse: bool = False,
+               limit: Optional[int] = None, after: Optional[tuple] = None) -> List[dict]:
+        """Like list, restricted to records whose fields equal every value in filters"""
+        raise NotImplementedError
+
+    def count(self, entity_name: str, filters: Optional[dict] = None) -> int:
+        raise NotImplementedError
+
+    def clear(self, entity_name: str):
+        raise NotImplementedError
+
+    def batch(self):
+        """Context manager grouping several writes (one transaction where the backend has them)"""
+        return nullcontext()
+
+    def has_index(self, entity_name: str, field: str) -> bool:
+        raise NotImplementedError
+
+    def create_index(self, entity_name: str, field: str) -> bool:
+        """Build an equality index; returns False when the field cannot be indexed"""
+        raise NotImplementedError
+
+    def index_names(self) -> Dict[str, List[str]]:
+        raise NotImplementedError
+
+    def use_index(self, entity_name: str, field: str, value) -> bool:
+        """Decide whether a filter on field can be answered from an index.
+
+        Counts hits and misses, and builds an index once a field has been
+        filtered on ENTITY_AUTO_INDEX_THRESHOLD times without one.
+        """
+        if _is_hashable(value) and (self.has_index(entity_name, field) or self._learn_index(entity_name, field)):
+            self.index_stats["hits"] += 1
+            return True
+        self.index_stats["misses"] += 1
+        return False
+
+    def _learn_index(self, entity_name: str, field: str) -> bool:
+        if ENTITY_AUTO_INDEX_THRESHOLD <= 0:
+            return False
+        key = (entity_name, field)
+        self.filter_counts[key] = self.filter_counts.get(key, 0) + 1
+        learned = self.auto_indexes.setdefault(entity_name, set())
+        if self.filter_counts[key] < ENTITY_AUTO_INDEX_THRESHOLD or len(learned) >= ENTITY_AUTO_INDEX_MAX:
+            return False
+        if not self.create_index(entity_name, field):
+            return False
+        learned.add(field)
+        self.index_stats["auto_created"] += 1
+        return True
+
+    def index_metrics(self) -> Dict[str, Any]:
+        return {
+            "engine": self.name,
+            **self.index_stats,
+            "indexes": self.index_names(),
+            "learned": {entity_name: sorted(fields) for entity_name, fields in self.auto_indexes.items() if fields},
+        }
+
+class MemoryStorageEngine(StorageEngine):
+    """Process-local storage (lost on restart).
+
+    Each collection maps id -> record. Dicts keep insertion order, so listing
+    is stable while single-record lookups, updates and deletes are O(1).
+    """
+    name = "memory"
+
+    def __init__(self):
+        super().__init__()
+        self.collections: Dict[str, Dict[Any, dict]] = {name: {} for name in ENTITY_NAMES}
+        # Per-collection id sequences, seeded once from the existing records
+        self.sequences: Dict[str, int] = {}
+        self.sequence_lock = threading.Lock()
+        # entity -> field -> value -> {id: None}; dict buckets keep insertion order
+        self.indexes: Dict[str, Dict[str, Dict[Any, Dict[Any, None]]]] = {}
+        # entity -> sort field -> ordered sort keys, built on first sorted read
+        self.sorted_indexes: Dict[str, Dict[str, SortedIndex]] = {}
+        for entity_name in ENTITY_INDEXES:
+            self.rebuild_indexes(entity_name)
+
+    def collection(self, entity_name: str) -> Dict[Any, dict]:
+        """Get or create a collection"""
+        if entity_name not in self.collections:
+            self.collections[entity_name] = {}
+        return self.collections[entity_name]
+
+    def next_id(self, entity_name: str) -> int:
+        with self.sequence_lock:
+            current = self.sequences.get(entity_name)
+            if current is None:
+                current = max((i for i in self.collection(entity_name) if isinstance(i, int)), default=0)
+            self.sequences[entity_name] = current + 1
+            return current + 1
+
+    def observe_id(self, entity_name: str, entity_id):
+        """Move the sequence past an id supplied by the client"""
+        if not isinstance(entity_id, int):
+            return
+        with self.sequence_lock:
+            current = self.sequences.get(entity_name)
+            if current is not None and entity_id > current:
+                self.sequences[entity_name] = entity_id
+
+    def get(self, entity_name, entity_id):
+        return self.collection(entity_name).get(entity_id)
+
+    def insert(self, entity_name, record):
+        store = self.collection(entity_name)
+        if 'id' not in record:
+            record['id'] = self.next_id(entity_name)
+        elif record['id'] in store:
+            raise DuplicateEntityError(record['id'])
+        else:
+            self.observe_id(entity_name, record['id'])
+        store[record['id']] = record
+        self._index_record(entity_name, record)
+        return record
+
+    def replace(self, entity_name, entity_id, record):
+        store = self.collection(entity_name)
+        previous = store.get(entity_id)
+        if previous is None:
+            return None
+        self._unindex_record(entity_name, previous)
+        store[entity_id] = record
+        self._index_record(entity_name, record)
+        return record
+
+    def delete(self, entity_name, entity_id):
+        deleted = self.collection(entity_name).pop(entity_id, None)
+        if deleted is not None:
+            self._unindex_record(entity_name, deleted)
+        return deleted
+
+    def scan(self, entity_name, filters=None):
+        store = self.collection(entity_name)
+        # Snapshot ids only; records are looked up as the caller reaches them
+        candidate_ids, remaining = self._lookup_indexes(entity_name, filters or {})
+        for entity_id in list(store) if candidate_ids is None else candidate_ids:
+            item = store.get(entity_id)
+            if item is not None and all(item.get(key) == value for key, value in remaining.items()):
+                yield item
+
+    def list(self, entity_name, sort_field=None, reverse=False, limit=None, after=None):
+        store = self.collection(entity_name)
+        if sort_field is None:
+            return list(islice(store.values(), limit))
+        if not has_sort_index(entity_name, sort_field):
+            return _select_sorted(store.values(), sort_field, reverse, limit, after)
+        keys = self._sorted_index(entity_name, sort_field).iter_from(_cursor_sort_key(after), reverse)
+        return [store[_key_id(key)] for key in islice(keys, limit)]
+
+    def filter(self, entity_name, filters, sort_field=None, reverse=False, limit=None, after=None):
+        store = self.collection(entity_name)
+
+        # Narrow candidates with the equality indexes, then scan what is left
+        candidate_ids, remaining = self._lookup_indexes(entity_name, filters)
+
+        def matches(item):
+            for key, value in remaining.items():
+                if item.get(key) != value:
+                    return False
+            return True
+
+        candidates = store.values() if candidate_ids is None else (store[i] for i in candidate_ids)
+        if sort_field is None:
+            return list(islice(filter(matches, candidates), limit))
+
+        if candidate_ids is None and has_sort_index(entity_name, sort_field):
+            # Nothing narrowed the search: walk the ordered index and stop at limit matches
+            keys = self._sorted_index(entity_name, sort_field).iter_from(_cursor_sort_key(after), reverse)
+            return list(islice(filter(matches, (store[_key_id(key)] for key in keys)), limit))
+
+        return _select_sorted(filter(matches, candidates), sort_field, reverse, limit, after)
+
+    def count(self, entity_name, filters=None):
+        if not filters:
+            return len(self.collection(entity_name))
+        return len(self.filter(entity_name, filters))
+
+    def clear(self, entity_name):
+        self.collection(entity_name).clear()
+        self.sequences.pop(entity_name, None)
+        self.sorted_indexes.pop(entity_name, None)
+        self.rebuild_indexes(entity_name)
+
+    def has_index(self, entity_name, field):
+        return field in self.indexes.get(entity_name, {})
+
+    def create_index(self, entity_name, field):
+        index = self.indexes.setdefault(entity_name, {})[field] = {}
+        for entity_id, item in self.collection(entity_name).items():
+            value = item.get(field)
+            if _is_hashable(value):
+                index.setdefault(value, {})[entity_id] = None
+        return True
+
+    def rebuild_indexes(self, entity_name: str):
+        """Rebuild every declared and learned index of a collection from scratch"""
+        fields = set(ENTITY_INDEXES.get(entity_name, [])) | self.auto_indexes.get(entity_name, set())
+        self.indexes[entity_name] = {}
+        for field in fields:
+            self.create_index(entity_name, field)
+
+    def index_names(self):
+        return {entity_name: sorted(indexes) for entity_name, indexes in self.indexes.items() if indexes}
+
+    def _sorted_index(self, entity_name: str, sort_field: str) -> SortedIndex:
+        indexes = self.sorted_indexes.setdefault(entity_name, {})
+        if sort_field not in indexes:
+            indexes[sort_field] = SortedIndex(
+                _record_sort_key(item, sort_field) for item in self.collection(entity_name).values()
+            )
+        return indexes[sort_field]
+
+    def _index_record(self, entity_name: str, item: dict):
+        for field, index in self.indexes.get(entity_name, {}).items():
+            value = item.get(field)
+            if _is_hashable(value):
+                index.setdefault(value, {})[item['id']] = None
+        for sort_field, sorted_index in self.sorted_indexes.get(entity_name, {}).items():
+            sorted_index.add(_record_sort_key(item, sort_field))
+
+    def _unindex_record(self, entity_name: str, item: dict):
+        for sort_field, sorted_index in self.sorted_indexes.get(entity_name, {}).items():
+            sorted_index.remove(_record_sort_key(item, sort_field))
+        for field, index in self.indexes.get(entity_name, {}).items():
+            value = item.get(field)
+            if not _is_hashable(value):
+                continue
+            bucket = index.get(value)
+            if bucket is not None:
+                bucket.pop(item['id'], None)
+                if not bucket:
+                    del index[value]
+
+    def _lookup_indexes(self, entity_name: str, filters: dict):
+        """Resolve filters against the equality indexes.
+
+        Returns (candidate_ids, remaining_filters). candidate_ids is None when no
+        filter could use an index and the caller has to scan the whole collection.
+        """
+        buckets = []
+        remaining = {}
+        for field, value in filters.items():
+            if self.use_index(entity_name, field, value):
+                buckets.append(self.indexes[entity_name][field].get(value, {}))
+            else:
+                remaining[field] = value
+
+        if not buckets:
+            return None, remaining
+
+        # Intersect starting from the smallest candidate set
+        buckets.sort(key=len)
+        smallest, others = buckets[0], buckets[1:]
+        candidate_ids = [entity_id for entity_id in smallest if all(entity_id in bucket for bucket in others)]
+        return candidate_ids, remaining
+
+class LoggedMemoryStorageEngine(MemoryStorageEngine):
+    """Memory engine made durable by an append-only write log.
+
+    Every write is appended to the current log segment before it returns,
+    and fsync runs at most every MEMORY_LOG_FSYNC_MS (0 fsyncs each write, or
+    each batch). After MEMORY_SNAPSHOT_EVERY logged writes a background thread
+    compacts the store into a binary snapshot and drops the segments it
+    covers; startup loads the snapshot and replays the newer segments.
+    """
+    name = "memory+log"
+    SNAPSHOT_FILE = "snapshot.bin"
+    SNAPSHOT_MAGIC = b"HBIUSNAP1\n"
+    SEGMENT_FILE = re.compile(r"log-(\d{10})\.bin")
+    FRAME_HEADER = struct.Struct("<II")  # payload length, crc32 of the payload
+
+    def __init__(self, directory: str, fsync_ms: int = MEMORY_LOG_FSYNC_MS,
+                 snapshot_every: int = MEMORY_SNAPSHOT_EVERY):
+        super().__init__()
+        self.directory = directory
+        self.fsync_ms = fsync_ms
+        self.snapshot_every = snapshot_every
+        os.makedirs(directory, exist_ok=True)
+        # Writes are applied and logged under one lock so the log replays in order
+        self.write_lock = threading.RLock()
+        self.batch_depth = 0
+        self.dirty = False
+        self.logged_since_snapshot = 0
+        self.compaction: Optional[threading.Thread] = None
+        self.log_stats = {"writes": 0, "fsyncs": 0, "snapshots": 0, "last_snapshot_seconds": None,
+                          "recovered_records": 0, "replayed_writes": 0, "recovery_seconds": None,
+                          "last_error": None}
+
+        started = time.perf_counter()
+        last_segment = self._recover()
+        self.log_stats["recovery_seconds"] = round(time.perf_counter() - started, 3)
+        self.segment_number = last_segment + 1
+        self.segment = open(self._segment_path(self.segment_number), "ab", buffering=0)
+
+        self.stop_flusher = threading.Event()
+        if fsync_ms > 0:
+            threading.Thread(target=self._flush_loop, name="memory-log-fsync", daemon=True).start()
+        atexit.register(self.close)
+
+    def _segment_path(self, number: int) -> str:
+        return os.path.join(self.directory, f"log-{number:010d}.bin")
+
+    def _segments(self) -> List[tuple]:
+        found = []
+        for filename in os.listdir(self.directory):
+            match = self.SEGMENT_FILE.fullmatch(filename)
+            if match:
+                found.append((int(match.group(1)), os.path.join(self.directory, filename)))
+        return sorted(found)
+
+    # --- recovery ---
+
+    def _recover(self) -> int:
+        """Load the snapshot, replay newer log segments; returns the last segment number seen"""
+        covered = 0
+        snapshot_path = os.path.join(self.directory, self.SNAPSHOT_FILE)
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, "rb") as f:
+                if f.read(len(self.SNAPSHOT_MAGIC)) != self.SNAPSHOT_MAGIC:
+                    raise ValueError(f"{snapshot_path} is not a storage snapshot")
+                state = pickle.load(f)
+            covered = state["segment"]
+            self.collections.update(state["collections"])
+            self.sequences.update(state["sequences"])
+
+        # Seed sequences from the snapshot so replayed ids only move them forward
+        for entity_name, store in self.collections.items():
+            if entity_name not in self.sequences:
+                self.sequences[entity_name] = max((i for i in store if isinstance(i, int)), default=0)
+
+        last = covered
+        for number, path in self._segments():
+            if number <= covered:
+                # Already in the snapshot (compaction stopped before cleaning up)
+                os.remove(path)
+                continue
+            self.log_stats["replayed_writes"] += self._replay(path)
+            last = number
+
+        self.logged_since_snapshot = self.log_stats["replayed_writes"]
+        self.log_stats["recovered_records"] = sum(len(store) for store in self.collections.values())
+        self.sorted_indexes = {}
+        for entity_name in self.collections:
+            self.rebuild_indexes(entity_name)
+        return last
+
+    def _replay(self, path: str) -> int:
+        """Apply every complete frame of a segment, cutting off a torn tail"""
+        applied = 0
+        with open(path, "r+b") as f:
+            data = f.read()
+            position = 0
+            while position < len(data):
+                header_end = position + self.FRAME_HEADER.size
+                if header_end > len(data):
+                    break
+                length, checksum = self.FRAME_HEADER.unpack_from(data, position)
+                payload = data[header_end:header_end + length]
+                if len(payload) < length or zlib.crc32(payload) != checksum:
+                    break
+                self._apply(pickle.loads(payload))
+                applied += 1
+                position = header_end + length
+            if position < len(data):
+                print(f"Warning: discarding {len(data) - position} bytes of incomplete writes at the end of {path}")
+                f.truncate(position)
+        return applied
+
+    def _apply(self, op: tuple):
+        kind, entity_name = op[0], op[1]
+        store = self.collection(entity_name)
+        if kind == "put":
+            entity_id = op[2]
+            store[entity_id] = op[3]
+            if isinstance(entity_id, int) and entity_id > self.sequences.get(entity_name, 0):
+                self.sequences[entity_name] = entity_id
+        elif kind == "delete":
+            store.pop(op[2], None)
+        elif kind == "clear":
+            store.clear()
+            self.sequences[entity_name] = 0
+
+    # --- logging ---
+
+    def _log(self, op: tuple):
+        payload = pickle.dumps(op, protocol=pickle.HIGHEST_PROTOCOL)
+        # Unbuffered: the frame reaches the OS before the write returns
+        self.segment.write(self.FRAME_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+        self.log_stats["writes"] += 1
+        self.logged_since_snapshot += 1
+        self.dirty = True
+        if self.fsync_ms == 0 and not self.batch_depth:
+            self.sync()
+        if self.snapshot_every and self.logged_since_snapshot >= self.snapshot_every and self.compaction is None:
+            self._start_compaction()
+
+    def insert(self, entity_name, record):
+        with self.write_lock:
+            record = super().insert(entity_name, record)
+            self._log(("put", entity_name, record['id'], record))
+            return record
+
+    def replace(self, entity_name, entity_id, record):
+        with self.write_lock:
+            replaced = super().replace(entity_name, entity_id, record)
+            if replaced is not None:
+                self._log(("put", entity_name, entity_id, replaced))
+            return replaced
+
+    def delete(self, entity_name, entity_id):
+        with self.write_lock:
+            deleted = super().delete(entity_name, entity_id)
+            if deleted is not None:
+                self._log(("delete", entity_name, entity_id))
+            return deleted
+
+    def clear(self, entity_name):
+        with self.write_lock:
+            super().clear(entity_name)
+            self._log(("clear", entity_name))
+
+    @contextmanager
+    def batch(self):
+        """Hold writers off for the whole batch and fsync once at the end"""
+        with self.write_lock:
+            self.batch_depth += 1
+            try:
+                yield
+            finally:
+                self.batch_depth -= 1
+                if self.fsync_ms == 0 and not self.batch_depth:
+                    self.sync()
+
+    def sync(self):
+        """fsync what has been logged so far (no-op when nothing is pending)"""
+        with self.write_lock:
+            if not self.dirty or self.segment.closed:
+                return
+            self.dirty = False
+            # fsync a duplicate so writers are not blocked while the disk catches up
+            fd = os.dup(self.segment.fileno())
+        try:
+            os.fsync(fd)
+            self.log_stats["fsyncs"] += 1
+        finally:
+            os.close(fd)
+
+    def _flush_loop(self):
+        while not self.stop_flusher.wait(self.fsync_ms / 1000):
+            try:
+                self.sync()
+            except OSError as e:
+                self.log_stats["last_error"] = str(e)
+                print(f"Warning: write log fsync failed: {e}")
+
+    # --- compaction ---
+
+    def _start_compaction(self):
+        """Roll over to a new segment and snapshot everything logged before it"""
+        with self.write_lock:
+            covered = self.segment_number
+            self.sync()
+            self.segment.close()
+            self.segment_number += 1
+            self.segment = open(self._segment_path(self.segment_number), "ab", buffering=0)
+            self.logged_since_snapshot = 0
+            # Records are replaced on update, never mutated, so shallow copies are a consistent view
+            state = {
+                "segment": covered,
+                "sequences": dict(self.sequences),
+                "collections": {entity_name: dict(store) for entity_name, store in self.collections.items()},
+            }
+            self.compaction = threading.Thread(
+                target=self._write_snapshot, args=(state,), name="memory-log-compaction", daemon=True
+            )
+            self.compaction.start()
+
+    def _write_snapshot(self, state: dict):
+        started = time.perf_counter()
+        path = os.path.join(self.directory, self.SNAPSHOT_FILE)
+        try:
+            with open(path + ".tmp", "wb") as f:
+                f.write(self.SNAPSHOT_MAGIC)
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + ".tmp", path)
+            for number, segment_path in self._segments():
+                if number <= state["segment"]:
+                    os.remove(segment_path)
+            self.log_stats["snapshots"] += 1
+            self.log_stats["last_snapshot_seconds"] = round(time.perf_counter() - started, 3)
+        except OSError as e:
+            # The segments are kept, so nothing is lost; the next compaction retries
+            self.log_stats["last_error"] = str(e)
+            print(f"Warning: storage snapshot failed: {e}")
+        finally:
+            self.compaction = None
+
+    def compact(self):
+        """Snapshot now and wait for it (benchmarks, shutdown)"""
+        running = self.compaction
+        if running is not None:
+            running.join()
+        with self.write_lock:
+            self._start_compaction()
+            compaction = self.compaction
+        compaction.join()
+
+    def close(self):
+        self.stop_flusher.set()
+        compaction = self.compaction
+        if compaction is not None:
+            compaction.join()
+        with self.write_lock:
+            if not self.segment.closed:
+                self.sync()
+                self.segment.close()
+
+    def log_metrics(self) -> Dict[str, Any]:
+        return {"directory": self.directory, "segment": self.segment_number,
+                "pending_writes": self.logged_since_snapshot, **self.log_stats}
+
+# Field names that can be inlined into SQL (JSON paths and index names)
+_SQL_FIELD = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+class SQLiteStorageEngine(StorageEngine):
+    """Persistent storage in a single SQLite file.
+
+    One row per record with the record kept as a JSON column. WAL mode lets
+    readers in other workers proceed during writes, sqlite3's statement cache
+    keeps every query prepared, and indexed fields get an expression index on
+    json_extract so equality filters and sorts do not scan the table.
+    """
+    name = "sqlite"
+    SCAN_CHUNK = 1000
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, cached_statements=256)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS entities (
+                entity TEXT NOT NULL,
+                id NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (entity, id)
+            );
+            CREATE TABLE IF NOT EXISTS entity_sequences (
+                entity TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+        """)
+        # Expression indexes are per field and shared by every entity
+        self.indexed_fields = {
+            row[0][len("idx_entities_"):]
+            for row in self.conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx_entities_%'"
+            )
+        }
+        for fields in ENTITY_INDEXES.values():
+            for field in fields:
+                self.create_index(None, field)
+        # Sort indexes end in id, matching the ORDER BY used for keyset pagination
+        sort_fields = set(SORTABLE_FIELDS).union(*ENTITY_SORT_FIELDS.values())
+        for sort_field in filter(_SQL_FIELD.fullmatch, sort_fields):
+            expression, _ = self._field_sql(sort_field)
+            self.conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_sort_{sort_field}" ON entities (entity, {expression}, id)')
+
+    @staticmethod
+    def _field_sql(field: str):
+        """SQL expression (and its parameters) extracting one field from the JSON column"""
+        if _SQL_FIELD.fullmatch(field):
+            return f"json_extract(data, '$.\"{field}\"')", []
+        return "json_extract(data, ?)", ['$."' + field.replace('"', '\\"') + '"']
+
+    def _order_by(self, sort_field: Optional[str], reverse: bool, use_sort_index: bool = True):
+        if sort_field is None:
+            return "rowid", []
+        expression, params = self._field_sql(sort_field)
+        direction = "DESC" if reverse else "ASC"
+        # A unary + keeps the planner from walking the sort index, so it picks
+        # an equality index and sorts the (few) matching rows instead
+        plus = "" if use_sort_index else "+"
+        return f"{plus}{expression} {direction}, {plus}id {direction}", params
+
+    def _keyset(self, sort_field: Optional[str], reverse: bool, after: Optional[tuple]):
+        """Condition selecting the rows positioned after an (value, id) cursor.
+
+        SQLite orders NULL before numbers before text, the same order as
+        _order_key, so both engines page through identical sequences.
+        """
+        if after is None or sort_field is None:
+            return None, []
+        value, entity_id = after
+        if isinstance(value, (dict, list)):
+            value = _compact_json(value)
+        expression, expression_params = self._field_sql(sort_field)
+        op = "<" if reverse else ">"
+        if value is None:
+            if reverse:
+                return f"({expression} IS NULL AND id < ?)", [*expression_params, entity_id]
+            return f"(({expression} IS NULL AND id > ?) OR {expression} IS NOT NULL)", [
+                *expression_params, entity_id, *expression_params
+            ]
+        clause = f"({expression} {op} ? OR ({expression} = ? AND id {op} ?)"
+        params = [*expression_params, value, *expression_params, value, entity_id]
+        if reverse:
+            clause += f" OR {expression} IS NULL"
+            params += expression_params
+        return clause + ")", params
+
+    def _where(self, entity_name: str, filters: dict):
+        """WHERE clause for the scalar filters; non-scalar ones are returned for Python-side matching"""
+        clauses = ["entity = ?"]
+        params = [entity_name]
+        remaining = {}
+        for field, value in filters.items():
+            if isinstance(value, (dict, list)):
+                self.index_stats["misses"] += 1
+                remaining[field] = value
+                continue
+            self.use_index(entity_name, field, value)
+            expression, expression_params = self._field_sql(field)
+            clauses.append(f"{expression} IS ?")
+            params.extend(expression_params)
+            params.append(value)
+        return " AND ".join(clauses), params, remaining
+
+    def _rows(self, sql: str, params: list) -> List[dict]:
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def _next_id(self, entity_name: str) -> int:
+        """Allocate an id; must run inside the insert transaction"""
+        row = self.conn.execute(
+            "UPDATE entity_sequences SET value = value + 1 WHERE entity = ? RETURNING value", (entity_name,)
+        ).fetchone()
+        if row:
+            return row[0]
+        # First insert since startup: seed the sequence from the stored records
+        value = self.conn.execute(
+            "SELECT COALESCE(MAX(id), 0) + 1 FROM entities WHERE entity = ? AND typeof(id) = 'integer'",
+            (entity_name,),
+        ).fetchone()[0]
+        self.conn.execute("INSERT INTO entity_sequences (entity, value) VALUES (?, ?)", (entity_name, value))
+        return value
+
+    def get(self, entity_name, entity_id):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT data FROM entities WHERE entity = ? AND id = ?", (entity_name, entity_id)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    @contextmanager
+    def batch(self):
+        with self.lock:
+            if self.conn.in_transaction:
+                yield
+                return
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def insert(self, entity_name, record):
+        with self.batch():
+            if 'id' not in record:
+                record['id'] = self._next_id(entity_name)
+            elif isinstance(record['id'], int):
+                self.conn.execute(
+                    "UPDATE entity_sequences SET value = ? WHERE entity = ? AND value < ?",
+                    (record['id'], entity_name, record['id']),
+                )
+            try:
+                self.conn.execute(
+                    "INSERT INTO entities (entity, id, data) VALUES (?, ?, ?)",
+                    (entity_name, record['id'], json.dumps(record, default=str)),
+                )
+            except sqlite3.IntegrityError:
+                # Only the failed statement is undone; an enclosing batch carries on
+                raise DuplicateEntityError(record['id'])
+        return record
+
+    def replace(self, entity_name, entity_id, record):
+        with self.lock:
+            cursor = self.conn.execute(
+                "UPDATE entities SET data = ? WHERE entity = ? AND id = ?",
+                (json.dumps(record, default=str), entity_name, entity_id),
+            )
+        return record if cursor.rowcount else None
+
+    def delete(self, entity_name, entity_id):
+        with self.lock:
+            row = self.conn.execute(
+                "DELETE FROM entities WHERE entity = ? AND id = ? RETURNING data", (entity_name, entity_id)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def scan(self, entity_name, filters=None):
+        where, params, remaining = self._where(entity_name, filters or {})
+        # Keyset pagination on rowid keeps memory flat and never holds the lock across a yield
+        last_rowid = 0
+        while True:
+            with self.lock:
+                rows = self.conn.execute(
+                    f"SELECT rowid, data FROM entities WHERE {where} AND rowid > ? ORDER BY rowid LIMIT ?",
+                    [*params, last_rowid, self.SCAN_CHUNK],
+                ).fetchall()
+            if not rows:
+                return
+            for rowid, data in rows:
+                item = json.loads(data)
+                if all(item.get(key) == value for key, value in remaining.items()):
+                    yield item
+            last_rowid = rows[-1][0]
+
+    def list(self, entity_name, sort_field=None, reverse=False, limit=None, after=None):
+        return self.filter(entity_name, {}, sort_field, reverse, limit, after)
+
+    def filter(self, entity_name, filters, sort_field=None, reverse=False, limit=None, after=None):
+        where, params, remaining = self._where(entity_name, filters)
+        keyset, keyset_params = self._keyset(sort_field, reverse, after)
+        if keyset:
+            where += f" AND {keyset}"
+            params += keyset_params
+        indexed_filter = any(self.has_index(entity_name, field) for field in filters)
+        order_by, order_params = self._order_by(sort_field, reverse, use_sort_index=not indexed_filter)
+        sql_limit = -1 if limit is None or remaining else limit
+        records = self._rows(
+            f"SELECT data FROM entities WHERE {where} ORDER BY {order_by} LIMIT ?",
+            [*params, *order_params, sql_limit],
+        )
+        if remaining:
+            records = [item for item in records if all(item.get(k) == v for k, v in remaining.items())]
+        return records[:limit]
+
+    def count(self, entity_name, filters=None):
+        where, params, remaining = self._where(entity_name, filters or {})
+        if remaining:
+            return len(self.filter(entity_name, filters))
+        with self.lock:
+            return self.conn.execute(f"SELECT COUNT(*) FROM entities WHERE {where}", params).fetchone()[0]
+
+    def clear(self, entity_name):
+        with self.lock:
+            self.conn.execute("DELETE FROM entities WHERE entity = ?", (entity_name,))
+            self.conn.execute("DELETE FROM entity_sequences WHERE entity = ?", (entity_name,))
+
+    def has_index(self, entity_name, field):
+        return field in self.indexed_fields
+
+    def create_index(self, entity_name, field):
+        if not _SQL_FIELD.fullmatch(field):
+            return False
+        if field not in self.indexed_fields:
+            expression, _ = self._field_sql(field)
+            with self.lock:
+                self.conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_entities_{field}" ON entities (entity, {expression})')
+            self.indexed_fields.add(field)
+        return True
+
+    def index_names(self):
+        return {"*": sorted(self.indexed_fields)}
+
+def create_storage_engine(kind: str = STORAGE_ENGINE) -> StorageEngine:
+    """Build the storage backend selected by STORAGE_ENGINE"""
+    if kind == "memory":
+        return LoggedMemoryStorageEngine(MEMORY_LOG_DIR) if MEMORY_LOG_DIR else MemoryStorageEngine()
+    if kind == "sqlite":
+        return SQLiteStorageEngine(SQLITE_PATH)
+    raise ValueError(f"Unknown STORAGE_ENGINE '{kind}' (expected 'memory' or 'sqlite')")
+
+storage = create_storage_engine()
+
+# ===== User Directory =====
+
+# Accounts are looked up through case-normalized copies of the username and
+# email ("username_key", "email_key"), which the _users indexes are built on
+
+def normalize_username(username: str) -> str:
+    return username.strip().casefold()
+
+def normalize_email(email: str) -> str:
+    return email.strip().casefold()
+
+def with_directory_keys(user: dict) -> dict:
+    """Copy of a user record carrying its lookup keys"""
+    return {
+        **user,
+        "username_key": normalize_username(user["username"]),
+        "email_key": normalize_email(user["email"]),
+    }
+
+def get_user_by_username(username: str):
+    matches = storage.filter(USERS_COLLECTION, {"username_key": normalize_username(username)}, limit=1)
+    return matches[0] if matches else None
+
+def get_user_by_email(email: str):
+    matches = storage.filter(USERS_COLLECTION, {"email_key": normalize_email(email)}, limit=1)
+    return matches[0] if matches else None
+
+def update_user(user_id: int, changes: dict) -> Optional[dict]:
+    """Change an account; tokens cached for it are dropped so the change applies at once"""
+    user = storage.get(USERS_COLLECTION, user_id)
+    if user is None:
+        return None
+    updated = storage.replace(USERS_COLLECTION, user_id, with_directory_keys({**user, **changes, "id": user_id}))
+    token_cache.invalidate_user(user_id)
+    return updated
+
+def delete_user(user_id: int) -> Optional[dict]:
+    deleted = storage.delete(USERS_COLLECTION, user_id)
+    token_cache.invalidate_user(user_id)
+    return deleted
+
+# Seed accounts and courses, inserted only when missing so a persistent
+# backend keeps whatever was changed since. Passwords are stored as
+# precomputed bcrypt hashes so importing the app does no hashing work.
+seed_users = [
+    {
+        "id": 1,
+        "username": "admin",
+        "email": "admin@hbiu.edu",
+        "password": "$2b$12$zRRbturC.HKsaYUJG1uK6uuocvzHDfex2qDT3RMiFEvfHiH5Rw11W",  # admin123
+        "role": "admin",
+        "created_at": datetime.now(timezone.utc).isoformat()
+    },
+    {
+        "id": 2,
+        "username": "lecturer1",
+        "email": "lecturer1@hbiu.edu",
+        "password": "$2b$12$X/AcPhmnDjOFp6jQcdsikeKv2HxwAWxk0FNToUc1YcaIJUWTfCZ9e",  # lecturer123
+        "role": "lecturer",
+        "created_at": datetime.now(timezone.utc).isoformat()
+    },
+    {
+        "id": 3,
+        "username": "student1",
+        "email": "student1@hbiu.edu",
+        "password": "$2b$12$MBx/H5mom2YuXWU.dtE4N..Uhu3yzZ0KlPfJV.2JCneQldSNTU86q",  # student123
+        "role": "student",
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+]
+
+seed_courses = [
+    {
+        "id": 1,
+        "title": "Introduction to Computer Science",
+        "description": "Basic programming concepts and algorithms",
+        "instructor": "Dr. Smith",
+        "created_at": datetime.now(timezone.utc).isoformat()
+    },
+    {
+        "id": 2,
+        "title": "Web Development",
+        "description": "Full-stack web development with modern frameworks",
+        "instructor": "Prof. Johnson",
+        "created_at": datetime.now(timezone.utc).isoformat()
+    },
+    {
+        "id": 3,
+        "title": "Database Systems",
+        "description": "Database design and SQL fundamentals",
+        "instructor": "Dr. Williams",
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+]
+
+def seed_storage(engine: StorageEngine):
+    for collection, seeds in ((USERS_COLLECTION, seed_users), (COURSES_COLLECTION, seed_courses)):
+        for seed in seeds:
+            if engine.get(collection, seed["id"]) is None:
+                engine.insert(collection, with_directory_keys(seed) if collection == USERS_COLLECTION else dict(seed))
+
+    # Accounts stored before the directory keys existed
+    for user in engine.filter(USERS_COLLECTION, {"username_key": None}):
+        engine.replace(USERS_COLLECTION, user["id"], with_directory_keys(user))
+
+seed_storage(storage)
+
+# ===== Token Cache =====
+
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 10000))  # verified tokens kept, 0 disables
+
+class TokenCache:
+    """LRU of verified bearer token -> user record.
+
+    Entries are dropped at the token's exp, and all entries of a user are
+    dropped when the account changes (invalidate_user), so a hit can skip
+    both the signature check and the user lookup.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()  # token -> (exp, user)
+        self.tokens_by_user: Dict[Any, set] = {}
+        # get_current_user is a sync dependency, so it runs on several threads
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0, "invalidated": 0}
+        # Bumped by invalidate_user; a put computed before an invalidation is discarded
+        self.version = 0
+
+    def get(self, token: str) -> Optional[dict]:
+        with self.lock:
+            entry = self.entries.get(token)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            exp, user = entry
+            if exp <= time.time():
+                self._drop(token)
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end(token)
+            self.stats["hits"] += 1
+            return user
+
+    def put(self, token: str, exp: float, user: dict, version: int):
+        """Cache user for token unless an account changed since version was read"""
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            if version != self.version:
+                return
+            if token in self.entries:
+                self._drop(token)
+            self.entries[token] = (exp, user)
+            self.tokens_by_user.setdefault(user["id"], set()).add(token)
+            while len(self.entries) > self.max_size:
+                self._drop(next(iter(self.entries)))
+                self.stats["evicted"] += 1
+
+    def invalidate_user(self, user_id):
+        with self.lock:
+            self.version += 1
+            for token in self.tokens_by_user.pop(user_id, ()):
+                self.entries.pop(token, None)
+                self.stats["invalidated"] += 1
+
+    def _drop(self, token: str):
+        _, user = self.entries.pop(token)
+        tokens = self.tokens_by_user.get(user["id"])
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self.tokens_by_user[user["id"]]
+
+    def metrics(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            **self.stats,
+            "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else None,
+        }
+
+token_cache = TokenCache(TOKEN_CACHE_SIZE)
+
+def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
+    to_encode = data.copy()
+    if expires_delta:
+        expire = datetime.now(timezone.utc) + expires_delta
+    else:
+        expire = datetime.now(timezone.utc) + timedelta(minutes=15)
+    to_encode.update({"exp": expire})
+    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    return encoded_jwt
+
+def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    token = credentials.credentials
+    user = token_cache.get(token)
+    if user is not None:
+        return user
+    version = token_cache.version
+
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        username: str = payload.get("sub")
+        if username is None or payload.get("type") == "refresh":
+            raise credentials_exception
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token expired",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    except jwt.JWTError:
+    except jwt.InvalidTokenError:
         raise credentials_exception
     
     user = get_user_by_username(username=username)
     if user is None:
         raise credentials_exception
+    if "exp" in payload:
+        token_cache.put(token, payload["exp"], user, version)
     return user
 
-# Routes
-@app.get("/")
-async def root():
-    return {"message": "HBIU University Backend API", "status": "running"}
+# ===== Refresh Tokens =====
 
-@app.post("/api/auth/login", response_model=Token)
-async def login(user_login: UserLogin):
-    user = get_user_by_username(user_login.username)
-    if not user or not verify_password(user_login.password, user["password"]):
+# A refresh token is exchanged at /api/auth/refresh for a new access token
+# and a new refresh token (rotation), so renewing a session costs an HMAC
+# check instead of a bcrypt verify. Each token id can be used once; using
+# one twice revokes every token descended from the same login (its family).
+REVOKED_TOKENS_PURGE_EVERY = 1000  # revocations between sweeps of expired entries
+refresh_stats = {"issued": 0, "refreshed": 0, "reuse_detected": 0, "revoked_families": 0, "purged": 0}
+revocations_since_purge = 0
+
+def create_refresh_token(username: str, family: Optional[str] = None) -> str:
+    expire = datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    refresh_stats["issued"] += 1
+    return jwt.encode({
+        "sub": username,
+        "type": "refresh",
+        "jti": secrets.token_urlsafe(16),
+        "family": family or secrets.token_urlsafe(16),
+        "exp": expire,
+    }, SECRET_KEY, algorithm=ALGORITHM)
+
+def decode_refresh_token(token: str) -> dict:
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.InvalidTokenError:  # includes expiry
+        payload = {}
+    if payload.get("type") != "refresh" or not payload.get("jti") or not payload.get("family"):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Incorrect username or password",
+            detail="Invalid refresh token",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    
+    return payload
+
+def revoke_token_id(token_id: str, exp: float) -> bool:
+    """Add an id to the revocation list; False when it was already on it"""
+    global revocations_since_purge
+    try:
+        storage.insert(REVOKED_TOKENS_COLLECTION, {"id": token_id, "exp": exp})
+    except DuplicateEntityError:
+        return False
+    revocations_since_purge += 1
+    if revocations_since_purge >= REVOKED_TOKENS_PURGE_EVERY:
+        revocations_since_purge = 0
+        purge_revoked_tokens()
+    return True
+
+def revoke_token_family(family: str):
+    # Every token of the family was issued before now, so none outlives this entry
+    expire = datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    if revoke_token_id(f"family:{family}", expire.timestamp()):
+        refresh_stats["revoked_families"] += 1
+
+def is_token_family_revoked(family: str) -> bool:
+    return storage.get(REVOKED_TOKENS_COLLECTION, f"family:{family}") is not None
+
+def purge_revoked_tokens():
+    """Drop revocation entries whose tokens have expired anyway"""
+    now = time.time()
+    for entry in storage.scan(REVOKED_TOKENS_COLLECTION):
+        if entry["exp"] <= now:
+            storage.delete(REVOKED_TOKENS_COLLECTION, entry["id"])
+            refresh_stats["purged"] += 1
+
+def issue_tokens(user: dict, family: Optional[str] = None) -> dict:
+    """Access + refresh token pair for a login or a refresh"""
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"sub": user["username"]}, expires_delta=access_token_expires
@@ -546,28 +2831,108 @@ async def login(user_login: UserLogin):
     return {
         "access_token": access_token,
         "token_type": "bearer",
-        "user": user_response
+        "user": user_response,
+        "refresh_token": create_refresh_token(user["username"], family),
     }
 
-@app.post("/api/auth/register", response_model=User)
-async def register(user_create: UserCreate):
-    # Check if user already exists
+# Routes
+@app.get("/")
+async def root():
+    return {
+        "message": "HBIU University Backend API",
+        "status": "running",
+        # closed: OpenAI healthy; open: failing fast (cached answers only); half_open: probing
+        "ai_service": ai_breaker.state if openai_client else "not_configured"
+    }
+
+@app.post("/api/auth/login", response_model=Token)
+async def login(user_login: UserLogin, request: Request):
+    auth_rate_limiter.check("ip", client_ip(request))
+    auth_rate_limiter.check("username", normalize_username(user_login.username))
+    user = get_user_by_username(user_login.username)
+    verified, new_hash = (
+        await password_pool.run(check_password, user_login.password, user["password"]) if user else (False, None)
+    )
+    if not verified:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect username or password",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    
+    if new_hash:
+        # Stored with another cost than this instance uses: upgrade it in place
+        user = update_user(user["id"], {"password": new_hash}) or user
+        bcrypt_settings["rehashed"] += 1
+    
+    return issue_tokens(user)
+
+@app.post("/api/auth/refresh", response_model=Token)
+async def refresh_access_token(refresh_request: RefreshRequest):
+    payload = decode_refresh_token(refresh_request.refresh_token)
+    revoked_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Refresh token has been revoked",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    if is_token_family_revoked(payload["family"]):
+        raise revoked_exception
+    
+    # Consume the token; the insert is atomic, so only one of two racing uses wins
+    if not revoke_token_id(payload["jti"], payload["exp"]):
+        # Presented a second time: a copy is in someone else's hands
+        refresh_stats["reuse_detected"] += 1
+        revoke_token_family(payload["family"])
+        raise revoked_exception
+    
+    user = get_user_by_username(payload["sub"])
+    if user is None:
+        raise revoked_exception
+    
+    refresh_stats["refreshed"] += 1
+    return issue_tokens(user, family=payload["family"])
+
+@app.post("/api/auth/logout")
+async def logout(refresh_request: RefreshRequest):
+    """Revoke the refresh token and every token rotated from the same login"""
+    payload = decode_refresh_token(refresh_request.refresh_token)
+    revoke_token_family(payload["family"])
+    return {
+        "success": True,
+        "message": "Logged out",
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    }
+
+def ensure_account_available(user_create: UserCreate):
+    """Usernames and emails are unique, ignoring case"""
     if get_user_by_username(user_create.username):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username already registered"
         )
+    if get_user_by_email(user_create.email):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email already registered"
+        )
+
+@app.post("/api/auth/register", response_model=User)
+async def register(user_create: UserCreate, request: Request):
+    auth_rate_limiter.check("ip", client_ip(request))
+    # Check if user already exists
+    ensure_account_available(user_create)
     
     # Create new user
-    new_user = {
-        "id": len(users_db) + 1,
+    hashed_password = await password_pool.run(get_password_hash, user_create.password)
+    # Another request may have taken the username or email while we were hashing
+    ensure_account_available(user_create)
+    new_user = storage.insert(USERS_COLLECTION, with_directory_keys({
         "username": user_create.username,
         "email": user_create.email,
-        "password": get_password_hash(user_create.password),
+        "password": hashed_password,
         "role": user_create.role,
-        "created_at": datetime.now(timezone.utc)
-    }
-    users_db.append(new_user)
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }))
     
     return User(
         id=new_user["id"],
@@ -589,11 +2954,11 @@ async def get_current_user_info(current_user: dict = Depends(get_current_user)):
 
 @app.get("/api/courses", response_model=List[Course])
 async def get_courses(current_user: dict = Depends(get_current_user)):
-    return [Course(**course) for course in courses_db]
+    return [Course(**course) for course in storage.scan(COURSES_COLLECTION)]
 
 @app.get("/api/courses/{course_id}", response_model=Course)
 async def get_course(course_id: int, current_user: dict = Depends(get_current_user)):
-    course = next((course for course in courses_db if course["id"] == course_id), None)
+    course = storage.get(COURSES_COLLECTION, course_id)
     if not course:
         raise HTTPException(status_code=404, detail="Course not found")
     return Course(**course)
@@ -614,28 +2979,65 @@ async def get_users(current_user: dict = Depends(get_current_user)):
             email=user["email"],
             role=user["role"],
             created_at=user["created_at"]
-        ) for user in users_db
+        ) for user in storage.scan(USERS_COLLECTION)
     ]
 
+@app.put("/api/users/{user_id}/role", response_model=User)
+async def update_user_role(user_id: int, role_update: UserRoleUpdate, current_user: dict = Depends(get_current_user)):
+    if current_user["role"] != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions"
+        )
+    if role_update.role not in ("admin", "lecturer", "student"):
+        raise HTTPException(status_code=400, detail=f"Unknown role {role_update.role}")
+    
+    user = update_user(user_id, {"role": role_update.role})
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return User(
+        id=user["id"],
+        username=user["username"],
+        email=user["email"],
+        role=user["role"],
+        created_at=user["created_at"]
+    )
+
+@app.delete("/api/users/{user_id}")
+async def remove_user(user_id: int, current_user: dict = Depends(get_current_user)):
+    if current_user["role"] != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions"
+        )
+    
+    if delete_user(user_id) is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return {
+        "success": True,
+        "message": "User deleted successfully",
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    }
+
 @app.get("/api/dashboard/stats")
 async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
     if current_user["role"] == "admin":
         return {
-            "total_users": len(users_db),
-            "total_courses": len(courses_db),
-            "total_students": len([u for u in users_db if u["role"] == "student"]),
-            "total_lecturers": len([u for u in users_db if u["role"] == "lecturer"])
+            "total_users": storage.count(USERS_COLLECTION),
+            "total_courses": storage.count(COURSES_COLLECTION),
+            "total_students": storage.count(USERS_COLLECTION, {"role": "student"}),
+            "total_lecturers": storage.count(USERS_COLLECTION, {"role": "lecturer"})
         }
     elif current_user["role"] == "lecturer":
         return {
-            "my_courses": len(courses_db),  # In real app, filter by lecturer
-            "total_students": len([u for u in users_db if u["role"] == "student"]),
+            "my_courses": storage.count(COURSES_COLLECTION),  # In real app, filter by lecturer
+            "total_students": storage.count(USERS_COLLECTION, {"role": "student"}),
             "assignments": 0,  # Placeholder
             "submissions": 0   # Placeholder
         }
     else:  # student
         return {
-            "enrolled_courses": len(courses_db),  # In real app, filter by enrollment
+            "enrolled_courses": storage.count(COURSES_COLLECTION),  # In real app, filter by enrollment
             "assignments": 0,  # Placeholder
             "grades": 0,       # Placeholder
             "attendance": 85   # Placeholder
@@ -651,12 +3053,15 @@ async def generate_content(request: AIContentRequest, current_user: dict = Depen
             detail="AI service is not configured. Please contact administrator."
         )
     
-    result = generate_educational_content(
+    start_ai_call(current_user, "generate-content")
+    
+    result = await generate_educational_content(
         prompt=request.prompt,
         content_type=request.content_type,
         subject=request.subject,
         difficulty=request.difficulty,
-        length=request.length
+        length=request.length,
+        no_cache=request.no_cache
     )
     
     if not result["success"]:
@@ -667,6 +3072,30 @@ async def generate_content(request: AIContentRequest, current_user: dict = Depen
     
     return AIResponse(**result)
 
+@app.post("/api/ai/generate-content/stream")
+async def generate_content_stream(request: AIContentRequest, current_user: dict = Depends(get_current_user)):
+    """generate-content as server-sent events (token events, then done with the metadata)"""
+    if not openai_client:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="AI service is not configured. Please contact administrator."
+        )
+    
+    start_ai_call(current_user, "generate-content/stream")
+    
+    arguments = dict(
+        prompt=request.prompt,
+        content_type=request.content_type,
+        subject=request.subject,
+        difficulty=request.difficulty,
+        length=request.length
+    )
+    metadata = {key: value for key, value in arguments.items() if key != "prompt"}
+    return sse_response(stream_ai_events(
+        content_messages(**arguments), metadata, max_tokens=1500, temperature=0.7,
+        cache_key=generate_educational_content.cache_key(**arguments), no_cache=request.no_cache
+    ))
+
 @app.post("/api/ai/generate-quiz", response_model=AIResponse)
 async def generate_quiz_endpoint(request: QuizGenerationRequest, current_user: dict = Depends(get_current_user)):
     """Generate quiz questions using AI"""
@@ -683,20 +3112,88 @@ async def generate_quiz_endpoint(request: QuizGenerationRequest, current_user: d
             detail="Only lecturers and administrators can generate quizzes"
         )
     
-    result = generate_quiz(
+    start_ai_call(current_user, "generate-quiz")
+    
+    result = await generate_quiz(
         topic=request.topic,
         num_questions=request.num_questions,
         difficulty=request.difficulty,
-        question_types=request.question_types
+        question_types=request.question_types,
+        no_cache=request.no_cache
     )
     
-    if not result["success"]:
+    if not result["success"]:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Quiz generation failed: {result.get('error_message', 'Unknown error')}"
+        )
+    
+    return AIResponse(**result)
+
+@app.post("/api/ai/generate-quiz/batch")
+async def generate_quiz_batch_endpoint(request: QuizBatchRequest, current_user: dict = Depends(get_current_user)):
+    """Generate many quizzes concurrently (e.g. one per module of a course).
+    
+    Each quiz gets its own result, so one failed generation does not fail
+    the batch; valid quizzes are stored as Quiz entities unless store is false.
+    """
+    if not openai_client:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="AI service is not configured. Please contact administrator."
+        )
+    
+    if current_user["role"] not in ["lecturer", "admin"]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only lecturers and administrators can generate quizzes"
+        )
+    
+    start_ai_call(current_user, "generate-quiz-batch", request.course_id)
+    
+    items = request.quizzes
+    if not items and request.course_id is not None:
+        modules = storage.filter("Module", {"courseId": request.course_id}, sort_field="order")
+        items = [QuizBatchItem(topic=module.get("title") or f"Module {module['id']}", module_id=module["id"]) for module in modules]
+    if not items:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Quiz generation failed: {result.get('error_message', 'Unknown error')}"
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="No quizzes to generate"
+        )
+    if len(items) > AI_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch requests are limited to {AI_BATCH_MAX_ITEMS} quizzes"
         )
     
-    return AIResponse(**result)
+    results = await generate_quiz_batch(items)
+    
+    quizzes = []
+    with storage.batch():
+        for item, result in zip(items, results):
+            if not result["success"]:
+                quizzes.append({"success": False, "topic": item.topic, "error": result.get("error_message", "Unknown error")})
+                continue
+            entry = {"success": True, "topic": item.topic, "content": result["content"], "metadata": result["metadata"]}
+            if request.store:
+                entry["quiz"] = storage.insert("Quiz", new_entity_record({
+                    "title": result["content"].get("quiz_title") or f"{item.topic} Quiz",
+                    "courseId": request.course_id,
+                    "moduleId": item.module_id,
+                    "difficulty": item.difficulty,
+                    "questions": result["content"]["questions"],
+                    "createdBy": current_user["id"],
+                    "generated": True
+                }))
+            quizzes.append(entry)
+    
+    generated = sum(1 for quiz in quizzes if quiz["success"])
+    return {
+        "success": True,
+        "data": {"quizzes": quizzes},
+        "message": f"{generated} of {len(quizzes)} quizzes generated",
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    }
 
 @app.post("/api/ai/study-assistant", response_model=AIResponse)
 async def study_assistant_endpoint(request: StudyAssistantRequest, current_user: dict = Depends(get_current_user)):
@@ -707,14 +3204,16 @@ async def study_assistant_endpoint(request: StudyAssistantRequest, current_user:
             detail="AI service is not configured. Please contact administrator."
         )
     
+    start_ai_call(current_user, "study-assistant", request.course_id)
+    
     # Get course info if course_id is provided
     course_info = None
     if request.course_id:
-        course = next((course for course in courses_db if course["id"] == request.course_id), None)
+        course = storage.get(COURSES_COLLECTION, request.course_id)
         if course:
             course_info = f"Course: {course['title']} - {course['description']}"
     
-    result = study_assistant(
+    result = await study_assistant(
         question=request.question,
         context=request.context,
         course_info=course_info
@@ -722,6 +3221,33 @@ async def study_assistant_endpoint(request: StudyAssistantRequest, current_user:
     
     return AIResponse(**result)
 
+@app.post("/api/ai/study-assistant/stream")
+async def study_assistant_stream(request: StudyAssistantRequest, current_user: dict = Depends(get_current_user)):
+    """study-assistant as server-sent events (token events, then done with the metadata)"""
+    if not openai_client:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="AI service is not configured. Please contact administrator."
+        )
+    
+    start_ai_call(current_user, "study-assistant/stream", request.course_id)
+    
+    course_info = None
+    if request.course_id:
+        course = storage.get(COURSES_COLLECTION, request.course_id)
+        if course:
+            course_info = f"Course: {course['title']} - {course['description']}"
+    
+    metadata = {
+        "question": request.question,
+        "has_context": bool(request.context),
+        "has_course_info": bool(course_info)
+    }
+    return sse_response(stream_ai_events(
+        study_assistant_messages(request.question, request.context, course_info), metadata,
+        max_tokens=1000, temperature=0.7
+    ))
+
 @app.get("/api/ai/capabilities")
 async def get_ai_capabilities(current_user: dict = Depends(get_current_user)):
     """Get available AI capabilities based on user role"""
@@ -756,7 +3282,7 @@ async def get_ai_capabilities(current_user: dict = Depends(get_current_user)):
     
     return {
         "user_role": current_user["role"],
-        "ai_service_available": bool(openai_client),
+        "ai_service_available": bool(openai_client) and ai_breaker.state != "open",
         "capabilities": base_capabilities
     }
 
@@ -779,12 +3305,15 @@ async def explain_concept(request: dict, current_user: dict = Depends(get_curren
             detail="Concept is required"
         )
     
-    result = generate_educational_content(
+    start_ai_call(current_user, "explain-concept")
+    
+    result = await generate_educational_content(
         prompt=f"Explain the concept: {concept}",
         content_type="explanation",
         subject=subject,
         difficulty=level,
-        length="medium"
+        length="medium",
+        no_cache=bool(request.get("no_cache", False))
     )
     
     if not result["success"]:
@@ -795,6 +3324,486 @@ async def explain_concept(request: dict, current_user: dict = Depends(get_curren
     
     return AIResponse(**result)
 
+@app.post("/api/ai/explain-concept/stream")
+async def explain_concept_stream(request: dict, current_user: dict = Depends(get_current_user)):
+    """explain-concept as server-sent events (token events, then done with the metadata)"""
+    if not openai_client:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="AI service is not configured. Please contact administrator."
+        )
+    
+    concept = request.get("concept", "")
+    if not concept:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Concept is required"
+        )
+    
+    start_ai_call(current_user, "explain-concept/stream")
+    
+    arguments = dict(
+        prompt=f"Explain the concept: {concept}",
+        content_type="explanation",
+        subject=request.get("subject", ""),
+        difficulty=request.get("level", "intermediate"),
+        length="medium"
+    )
+    metadata = {key: value for key, value in arguments.items() if key != "prompt"}
+    return sse_response(stream_ai_events(
+        content_messages(**arguments), metadata, max_tokens=1500, temperature=0.7,
+        cache_key=generate_educational_content.cache_key(**arguments),
+        no_cache=bool(request.get("no_cache", False))
+    ))
+
+
+@app.get("/api/ai/usage")
+async def get_ai_usage(scope: str = "user", top: int = 20, current_user: dict = Depends(get_current_user)):
+    """Heaviest users, courses or endpoints by AI tokens over the usage window (admin only)"""
+    if current_user["role"] != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions"
+        )
+    if scope not in ("user", "course", "endpoint"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="scope must be one of: user, course, endpoint"
+        )
+    
+    return {
+        "success": True,
+        "data": {
+            "scope": scope,
+            "window_seconds": ai_usage.buckets * ai_usage.bucket_seconds,
+            "usage": ai_usage.report(scope, max(top, 1))
+        },
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    }
+
+@app.get("/api/ai/usage/me")
+async def get_my_ai_usage(current_user: dict = Depends(get_current_user)):
+    """The current user's AI tokens over the usage window, and what is left of their budget"""
+    tokens, calls = ai_usage.usage("user", current_user["id"])
+    budget = ai_usage.budgets["user"] if current_user["role"] != "admin" else 0
+    return {
+        "success": True,
+        "data": {
+            "tokens": tokens,
+            "calls": calls,
+            "budget": budget or None,
+            "remaining": max(budget - tokens, 0) if budget else None,
+            "window_seconds": ai_usage.buckets * ai_usage.bucket_seconds
+        },
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    }
+
+# ===== AI Job Queue =====
+
+# Long generations can be submitted as jobs instead of holding the HTTP request
+# open: POST /api/ai/jobs answers at once with a job id, a worker runs the same
+# route in the background, and the client polls (or gets a callback) for the
+# result. Interactive kinds jump ahead of bulk generation.
+AI_JOB_WORKERS = int(os.getenv("AI_JOB_WORKERS", 4))  # jobs run at once per worker process
+AI_JOB_QUEUE_LIMIT = int(os.getenv("AI_JOB_QUEUE_LIMIT", 1000))  # queued jobs before submissions get 503
+AI_JOB_RETENTION_SECONDS = int(os.getenv("AI_JOB_RETENTION_SECONDS", 86400))  # finished jobs kept this long
+AI_JOB_BACKEND = os.getenv("AI_JOB_BACKEND", "memory").lower()  # "memory" or "sqlite" (survives restarts)
+AI_JOB_SQLITE_PATH = os.getenv("AI_JOB_SQLITE_PATH", "ai_jobs.db")
+AI_JOB_RETRY_AFTER = int(os.getenv("AI_JOB_RETRY_AFTER", 5))  # seconds, sent with the queue-full 503
+# Hosts callback_url may point at (comma-separated); empty disables callbacks
+AI_JOB_CALLBACK_HOSTS = {
+    host.strip().lower() for host in os.getenv("AI_JOB_CALLBACK_HOSTS", "").split(",") if host.strip()
+}
+
+class AIJobRequest(BaseModel):
+    kind: str  # one of AI_JOB_KINDS
+    payload: Dict[str, Any] = {}  # the body the synchronous route takes
+    callback_url: Optional[str] = None  # POSTed the finished job
+
+class MemoryAIJobBackend:
+    name = "memory"
+
+    def __init__(self):
+        self.jobs: Dict[str, dict] = {}
+        self.lock = threading.Lock()
+
+    def save(self, job: dict):
+        with self.lock:
+            self.jobs[job["id"]] = dict(job)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def claim(self, job_id: str, now: float) -> Optional[dict]:
+        """Mark a queued job running; None if it is gone or someone else took it"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job["status"] != "queued":
+                return None
+            job.update(status="running", started_at=now)
+            return dict(job)
+
+    def unfinished(self) -> List[dict]:
+        with self.lock:
+            return [dict(job) for job in self.jobs.values() if job["status"] in ("queued", "running")]
+
+    def purge(self, before: float) -> int:
+        with self.lock:
+            expired = [job_id for job_id, job in self.jobs.items() if (job["finished_at"] or before) < before]
+            for job_id in expired:
+                del self.jobs[job_id]
+            return len(expired)
+
+class SQLiteAIJobBackend:
+    """Jobs in a SQLite file: kept across restarts and shared by the workers"""
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS ai_jobs "
+            "(id TEXT PRIMARY KEY, status TEXT NOT NULL, finished_at REAL, job TEXT NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_ai_jobs_status ON ai_jobs (status)")
+        self.lock = threading.Lock()
+
+    def save(self, job: dict):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO ai_jobs (id, status, finished_at, job) VALUES (?, ?, ?, ?)",
+                (job["id"], job["status"], job["finished_at"], json.dumps(job, default=str)),
+            )
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self.lock:
+            row = self.conn.execute("SELECT job FROM ai_jobs WHERE id = ?", (job_id,)).fetchone()
+            return json.loads(row[0]) if row else None
+
+    def claim(self, job_id: str, now: float) -> Optional[dict]:
+        with self.lock:
+            claimed = self.conn.execute(
+                "UPDATE ai_jobs SET status = 'running', "
+                "job = json_set(job, '$.status', 'running', '$.started_at', ?) "
+                "WHERE id = ? AND status = 'queued'", (now, job_id)
+            ).rowcount
+            if not claimed:
+                return None
+            return json.loads(self.conn.execute("SELECT job FROM ai_jobs WHERE id = ?", (job_id,)).fetchone()[0])
+
+    def unfinished(self) -> List[dict]:
+        with self.lock:
+            rows = self.conn.execute("SELECT job FROM ai_jobs WHERE status IN ('queued', 'running')").fetchall()
+            return [json.loads(row[0]) for row in rows]
+
+    def purge(self, before: float) -> int:
+        with self.lock:
+            return self.conn.execute("DELETE FROM ai_jobs WHERE finished_at < ?", (before,)).rowcount
+
+def create_ai_job_backend(kind: str = AI_JOB_BACKEND):
+    if kind == "memory":
+        return MemoryAIJobBackend()
+    if kind == "sqlite":
+        return SQLiteAIJobBackend(AI_JOB_SQLITE_PATH)
+    raise ValueError(f"Unknown AI_JOB_BACKEND '{kind}' (expected 'memory' or 'sqlite')")
+
+# kind -> (request model, route run by the worker, priority; lower runs first)
+AI_JOB_KINDS = {
+    "study-assistant": (StudyAssistantRequest, study_assistant_endpoint, 0),
+    "explain-concept": (dict, explain_concept, 1),
+    "generate-content": (AIContentRequest, generate_content, 1),
+    "generate-quiz": (QuizGenerationRequest, generate_quiz_endpoint, 2),
+    "generate-quiz-batch": (QuizBatchRequest, generate_quiz_batch_endpoint, 2),
+}
+
+def percentiles_ms(samples) -> Dict[str, Any]:
+    if not samples:
+        return {"p50": None, "p95": None}
+    ordered = sorted(samples)
+    pick = lambda q: round(ordered[min(int(q * len(ordered)), len(ordered) - 1)] * 1000, 1)
+    return {"p50": pick(0.5), "p95": pick(0.95)}
+
+class AIJobQueue:
+    """Priority queue of AI jobs drained by a fixed number of asyncio workers.
+
+    The backend holds the jobs themselves; the in-process queue only orders
+    job ids. Workers start on the serving event loop (and again if the loop
+    changes, as it does between test clients), and re-queue the unfinished
+    jobs a durable backend kept. Running jobs left by a process that died
+    are re-queued once they are older than any call could take.
+    """
+
+    def __init__(self, backend, workers: int = AI_JOB_WORKERS, queue_limit: int = AI_JOB_QUEUE_LIMIT):
+        self.backend = backend
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.loop = None
+        self.queue = None
+        self.tasks = []  # the event loop only keeps weak references to tasks
+        self.sequence = 0
+        self.depth = {priority: 0 for _, _, priority in AI_JOB_KINDS.values()}
+        self.running = 0
+        self.purged_at = 0.0
+        self.stats = {"submitted": 0, "succeeded": 0, "failed": 0, "rejected": 0, "recovered": 0,
+                      "purged": 0, "callbacks_failed": 0}
+        self.wait_times = deque(maxlen=1000)  # seconds from submission to start
+        self.run_times = deque(maxlen=1000)
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        if self.loop is loop:
+            return
+        self.loop = loop
+        self.queue = asyncio.PriorityQueue()
+        self.depth = dict.fromkeys(self.depth, 0)
+        self.running = 0
+        self.tasks = [loop.create_task(self.work()) for _ in range(self.workers)]
+        stale_before = time.time() - AI_TIMEOUT_SECONDS * 10
+        for job in self.backend.unfinished():
+            if job["status"] == "running":
+                if job["started_at"] > stale_before:
+                    continue
+                job.update(status="queued", started_at=None)
+                self.backend.save(job)
+            self.stats["recovered"] += 1
+            self.enqueue(job)
+
+    async def stop(self):
+        """Cancel the workers (at shutdown); a durable backend's running jobs are requeued once stale"""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        self.loop = None
+
+    def enqueue(self, job: dict):
+        self.sequence += 1
+        self.depth[job["priority"]] += 1
+        self.queue.put_nowait((job["priority"], self.sequence, job["id"]))
+
+    def submit(self, kind: str, payload: dict, user: dict, callback_url: Optional[str] = None) -> dict:
+        self.start()
+        if sum(self.depth.values()) >= self.queue_limit:
+            self.stats["rejected"] += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="AI job queue is full, try again shortly",
+                headers={"Retry-After": str(AI_JOB_RETRY_AFTER)}
+            )
+        now = time.time()
+        if now - self.purged_at > 60:
+            self.purged_at = now
+            self.stats["purged"] += self.backend.purge(now - AI_JOB_RETENTION_SECONDS)
+        job = {
+            "id": secrets.token_hex(16),
+            "kind": kind,
+            "priority": AI_JOB_KINDS[kind][2],
+            "status": "queued",
+            "user_id": user["id"],
+            "payload": payload,
+            "callback_url": callback_url,
+            "result": None,
+            "error": None,
+            "error_status": None,
+            "submitted_at": now,
+            "started_at": None,
+            "finished_at": None,
+        }
+        self.backend.save(job)
+        self.stats["submitted"] += 1
+        self.enqueue(job)
+        return job
+
+    async def work(self):
+        while True:
+            priority, _, job_id = await self.queue.get()
+            self.depth[priority] -= 1
+            job = self.backend.claim(job_id, time.time())
+            if job is None:
+                continue
+            self.running += 1
+            try:
+                await self.run(job)
+            finally:
+                self.running -= 1
+
+    async def run(self, job: dict):
+        self.wait_times.append(job["started_at"] - job["submitted_at"])
+        model, route, _ = AI_JOB_KINDS[job["kind"]]
+        try:
+            user = storage.get(USERS_COLLECTION, job["user_id"])
+            if user is None:
+                raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User no longer exists")
+            result = await route(model(**job["payload"]), user)
+            job.update(status="succeeded", result=result.model_dump() if isinstance(result, BaseModel) else result)
+            self.stats["succeeded"] += 1
+        except HTTPException as e:
+            job.update(status="failed", error=e.detail, error_status=e.status_code)
+            self.stats["failed"] += 1
+        except Exception as e:
+            job.update(status="failed", error=str(e), error_status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            self.stats["failed"] += 1
+        job["finished_at"] = time.time()
+        self.run_times.append(job["finished_at"] - job["started_at"])
+        self.backend.save(job)
+        if job["callback_url"]:
+            await self.send_callback(job)
+
+    async def send_callback(self, job: dict):
+        data = json.dumps(ai_job_view(job, with_result=True), default=str).encode("utf-8")
+        callback = urllib.request.Request(job["callback_url"], data=data, headers={"Content-Type": "application/json"})
+
+        def post():
+            # Checked again: the host may resolve elsewhere by now
+            problem = callback_url_problem(job["callback_url"])
+            if problem:
+                raise ValueError(problem)
+            callback_opener.open(callback, timeout=10).close()
+
+        try:
+            await asyncio.to_thread(post)
+        except Exception as e:
+            self.stats["callbacks_failed"] += 1
+            print(f"Warning: AI job {job['id']} callback failed: {e}")
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend.name,
+            "workers": self.workers,
+            "queue_limit": self.queue_limit,
+            "queued": sum(self.depth.values()),
+            "queued_by_priority": dict(self.depth),
+            "running": self.running,
+            **self.stats,
+            "wait_ms": percentiles_ms(self.wait_times),
+            "run_ms": percentiles_ms(self.run_times),
+        }
+
+ai_jobs = AIJobQueue(create_ai_job_backend())
+
+class RefuseRedirects(urllib.request.HTTPRedirectHandler):
+    """A redirect could send the callback to a host callback_url_problem never checked"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None  # urlopen raises HTTPError instead
+
+callback_opener = urllib.request.build_opener(RefuseRedirects)
+
+def callback_url_problem(url: str) -> Optional[str]:
+    """Why job results may not be POSTed to url, or None (resolves its host, so it blocks).
+
+    The host must be in AI_JOB_CALLBACK_HOSTS and resolve only to public
+    addresses, so a callback cannot reach this server or the internal network.
+    """
+    try:
+        parts = urllib.parse.urlsplit(url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+    except ValueError:
+        return "callback_url is not a valid URL"
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        return "callback_url must be an http(s) URL"
+    if not AI_JOB_CALLBACK_HOSTS:
+        return "Job callbacks are disabled on this server"
+    if parts.hostname.lower() not in AI_JOB_CALLBACK_HOSTS:
+        return f"callback_url host '{parts.hostname}' is not allowed"
+    try:
+        addresses = socket.getaddrinfo(parts.hostname, port, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError):
+        return f"callback_url host '{parts.hostname}' does not resolve"
+    for *_, sockaddr in addresses:
+        address = ipaddress.ip_address(sockaddr[0].split("%")[0])
+        if not address.is_global or address.is_multicast:
+            return f"callback_url host '{parts.hostname}' resolves to a non-public address"
+    return None
+
+def ai_job_view(job: dict, with_result: bool = False) -> dict:
+    """A job as returned to its owner (timestamps as ISO strings)"""
+    def iso(timestamp):
+        return datetime.fromtimestamp(timestamp, timezone.utc).isoformat() if timestamp else None
+    view = {
+        "id": job["id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "error": job["error"],
+        "submitted_at": iso(job["submitted_at"]),
+        "started_at": iso(job["started_at"]),
+        "finished_at": iso(job["finished_at"]),
+    }
+    if with_result:
+        view["result"] = job["result"]
+    return view
+
+def get_owned_ai_job(job_id: str, current_user: dict) -> dict:
+    job = ai_jobs.backend.get(job_id)
+    if job is None or (job["user_id"] != current_user["id"] and current_user["role"] != "admin"):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return job
+
+@app.post("/api/ai/jobs", status_code=status.HTTP_202_ACCEPTED)
+async def submit_ai_job(request: AIJobRequest, current_user: dict = Depends(get_current_user)):
+    """Queue an AI request (any AI_JOB_KINDS route) and return its job id at once"""
+    if not openai_client:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="AI service is not configured. Please contact administrator."
+        )
+    
+    if request.kind not in AI_JOB_KINDS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown job kind '{request.kind}' (expected one of: {', '.join(AI_JOB_KINDS)})"
+        )
+    if request.kind.startswith("generate-quiz") and current_user["role"] not in ["lecturer", "admin"]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only lecturers and administrators can generate quizzes"
+        )
+    ai_usage.check(current_user, request.payload.get("course_id"))
+    if request.callback_url:
+        problem = await asyncio.to_thread(callback_url_problem, request.callback_url)
+        if problem:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=problem)
+    
+    # Reject a bad payload now rather than when the job runs
+    model = AI_JOB_KINDS[request.kind][0]
+    try:
+        model(**request.payload)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+    
+    job = ai_jobs.submit(request.kind, request.payload, current_user, request.callback_url)
+    return {
+        "success": True,
+        "data": ai_job_view(job),
+        "message": "Job queued",
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    }
+
+@app.get("/api/ai/jobs/{job_id}")
+async def get_ai_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    """Status of a job"""
+    return {
+        "success": True,
+        "data": ai_job_view(get_owned_ai_job(job_id, current_user)),
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    }
+
+@app.get("/api/ai/jobs/{job_id}/result")
+async def get_ai_job_result(job_id: str, current_user: dict = Depends(get_current_user)):
+    """What the synchronous route would have answered: its body, or its error status and detail"""
+    job = get_owned_ai_job(job_id, current_user)
+    if job["status"] == "failed":
+        raise HTTPException(status_code=job["error_status"], detail=job["error"])
+    if job["status"] != "succeeded":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Job is {job['status']}",
+            headers={"Retry-After": "1"}
+        )
+    return job["result"]
+
 
 # ===== Entity Routes (HBIU Virtual Campus) =====
 
@@ -802,67 +3811,78 @@ async def explain_concept(request: dict, current_user: dict = Depends(get_curren
 mock_users = []
 mock_courses = []
 
-# Generic entity storage (in-memory for now - replace with database)
-entity_store = {
-    "User": [],
-    "Course": [],
-    "Enrollment": [],
-    "Assignment": [],
-    "College": [],
-    "Module": [],
-    "Announcement": [],
-    "Quiz": [],
-    "Submission": [],
-    "SystemSetting": [],
-    "StaffApplication": [],
-    "UniversityAnnouncement": [],
-    "Notification": [],
-    "InternalMessage": [],
-    "Document": [],
-    "DocumentVersion": [],
-    "CollegeTransferHistory": [],
-    "AuditLog": [],
-    "EmployeeRecord": [],
-    "LeaveRequest": [],
-    "PerformanceReview": [],
-    "PayrollRecord": [],
-    "CommunityGroup": [],
-    "CommunityMember": [],
-    "CommunityPost": [],
-    "SystemAccess": [],
-}
+def ensure_public_entity(entity: str):
+    """Internal collections (e.g. user accounts) are not part of the entity API"""
+    if entity.startswith("_"):
+        raise HTTPException(
+            status_code=404,
+            detail=f"Unknown entity {entity}"
+        )
+
+def new_entity_record(data: dict) -> dict:
+    """Fill in the defaults of a record about to be created"""
+    # Add timestamps if not present
+    if 'created_at' not in data and 'createdAt' not in data:
+        data['created_at'] = datetime.now(timezone.utc).isoformat()
+    return data
+
+def merge_entity_record(item: dict, data: dict) -> dict:
+    """Apply an update on top of a stored record"""
+    # Merge data (the id is the primary key and cannot be changed)
+    updated = {**item, **data, 'id': item['id']}
+    
+    # Add updated timestamp
+    if 'updated_at' not in updated and 'updatedAt' not in updated:
+        updated['updated_at'] = datetime.now(timezone.utc).isoformat()
+    return updated
+
+def encode_cursor(sort: str, record: dict) -> str:
+    """Opaque keyset cursor pointing just after record in the given sort order"""
+    sort_field = sort[1:] if sort.startswith('-') else sort
+    payload = json.dumps([sort, record.get(sort_field), record.get('id')], default=str)
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor: str, sort: str):
+    """Turn a cursor back into the (sort value, id) position it points after"""
+    try:
+        cursor_sort, value, entity_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+    if cursor_sort != sort:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Cursor was issued for a different sort order"
+        )
+    return (value, entity_id)
 
-def get_entity_store(entity_name: str):
-    """Get or create entity store"""
-    if entity_name not in entity_store:
-        entity_store[entity_name] = []
-    return entity_store[entity_name]
+def paginate(page: List[dict], limit: int, sort: str):
+    """Split a page fetched with one look-ahead record into (data, next_cursor)"""
+    result = page[:limit]
+    if len(page) > limit > 0:
+        return result, encode_cursor(sort, result[-1])
+    return result, None
 
 @app.get("/api/entities/{entity}")
-async def list_entities(entity: str, sort: str = "-created_at", limit: int = 100):
-    """Entity API - List all entities"""
+async def list_entities(entity: str, sort: str = "-created_at", limit: int = Query(100, ge=0), after: Optional[str] = None):
+    """Entity API - List all entities (pass next_cursor back as `after` for the next page)"""
+    ensure_public_entity(entity)
+    cursor = decode_cursor(after, sort) if after else None
     try:
-        store = get_entity_store(entity)
-        
         # Parse sort (Base44 uses '-field' for DESC)
         reverse = sort.startswith('-')
         sort_field = sort[1:] if reverse else sort
         
-        # Sort if possible
-        try:
-            if sort_field in ['created_at', 'createdAt', 'id']:
-                sorted_data = sorted(store, key=lambda x: x.get(sort_field, x.get('id', 0)), reverse=reverse)
-            else:
-                sorted_data = store
-        except:
-            sorted_data = store
-        
-        # Apply limit
-        result = sorted_data[:limit]
+        # Served from an ordered index: O(log n + limit) for any page
+        page = storage.list(entity, sort_field, reverse, limit + 1, cursor)
+        result, next_cursor = paginate(page, limit, sort)
         
         return {
             "success": True,
             "data": result,
+            "next_cursor": next_cursor,
             "timestamp": datetime.now(timezone.utc).isoformat()
         }
     except Exception as e:
@@ -873,14 +3893,82 @@ async def list_entities(entity: str, sort: str = "-created_at", limit: int = 100
             "timestamp": datetime.now(timezone.utc).isoformat()
         }
 
+def export_ndjson(records: Iterator[dict]):
+    """Yield NDJSON in chunks of EXPORT_CHUNK_SIZE records"""
+    while True:
+        chunk = list(islice(records, EXPORT_CHUNK_SIZE))
+        if not chunk:
+            return
+        yield "".join(json.dumps(item, default=str) + "\n" for item in chunk)
+
+def export_csv(records: Iterator[dict], fields: Optional[List[str]]):
+    """Yield CSV in chunks of EXPORT_CHUNK_SIZE records.
+    
+    Without explicit fields the header is taken from the keys of the first
+    chunk. Nested values are written as JSON.
+    """
+    chunk = list(islice(records, EXPORT_CHUNK_SIZE))
+    if not fields:
+        fields = list(dict.fromkeys(key for item in chunk for key in item))
+    
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction="ignore")
+    writer.writeheader()
+    while chunk:
+        for item in chunk:
+            writer.writerow({
+                key: json.dumps(value) if isinstance(value, (dict, list)) else value
+                for key, value in item.items()
+            })
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        chunk = list(islice(records, EXPORT_CHUNK_SIZE))
+
+@app.get("/api/entities/{entity}/export")
+async def export_entities(entity: str, format: str = "ndjson", filters: Optional[str] = None, fields: Optional[str] = None):
+    """Entity API - Stream a whole collection as NDJSON or CSV.
+    
+    `filters` is a JSON object with the same meaning as the filter route's
+    body; `fields` is a comma-separated CSV column list.
+    """
+    ensure_public_entity(entity)
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="format must be 'ndjson' or 'csv'"
+        )
+    try:
+        filter_values = json.loads(filters) if filters else {}
+    except json.JSONDecodeError:
+        filter_values = None
+    if not isinstance(filter_values, dict):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="filters must be a JSON object"
+        )
+    
+    records = storage.scan(entity, filter_values)
+    if format == "csv":
+        body = export_csv(records, fields.split(",") if fields else None)
+        media_type = "text/csv"
+    else:
+        body = export_ndjson(records)
+        media_type = "application/x-ndjson"
+    
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{entity}.{format}"'}
+    )
+
 @app.get("/api/entities/{entity}/{entity_id}")
 async def get_entity(entity: str, entity_id: int):
     """Entity API - Get single entity"""
+    ensure_public_entity(entity)
     try:
-        store = get_entity_store(entity)
-        
         # Find entity by ID
-        found = next((item for item in store if item.get('id') == entity_id), None)
+        found = storage.get(entity, entity_id)
         
         if not found:
             raise HTTPException(
@@ -904,41 +3992,23 @@ async def get_entity(entity: str, entity_id: int):
         }
 
 @app.post("/api/entities/{entity}/filter")
-async def filter_entities(entity: str, filters: dict, sort: str = "-created_at", limit: int = 100):
+async def filter_entities(entity: str, filters: dict, sort: str = "-created_at", limit: int = Query(100, ge=0), after: Optional[str] = None):
     """Entity API - Filter entities"""
+    ensure_public_entity(entity)
+    cursor = decode_cursor(after, sort) if after else None
     try:
-        store = get_entity_store(entity)
-        
-        # Apply filters
-        filtered = []
-        for item in store:
-            match = True
-            for key, value in filters.items():
-                if item.get(key) != value:
-                    match = False
-                    break
-            if match:
-                filtered.append(item)
-        
         # Parse sort
         reverse = sort.startswith('-')
         sort_field = sort[1:] if reverse else sort
         
-        # Sort if possible
-        try:
-            if sort_field in ['created_at', 'createdAt', 'id']:
-                sorted_data = sorted(filtered, key=lambda x: x.get(sort_field, x.get('id', 0)), reverse=reverse)
-            else:
-                sorted_data = filtered
-        except:
-            sorted_data = filtered
-        
-        # Apply limit
-        result = sorted_data[:limit]
+        # Equality filters are answered from the storage engine's indexes where possible
+        page = storage.filter(entity, filters, sort_field, reverse, limit + 1, cursor)
+        result, next_cursor = paginate(page, limit, sort)
         
         return {
             "success": True,
             "data": result,
+            "next_cursor": next_cursor,
             "timestamp": datetime.now(timezone.utc).isoformat()
         }
     except Exception as e:
@@ -952,20 +4022,16 @@ async def filter_entities(entity: str, filters: dict, sort: str = "-created_at",
 @app.post("/api/entities/{entity}")
 async def create_entity(entity: str, data: dict):
     """Entity API - Create new entity"""
+    ensure_public_entity(entity)
     try:
-        store = get_entity_store(entity)
-        
-        # Generate ID if not present
-        if 'id' not in data:
-            max_id = max([item.get('id', 0) for item in store], default=0)
-            data['id'] = max_id + 1
-        
-        # Add timestamps if not present
-        if 'created_at' not in data and 'createdAt' not in data:
-            data['created_at'] = datetime.now(timezone.utc).isoformat()
-        
-        # Add to store
-        store.append(data)
+        # Add to store (generates the ID if not present)
+        try:
+            storage.insert(entity, new_entity_record(data))
+        except DuplicateEntityError:
+            raise HTTPException(
+                status_code=409,
+                detail=f"{entity} with id {data['id']} already exists"
+            )
         
         return {
             "success": True,
@@ -973,6 +4039,8 @@ async def create_entity(entity: str, data: dict):
             "message": f"{entity} created successfully",
             "timestamp": datetime.now(timezone.utc).isoformat()
         }
+    except HTTPException:
+        raise
     except Exception as e:
         return {
             "success": False,
@@ -984,30 +4052,24 @@ async def create_entity(entity: str, data: dict):
 @app.put("/api/entities/{entity}/{entity_id}")
 async def update_entity(entity: str, entity_id: int, data: dict):
     """Entity API - Update entity"""
+    ensure_public_entity(entity)
     try:
-        store = get_entity_store(entity)
-        
         # Find and update entity
-        for i, item in enumerate(store):
-            if item.get('id') == entity_id:
-                # Merge data
-                store[i] = {**item, **data}
-                
-                # Add updated timestamp
-                if 'updated_at' not in store[i] and 'updatedAt' not in store[i]:
-                    store[i]['updated_at'] = datetime.now(timezone.utc).isoformat()
-                
-                return {
-                    "success": True,
-                    "data": store[i],
-                    "message": f"{entity} updated successfully",
-                    "timestamp": datetime.now(timezone.utc).isoformat()
-                }
+        item = storage.get(entity, entity_id)
+        if item is None:
+            raise HTTPException(
+                status_code=404,
+                detail=f"{entity} with id {entity_id} not found"
+            )
         
-        raise HTTPException(
-            status_code=404,
-            detail=f"{entity} with id {entity_id} not found"
-        )
+        updated = storage.replace(entity, entity_id, merge_entity_record(item, data))
+        
+        return {
+            "success": True,
+            "data": updated,
+            "message": f"{entity} updated successfully",
+            "timestamp": datetime.now(timezone.utc).isoformat()
+        }
     except HTTPException:
         raise
     except Exception as e:
@@ -1021,24 +4083,21 @@ async def update_entity(entity: str, entity_id: int, data: dict):
 @app.delete("/api/entities/{entity}/{entity_id}")
 async def delete_entity(entity: str, entity_id: int):
     """Entity API - Delete entity"""
+    ensure_public_entity(entity)
     try:
-        store = get_entity_store(entity)
-        
         # Find and remove entity
-        for i, item in enumerate(store):
-            if item.get('id') == entity_id:
-                deleted = store.pop(i)
-                return {
-                    "success": True,
-                    "data": None,
-                    "message": f"{entity} deleted successfully",
-                    "timestamp": datetime.now(timezone.utc).isoformat()
-                }
+        if storage.delete(entity, entity_id) is None:
+            raise HTTPException(
+                status_code=404,
+                detail=f"{entity} with id {entity_id} not found"
+            )
         
-        raise HTTPException(
-            status_code=404,
-            detail=f"{entity} with id {entity_id} not found"
-        )
+        return {
+            "success": True,
+            "data": None,
+            "message": f"{entity} deleted successfully",
+            "timestamp": datetime.now(timezone.utc).isoformat()
+        }
     except HTTPException:
         raise
     except Exception as e:
@@ -1049,6 +4108,102 @@ async def delete_entity(entity: str, entity_id: int):
             "timestamp": datetime.now(timezone.utc).isoformat()
         }
 
+@app.post("/api/entities/{entity}/bulk")
+async def bulk_entities(entity: str, request: BulkEntityRequest):
+    """Entity API - Create, update and delete many entities in one request.
+    
+    Items are applied in order (creates, then updates, then deletes) and each
+    one gets its own result, so one bad item does not fail the batch.
+    """
+    ensure_public_entity(entity)
+    total = len(request.create) + len(request.update) + len(request.delete)
+    if total > ENTITY_BULK_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Bulk requests are limited to {ENTITY_BULK_MAX_ITEMS} items"
+        )
+    
+    def failed(entity_id, error):
+        return {"success": False, "id": entity_id, "error": error}
+    
+    try:
+        created, updated, deleted = [], [], []
+        with storage.batch():
+            for data in request.create:
+                try:
+                    created.append({"success": True, "data": storage.insert(entity, new_entity_record(data))})
+                except DuplicateEntityError:
+                    created.append(failed(data['id'], f"{entity} with id {data['id']} already exists"))
+                except Exception as e:
+                    created.append(failed(data.get('id'), str(e)))
+            
+            for data in request.update:
+                entity_id = data.get('id')
+                try:
+                    item = storage.get(entity, entity_id)
+                    if item is None:
+                        updated.append(failed(entity_id, f"{entity} with id {entity_id} not found"))
+                    else:
+                        updated.append({"success": True, "data": storage.replace(entity, entity_id, merge_entity_record(item, data))})
+                except Exception as e:
+                    updated.append(failed(entity_id, str(e)))
+            
+            for entity_id in request.delete:
+                try:
+                    if storage.delete(entity, entity_id) is None:
+                        deleted.append(failed(entity_id, f"{entity} with id {entity_id} not found"))
+                    else:
+                        deleted.append({"success": True, "id": entity_id})
+                except Exception as e:
+                    deleted.append(failed(entity_id, str(e)))
+        
+        return {
+            "success": True,
+            "data": {
+                "created": created,
+                "updated": updated,
+                "deleted": deleted
+            },
+            "message": f"{entity} bulk request applied",
+            "timestamp": datetime.now(timezone.utc).isoformat()
+        }
+    except Exception as e:
+        return {
+            "success": False,
+            "message": f"Failed to apply {entity} bulk request",
+            "error": str(e),
+            "timestamp": datetime.now(timezone.utc).isoformat()
+        }
+
+
+# ===== Metrics =====
+
+@app.get("/api/metrics")
+async def get_metrics(current_user: dict = Depends(get_current_user)):
+    """Operational counters for the in-process caches and indexes (admin only)"""
+    if current_user["role"] != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions"
+        )
+    
+    return {
+        "entity_indexes": storage.index_metrics(),
+        "write_log": storage.log_metrics() if isinstance(storage, LoggedMemoryStorageEngine) else None,
+        "password_pool": password_pool.metrics(),
+        "token_cache": token_cache.metrics(),
+        "refresh_tokens": refresh_stats,
+        "auth_rate_limits": auth_rate_limiter.metrics(),
+        "ai_calls": {"max_concurrency": AI_MAX_CONCURRENCY, "timeout_seconds": AI_TIMEOUT_SECONDS,
+                     "deadlines": AI_ENDPOINT_DEADLINES, "max_retries": AI_MAX_RETRIES, **ai_stats},
+        "ai_breaker": ai_breaker.metrics(),
+        "ai_cache": ai_cache.metrics(),
+        "ai_single_flight": single_flight_metrics(),
+        "ai_jobs": ai_jobs.metrics(),
+        "ai_usage": ai_usage.metrics(),
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    }
+
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 8000))
@@ -2,14 +2,20 @@
 """
 AI Test Script for HBIU University Backend
 Test various AI endpoints and functionalities
+
+Usage:
+    python3 test_ai.py [base_url]
+
+Without an OpenAI key, run the backend against fake_llm_server.py (see its docstring).
 """
 
+import sys
 import requests
 import json
 from typing import Dict, Any
 
 # Configuration
-BASE_URL = "http://localhost:8001"
+BASE_URL = sys.argv[1] if len(sys.argv) > 1 else "http://localhost:8001"
 
 def login_user(username: str, password: str) -> Dict[str, Any]:
     """Login and get authentication token"""
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+AI concurrency test for HBIU University Backend
+Starts a fake LLM server and the backend pointed at it, fires 50 concurrent
+AI requests and checks that /api/courses keeps answering quickly meanwhile
+
+Usage:
+    python3 test_ai_concurrency.py
+"""
+
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import requests
+
+from fake_llm_server import start_server
+
+# Configuration
+FAKE_LLM_PORT = 8101
+BACKEND_PORT = 8102
+BASE_URL = f"http://127.0.0.1:{BACKEND_PORT}"
+CONCURRENT_AI_REQUESTS = 50
+FAKE_LATENCY = 2.0  # seconds per completion
+MAX_COURSES_P95_MS = 250
+
+def start_backend() -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY="fake",
+        OPENAI_BASE_URL=f"http://127.0.0.1:{FAKE_LLM_PORT}/v1",
+    )
+    backend = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(BACKEND_PORT), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+    )
+    for _ in range(100):
+        try:
+            requests.get(f"{BASE_URL}/", timeout=1)
+            return backend
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    backend.kill()
+    raise RuntimeError("Backend did not start")
+
+def login(username: str, password: str) -> str:
+    response = requests.post(f"{BASE_URL}/api/auth/login", json={"username": username, "password": password})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+def ask_study_assistant(headers: dict, i: int) -> int:
+    response = requests.post(
+        f"{BASE_URL}/api/ai/study-assistant",
+        json={"question": f"Question {i}: what is recursion?"},
+        headers=headers,
+        timeout=120,
+    )
+    return response.status_code
+
+def probe_courses(headers: dict, stop: threading.Event, samples: List[float]) -> None:
+    with requests.Session() as session:
+        while not stop.is_set():
+            start = time.perf_counter()
+            session.get(f"{BASE_URL}/api/courses", headers=headers, timeout=30).raise_for_status()
+            samples.append((time.perf_counter() - start) * 1000)
+            time.sleep(0.02)
+
+def test_ai_requests_do_not_block_courses() -> bool:
+    headers = {"Authorization": f"Bearer {login('admin', 'admin123')}"}
+
+    samples: List[float] = []
+    stop = threading.Event()
+    prober = threading.Thread(target=probe_courses, args=(headers, stop, samples))
+    prober.start()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=CONCURRENT_AI_REQUESTS) as executor:
+        codes = list(executor.map(lambda i: ask_study_assistant(headers, i), range(CONCURRENT_AI_REQUESTS)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    prober.join()
+
+    samples.sort()
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(f"   {CONCURRENT_AI_REQUESTS} AI requests finished in {elapsed:.1f}s "
+          f"({codes.count(200)} x 200)")
+    print(f"   /api/courses during the burst: {len(samples)} probes, "
+          f"p50 {samples[len(samples) // 2]:.1f} ms, p95 {p95:.1f} ms, max {samples[-1]:.1f} ms")
+
+    if codes.count(200) != CONCURRENT_AI_REQUESTS:
+        print(f"❌ Some AI requests failed: {codes}")
+        return False
+    if p95 > MAX_COURSES_P95_MS:
+        print(f"❌ /api/courses stalled (p95 above {MAX_COURSES_P95_MS} ms)")
+        return False
+    print("✅ /api/courses stayed responsive during the AI burst")
+    return True
+
+def main():
+    print("🧪 AI concurrency test")
+    fake_llm = start_server(FAKE_LLM_PORT, FAKE_LATENCY)
+    backend = start_backend()
+    try:
+        passed = test_ai_requests_do_not_block_courses()
+    finally:
+        backend.terminate()
+        backend.wait()
+        fake_llm.shutdown()
+    sys.exit(0 if passed else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+AI resilience test for HBIU University Backend
+Drives call_upstream directly (no server needed) and checks that the circuit
+breaker only judges requests that reached OpenAI: waiting for one of our own
+AI_MAX_CONCURRENCY slots must never count as an OpenAI success or failure.
+
+Usage:
+    python3 test_ai_resilience.py
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+from openai import APIConnectionError
+
+os.environ["AI_MAX_CONCURRENCY"] = "2"
+import main
+
+def reset(**breaker_settings) -> None:
+    main.ai_breaker = main.CircuitBreaker(**breaker_settings)
+    main.ai_semaphore = asyncio.Semaphore(main.AI_MAX_CONCURRENCY)
+    for key in main.ai_stats:
+        main.ai_stats[key] = 0
+
+async def late_slot_call(upstream_calls: list) -> str:
+    """call_upstream whose slot is granted 10 ms after the deadline"""
+    original = main.acquire_ai_slot
+
+    async def acquire_late(timeout=None):
+        await asyncio.sleep(timeout + 0.01)
+        await original()
+
+    async def make_call(remaining):
+        upstream_calls.append(remaining)
+        return "answer"
+
+    main.acquire_ai_slot = acquire_late
+    try:
+        await main.call_upstream(make_call, timeout=0.1)
+        return "answered"
+    except main.AIUnavailableError as e:
+        return e.detail
+    finally:
+        main.acquire_ai_slot = original
+
+async def test_late_slot_in_half_open() -> bool:
+    reset(cooldown=0)
+    main.ai_breaker.open()  # cooldown 0: the next call is the half-open probe
+    upstream_calls = []
+    detail = await late_slot_call(upstream_calls)
+    state = main.ai_breaker.state
+    print(f"   half-open, slot 10 ms late: {detail!r}, breaker {state}, "
+          f"{len(upstream_calls)} upstream calls, failed {main.ai_stats['failed']}")
+    if upstream_calls or "busy" not in detail:
+        print("❌ A late slot should answer busy without calling OpenAI")
+        return False
+    if state != "half_open" or main.ai_breaker.probing:
+        print("❌ A late slot must not decide the half-open probe")
+        return False
+    if main.ai_stats["failed"]:
+        print("❌ A busy answer is not a failed OpenAI call")
+        return False
+    return True
+
+async def test_late_slot_in_closed() -> bool:
+    reset()
+    detail = await late_slot_call([])
+    recorded = len(main.ai_breaker.outcomes)
+    print(f"   closed, slot 10 ms late: {detail!r}, {recorded} outcomes recorded")
+    if recorded:
+        print("❌ A late slot must not add to the breaker's failure-rate window")
+        return False
+    return True
+
+async def test_slow_error_then_hang() -> bool:
+    """An attempt that errors after most of the deadline, then one that hangs: both are OpenAI's fault"""
+    reset(min_calls=100)
+    attempts = []
+
+    async def make_call(remaining):
+        attempts.append(remaining)
+        if len(attempts) == 1:
+            await asyncio.sleep(remaining * 0.6)
+            raise APIConnectionError(request=None)
+        await asyncio.sleep(3600)
+
+    original_base = main.AI_RETRY_BASE_SECONDS
+    main.AI_RETRY_BASE_SECONDS = 0.01
+    try:
+        await main.call_upstream(make_call, timeout=1.0)
+        detail = "answered"
+    except main.AIUnavailableError as e:
+        detail = e.detail
+    finally:
+        main.AI_RETRY_BASE_SECONDS = original_base
+    outcomes = list(main.ai_breaker.outcomes)
+    print(f"   slow error then hang: {detail!r}, outcomes {outcomes}, timeouts {main.ai_stats['timeouts']}")
+    if outcomes != [True, True] or "busy" in detail:
+        print("❌ The hang after a slow error should count as an OpenAI timeout")
+        return False
+    return True
+
+async def test_queueing_keeps_breaker_closed() -> bool:
+    """12 calls of 1 s against 2 slots and a 2.5 s deadline: healthy OpenAI, overloaded us"""
+    reset(min_calls=4)
+
+    async def make_call(remaining):
+        await asyncio.sleep(1.0)
+        return "answer"
+
+    async def call():
+        try:
+            return await main.call_upstream(make_call, timeout=2.5)
+        except main.AIUnavailableError as e:
+            return e.detail
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(call() for _ in range(12)))
+    print(f"   12 calls, 2 slots, 2.5s deadline: {results.count('answer')} answered, "
+          f"{sum('busy' in r for r in results)} busy in {time.perf_counter() - start:.1f}s, "
+          f"breaker {main.ai_breaker.state}")
+    if main.ai_breaker.state != "closed" or any(main.ai_breaker.outcomes):
+        print("❌ Queueing behind our own calls opened the breaker")
+        return False
+    return True
+
+async def run_tests() -> bool:
+    results = [
+        await test_late_slot_in_half_open(),
+        await test_late_slot_in_closed(),
+        await test_slow_error_then_hang(),
+        await test_queueing_keeps_breaker_closed(),
+    ]
+    return all(results)
+
+def main_test():
+    print("🧪 AI resilience test")
+    passed = asyncio.run(run_tests())
+    print("✅ The circuit breaker only judged requests that reached OpenAI" if passed else "❌ AI resilience test failed")
+    sys.exit(0 if passed else 1)
+
+if __name__ == "__main__":
+    main_test()